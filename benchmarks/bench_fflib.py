@@ -0,0 +1,234 @@
+'''
+    Benchmarks for the fflib read, write and time conversion hot paths
+
+    Synthetic flat files are generated with ff_writer for every combination
+    of row and column counts, then each operation is timed in a separate
+    process so its peak memory usage can be measured. Results are printed
+    and saved to a JSON file that can be compared against a previous run:
+
+        python benchmarks/bench_fflib.py --rows 1e4 1e6 --cols 3 100
+        python benchmarks/bench_fflib.py --compare old_results.json
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+
+repo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, repo_path)
+
+from fflib import ff_reader, ff_writer, ff_time
+from fflib.ff_lib import ff_header
+
+epoch = 'J2000'
+
+def write_file(name, rows, cols, chunk_size=1000000):
+    ''' Writes a synthetic flat file in chunks to bound memory usage '''
+    rng = np.random.RandomState(0)
+    ff = ff_writer(name)
+    ff.set_epoch(epoch)
+    ff.set_labels([f'C{i}' for i in range(cols)])
+    for a in range(0, rows, chunk_size):
+        n = min(chunk_size, rows - a)
+        times = 6e8 + (np.arange(a, a + n) * 0.125)
+        ff.append(times, rng.normal(size=(n, cols)))
+    ff.close()
+
+def data_bytes(name):
+    return os.path.getsize(f'{name}.ffd')
+
+# Each benchmark returns the number of rows and bytes it processed
+def bench_header(name, rows, repeat=100):
+    for i in range(repeat):
+        ff_header(name)
+    return (repeat, os.path.getsize(f'{name}.ffh') * repeat)
+
+def bench_read_data(name, rows):
+    ff_reader(name)._read_data()
+    return (rows, data_bytes(name))
+
+def bench_data_table(name, rows):
+    ff_reader(name).get_data_table()
+    return (rows, data_bytes(name))
+
+def bench_to_csv(name, rows):
+    ff_reader(name).to_csv(f'{name}_out')
+    return (rows, os.path.getsize(f'{name}_out.csv'))
+
+def bench_write(name, rows):
+    ff = ff_reader(name)
+    data = ff.get_data(include_times=True)
+    out = ff_writer(f'{name}_out', copy_header=name)
+    out.set_data(data[:,0], data[:,1:])
+
+    t0 = time.perf_counter()
+    out.write()
+    return (rows, data_bytes(f'{name}_out'), time.perf_counter() - t0)
+
+def bench_ticks_to_dates(name, rows):
+    times = ff_reader(name).get_times()
+
+    t0 = time.perf_counter()
+    ff_time.ticks_to_dates(times, epoch)
+    return (rows, times.nbytes, time.perf_counter() - t0)
+
+def bench_ticks_to_iso(name, rows):
+    times = ff_reader(name).get_times()
+
+    t0 = time.perf_counter()
+    ff_time.ticks_to_iso(times, epoch)
+    return (rows, times.nbytes, time.perf_counter() - t0)
+
+def bench_dates_to_ticks(name, rows):
+    dates = ff_time.ticks_to_dates(ff_reader(name).get_times(), epoch)
+
+    t0 = time.perf_counter()
+    ff_time.dates_to_ticks(dates, epoch)
+    return (rows, len(dates) * 8, time.perf_counter() - t0)
+
+benchmarks = {
+    'header' : bench_header,
+    'read_data' : bench_read_data,
+    'get_data_table' : bench_data_table,
+    'to_csv' : bench_to_csv,
+    'write' : bench_write,
+    'ticks_to_dates' : bench_ticks_to_dates,
+    'ticks_to_iso' : bench_ticks_to_iso,
+    'dates_to_ticks' : bench_dates_to_ticks,
+}
+
+# Operations that go through Python objects per row are limited to
+# files with at most this many rows unless --no-limit is given
+slow_ops = ['to_csv', 'ticks_to_dates', 'ticks_to_iso', 'dates_to_ticks']
+slow_row_limit = 10**6
+
+def peak_rss_mb():
+    ''' Returns the peak resident set size of this process in MB '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return rss * scale / 1e6
+
+def run_case(op, name, rows, queue):
+    ''' Runs a single benchmark and puts its results on the queue '''
+    base_rss = peak_rss_mb()
+    t0 = time.perf_counter()
+    result = benchmarks[op](name, rows)
+    elapsed = time.perf_counter() - t0
+
+    # Some benchmarks only time part of the work they do
+    if len(result) == 3:
+        elapsed = result[2]
+    queue.put((result[0], result[1], elapsed, peak_rss_mb(), base_rss))
+
+def run_isolated(op, name, rows):
+    ''' Runs a benchmark in a new process so peak memory is per operation '''
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=run_case, args=(op, name, rows, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def write_isolated(name, rows, cols):
+    ''' Generates a test file in a new process; Linux keeps the peak RSS
+        of a parent process across fork/exec, so the parent has to stay
+        small for the per-operation measurements to be meaningful
+    '''
+    ctx = multiprocessing.get_context('spawn')
+    proc = ctx.Process(target=write_file, args=(name, rows, cols))
+    proc.start()
+    proc.join()
+
+def format_row(item):
+    return (f'{item["op"]:<16} {item["rows"]:>11} {item["cols"]:>5} '
+        f'{item["seconds"]:>10.4f} {item["rows_per_s"]:>14.4g} '
+        f'{item["mb_per_s"]:>10.2f} {item["peak_rss_mb"]:>10.1f}')
+
+def compare(results, path):
+    ''' Prints the speedup of each result relative to a previous run '''
+    with open(path, 'r') as fd:
+        prev = json.load(fd)
+
+    key = lambda item : (item['op'], item['rows'], item['cols'])
+    prev_items = {key(item):item for item in prev['results']}
+    print (f'\nCompared to {path} (version {prev.get("version")})')
+    for item in results:
+        if key(item) not in prev_items:
+            continue
+        old = prev_items[key(item)]
+        speedup = old['seconds'] / item['seconds'] if item['seconds'] else np.inf
+        mem = item['peak_rss_mb'] - old['peak_rss_mb']
+        print (f'{item["op"]:<16} {item["rows"]:>11} {item["cols"]:>5} '
+            f'{speedup:>8.2f}x speed {mem:>+10.1f} MB peak')
+
+def get_version():
+    with open(os.path.join(repo_path, 'version.txt'), 'r') as fd:
+        return fd.read().strip()
+
+def main():
+    parser = argparse.ArgumentParser(description='fflib benchmarks')
+    parser.add_argument('--rows', nargs='+', type=float, default=[1e4, 1e5, 1e6])
+    parser.add_argument('--cols', nargs='+', type=int, default=[3, 10, 100])
+    parser.add_argument('--ops', nargs='+', choices=list(benchmarks),
+        default=list(benchmarks))
+    parser.add_argument('--dir', default=None, help='directory for test files')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', default=None, help='previous results JSON')
+    parser.add_argument('--no-limit', action='store_true',
+        help=f'run per-row Python operations on files > {slow_row_limit} rows')
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory(dir=args.dir)
+    results = []
+    print (f'{"Operation":<16} {"Rows":>11} {"Cols":>5} {"Seconds":>10} '
+        f'{"Rows/s":>14} {"MB/s":>10} {"Peak MB":>10}')
+    for rows in [int(n) for n in args.rows]:
+        for cols in args.cols:
+            name = os.path.join(tmp.name, f'bench_{rows}_{cols}')
+            write_isolated(name, rows, cols)
+            for op in args.ops:
+                if op in slow_ops and rows > slow_row_limit and not args.no_limit:
+                    continue
+
+                n, nbytes, seconds, peak, base = run_isolated(op, name, rows)
+                item = {
+                    'op' : op,
+                    'rows' : rows,
+                    'cols' : cols,
+                    'seconds' : seconds,
+                    'rows_per_s' : n / seconds if seconds else None,
+                    'mb_per_s' : nbytes / seconds / 1e6 if seconds else None,
+                    'peak_rss_mb' : peak,
+                    'base_rss_mb' : base,
+                }
+                results.append(item)
+                print (format_row(item))
+
+            # Remove files for this size before generating the next one
+            for path in os.listdir(tmp.name):
+                os.remove(os.path.join(tmp.name, path))
+
+    info = {
+        'version' : get_version(),
+        'date' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python' : platform.python_version(),
+        'numpy' : np.__version__,
+        'platform' : platform.platform(),
+        'results' : results,
+    }
+    with open(args.output, 'w') as fd:
+        json.dump(info, fd, indent=1)
+    print (f'Saved results to {args.output}')
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+'''
+    Measures the time to import fflib modules in a fresh interpreter,
+    relative to importing numpy alone, since the fflist/ff2csv entry
+    points are started once per file from shell pipelines
+
+        python benchmarks/bench_import.py --repeat 20 --max-ms 30
+'''
+import argparse
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+repo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+statements = {
+    'python' : 'pass',
+    'numpy' : 'import numpy',
+    'fflib.ff_lib' : 'import fflib.ff_lib',
+    'fflib.ff_util' : 'import fflib.ff_util',
+    'fflib.ff_time' : 'import fflib.ff_time',
+}
+
+def time_import(statement, repeat):
+    ''' Returns the median wall time in seconds to run the statement
+        in a new interpreter
+    '''
+    env = dict(os.environ, PYTHONPATH=repo_path)
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', statement], env=env)
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times))
+
+def main():
+    parser = argparse.ArgumentParser(description='fflib import time benchmark')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, default=None,
+        help='exit with an error if fflib.ff_util takes longer than this '
+        'many milliseconds to import on top of numpy')
+    args = parser.parse_args()
+
+    results = {name:time_import(stmt, args.repeat) for name, stmt in statements.items()}
+    for name, seconds in results.items():
+        extra = (seconds - results['numpy']) * 1000
+        print (f'{name:<16} {seconds*1000:8.1f} ms ({extra:+7.1f} ms vs numpy)')
+
+    overhead = (results['fflib.ff_util'] - results['numpy']) * 1000
+    if args.max_ms is not None and overhead > args.max_ms:
+        print (f'fflib.ff_util import overhead {overhead:.1f} ms > {args.max_ms} ms')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
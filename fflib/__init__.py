@@ -1 +1,18 @@
-from .ff_lib import ff_reader, ff_writer
\ No newline at end of file
+from .ff_lib import ff_reader, ff_writer
+from .ff_resample import ff_resample
+from .ff_compress import ff_compress, ff_decompress
+from .ff_ops import ff_extract, ff_concat
+from .ff_profile import set_profiler
+from .ff_pool import ff_reader_pool, get_reader
+from .ff_pipeline import ff_pipeline
+
+# Loaded on first use, since their dependencies slow down importing fflib
+_lazy = {'ff_shared_cache':'ff_shared', 'query':'ff_query'}
+
+def __getattr__(name):
+    if name in _lazy:
+        from importlib import import_module
+        value = getattr(import_module(f'.{_lazy[name]}', __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,80 @@
+import asyncio
+from functools import partial
+from .ff_lib import ff_reader
+
+class ff_async_reader():
+    '''
+        Asyncio wrapper around ff_reader for use in event loop based
+        servers; file I/O and decoding run in an executor so the event
+        loop is never blocked, with at most max_concurrency operations
+        in flight per reader
+
+        Usage:
+            ff = await ff_async_reader.open(name)
+            times, data = await ff.read_range(start, stop, columns)
+            async for times, data in ff.iter_chunks():
+                ...
+    '''
+    def __init__(self, reader, max_concurrency=4, executor=None):
+        '''
+            Requires an ff_reader created with thread_safe=True, since
+            several executor threads may use it at once; Use
+            ff_async_reader.open() to read the header without blocking
+            the event loop
+
+            Optional executor argument specifies a concurrent.futures
+            executor to run blocking calls in (defaults to the event
+            loop's default executor)
+        '''
+        if reader._lock is None:
+            raise Exception('Error: ff_async_reader requires an ff_reader '
+                'created with thread_safe=True')
+
+        self.reader = reader
+        self.executor = executor
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def __str__(self):
+        return f'Async Flat File: {self.reader.name}'
+
+    @classmethod
+    async def open(cls, name, max_concurrency=4, executor=None):
+        ''' Opens a flat file, reading its header in the executor '''
+        loop = asyncio.get_running_loop()
+        reader = await loop.run_in_executor(executor, 
+            partial(ff_reader, name, thread_safe=True))
+        return cls(reader, max_concurrency, executor)
+
+    async def _run(self, func, *args):
+        ''' Runs a blocking call in the executor once a slot is free '''
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(func, *args))
+
+    async def read_range(self, start=None, stop=None, columns=None):
+        ''' Returns (times, data) for the records w/ time ticks in
+            [start, stop]; See ff_reader.read_range for additional info
+        '''
+        return await self._run(self.reader.read_range, start, stop, columns)
+
+    async def iter_chunks(self, chunk_size=65536, start=None, stop=None,
+        columns=None):
+        ''' Asynchronously iterates over (times, data) chunks of records;
+            See ff_reader.iter_chunks for additional info
+        '''
+        labels = self.reader._column_labels(columns)
+        i0, i1 = await self._run(self.reader._row_range, start, stop)
+        for a in range(i0, i1, chunk_size):
+            b = min(a + chunk_size, i1)
+            yield await self._run(self.reader._read_rows, a, b, labels)
+
+    async def get_data(self, include_times=False):
+        ''' Returns the full data array; See ff_reader.get_data '''
+        return await self._run(self.reader.get_data, include_times)
+
+    async def get_times(self, fmt='ticks'):
+        ''' Returns the time array; See ff_reader.get_times '''
+        return await self._run(self.reader.get_times, fmt)
+
+    def close(self):
+        self.reader.close()
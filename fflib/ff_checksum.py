@@ -0,0 +1,148 @@
+'''
+    Checksums for detecting corrupted flat file data
+
+    When enabled with ff_writer.set_checksums(), the CRC32 of each block
+    of block_size bytes of the data file is computed as it is written and
+    saved to a {name}.ffc sidecar file with one line per block:
+
+        offset size crc32
+
+    The header file records the block size and the CRC32 of the whole
+    data file (CHECKSUM BLOCK and DATA CRC keywords), so corruption is
+    detected even if the sidecar file is lost, and the sidecar locates
+    the corrupted blocks.
+'''
+import os
+import zlib
+
+checksum_keys = ['CHECKSUM', 'CHECKSUM BLOCK', 'DATA CRC']
+
+def sidecar_filename(name):
+    return f'{name}.ffc'
+
+class checksum_writer():
+    ''' Wraps a binary file object and computes the CRC32 of each
+        block of block_size bytes written through it
+    '''
+    def __init__(self, fd, block_size=4194304):
+        self.fd = fd
+        self.block_size = int(block_size)
+        self.crc = 0
+        self.size = 0
+        self.blocks = []
+        self._block_crc = 0
+        self._block_used = 0
+        self._block_offset = 0
+
+    def write(self, data):
+        self.fd.write(data)
+        data = memoryview(data).cast('B')
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+
+        # Split data at block boundaries
+        while len(data) > 0:
+            n = min(self.block_size - self._block_used, len(data))
+            self._block_crc = zlib.crc32(data[:n], self._block_crc)
+            self._block_used += n
+            data = data[n:]
+            if self._block_used == self.block_size:
+                self._end_block()
+
+    def _end_block(self):
+        self.blocks.append((self._block_offset, self._block_used, self._block_crc))
+        self._block_offset += self._block_used
+        self._block_crc = 0
+        self._block_used = 0
+
+    def close(self):
+        if self._block_used > 0:
+            self._end_block()
+        self.fd.close()
+
+    def save(self, name, header):
+        ''' Writes the sidecar file and sets the header keywords '''
+        lines = [f'{offset} {size} {crc:08x}\n' for offset, size, crc in self.blocks]
+        with open(sidecar_filename(name), 'w') as fd:
+            fd.writelines(lines)
+
+        header.set_value('CHECKSUM', 'CRC32')
+        header.set_value('CHECKSUM BLOCK', self.block_size)
+        header.set_value('DATA CRC', f'{self.crc:08x}')
+
+def read_sidecar(name):
+    ''' Returns the list of (offset, size, crc) blocks in a sidecar file,
+        or None if there is no sidecar file
+    '''
+    try:
+        with open(sidecar_filename(name), 'r') as fd:
+            lines = fd.readlines()
+    except OSError:
+        return None
+
+    blocks = []
+    for line in lines:
+        offset, size, crc = line.split()
+        blocks.append((int(offset), int(size), int(crc, 16)))
+    return blocks
+
+def file_checksums(filename, block_size, read_size=16777216):
+    ''' Returns the CRC32 of the whole file and of each block, reading
+        the file sequentially in large pieces
+    '''
+    read_size = max(read_size // block_size, 1) * block_size
+    crc = 0
+    crcs = []
+    with open(filename, 'rb', buffering=0) as fd:
+        while True:
+            data = fd.read(read_size)
+            if not data:
+                break
+            data = memoryview(data)
+            crc = zlib.crc32(data, crc)
+            for a in range(0, len(data), block_size):
+                crcs.append(zlib.crc32(data[a:a+block_size]))
+    return (crc, crcs)
+
+def verify(reader):
+    '''
+        Checks a flat file's data file against its checksums
+
+        Parameters:
+        -----------
+        reader: ff_reader
+            Flat file to check
+
+        Returns:
+        --------
+        A list of strings describing each problem found, which is
+        empty if the file is intact; Files without checksums are only
+        checked for truncation
+    '''
+    header = reader.header
+    filename = reader._filename()
+    if not os.path.exists(filename):
+        return [f'Missing data file {filename}']
+
+    if header.get_value('CHECKSUM') is None:
+        if not reader._is_filesize_valid():
+            return ['Data file size does not match NROWS * RECL']
+        return []
+
+    block_size = int(header.get_value('CHECKSUM BLOCK'))
+    blocks = read_sidecar(reader.name)
+    crc, crcs = file_checksums(filename, block_size)
+
+    errors = []
+    if blocks is not None:
+        size = sum([size for offset, size, block_crc in blocks])
+        if os.path.getsize(filename) != size:
+            errors.append(f'Data file is {os.path.getsize(filename)} bytes, expected {size}')
+        for i, (offset, size, block_crc) in enumerate(blocks):
+            if i >= len(crcs) or crcs[i] != block_crc:
+                errors.append(f'Checksum mismatch in bytes {offset} to {offset + size}')
+
+    if f'{crc:08x}' != header.get_value('DATA CRC'):
+        if not errors:
+            errors.append('Checksum mismatch for data file')
+    return errors
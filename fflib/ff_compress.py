@@ -0,0 +1,381 @@
+'''
+    Compressed flat file data (.ffz) layout
+
+    A .ffz file holds the same big-endian records as a .ffd file, split
+    into blocks of a fixed number of records that are compressed
+    independently with zlib or lzma, followed by a block index:
+
+        'FFZ1'
+        compressed block 0, compressed block 1, ...
+        index - one entry per block of (offset, size, rows, first, last)
+            where first/last are the block's first and last time ticks
+        trailer - index offset, number of blocks, method, 'FFZ1'
+
+    All integers are big-endian uint64 and ticks are big-endian float64.
+    Range reads only decompress the blocks they touch, and blocks that
+    are read together are decompressed in parallel.
+'''
+import numpy as np
+import os
+import struct
+import zlib
+from bisect import bisect_left, bisect_right
+from .ff_checksum import checksum_keys
+
+magic = b'FFZ1'
+methods = ['zlib', 'lzma']
+index_dtype = np.dtype([('offset', '>u8'), ('size', '>u8'), ('rows', '>u8'),
+    ('first', '>f8'), ('last', '>f8')])
+trailer_fmt = '>QQ4s4s'
+trailer_size = struct.calcsize(trailer_fmt)
+
+def _compress(data, method, level=None):
+    if method == 'zlib':
+        return zlib.compress(data, -1 if level is None else level)
+    elif method == 'lzma':
+        import lzma
+        return lzma.compress(data, preset=level)
+    raise Exception(f'Error: Unknown compression method {method}')
+
+def _decompress(data, method):
+    if method == 'zlib':
+        return zlib.decompress(data)
+    else:
+        import lzma
+        return lzma.decompress(data)
+
+def _read_at(fd, offset, size):
+    ''' Reads size bytes at offset, without moving the file position
+        where os.pread is available so open files can be shared
+    '''
+    if hasattr(os, 'pread'):
+        return os.pread(fd.fileno(), size, offset)
+    fd.seek(offset)
+    return fd.read(size)
+
+class ffz_writer():
+    ''' Writes binary records to a .ffz file in compressed blocks '''
+    def __init__(self, fd, recl, method='zlib', block_records=65536,
+        level=None):
+        '''
+            Requires the name of the file to write (or a binary file
+            object to write to) and the record length
+
+            Optional method, block_records and level arguments specify
+            the compression method, number of records per block, and the
+            compression level (method default if None)
+        '''
+        if method not in methods:
+            raise Exception(f'Error: Unknown compression method {method}')
+
+        self.recl = recl
+        self.method = method
+        self.block_records = int(block_records)
+        self.level = level
+        self.index = []
+
+        if isinstance(fd, str):
+            try:
+                fd = open(fd, 'wb')
+            except:
+                raise Exception('Error: Could not open data file for writing')
+        self.fd = fd
+        self.fd.write(magic)
+        self._offset = len(magic)
+
+        # Records waiting to fill a block
+        self._data = []
+        self._times = []
+        self._rows = 0
+
+    def write(self, data, times):
+        ''' Adds the binary records in data, whose time ticks are given
+            by times, writing out each block that fills up
+        '''
+        self._data.append(data)
+        self._times.append(np.asarray(times, dtype='f8'))
+        self._rows += len(times)
+        if self._rows >= self.block_records:
+            self._flush(final=False)
+
+    def _flush(self, final):
+        data = b''.join(self._data)
+        times = np.concatenate(self._times)
+        n = len(times)
+
+        a = 0
+        while (n - a >= self.block_records) or (final and a < n):
+            b = min(a + self.block_records, n)
+            self._write_block(data[a*self.recl:b*self.recl], times[a], times[b-1])
+            a = b
+
+        self._data = [data[a*self.recl:]]
+        self._times = [times[a:]]
+        self._rows = n - a
+
+    def _write_block(self, data, first, last):
+        block = _compress(data, self.method, self.level)
+        self.fd.write(block)
+        rows = len(data) // self.recl
+        self.index.append((self._offset, len(block), rows, first, last))
+        self._offset += len(block)
+
+    def close(self):
+        ''' Writes out any remaining records, the block index and trailer '''
+        if self.fd is None:
+            return
+
+        self._flush(final=True)
+        index = np.array(self.index, dtype=index_dtype)
+        self.fd.write(index.tobytes())
+        trailer = struct.pack(trailer_fmt, self._offset, len(index),
+            self.method.encode('ascii'), magic)
+        self.fd.write(trailer)
+        self.fd.close()
+        self.fd = None
+
+class ffz_file():
+    ''' Reads records from a .ffz file using its block index '''
+    def __init__(self, filename, recl, time_loc=0, max_workers=None):
+        '''
+            Requires the name of the file, the record length and the byte
+            offset of the time column within each record
+
+            Optional max_workers argument limits the number of threads
+            used to decompress blocks (defaults to the number of CPUs)
+        '''
+        # File kept open between reads by open()
+        self._fd = None
+        self.filename = filename
+        self.recl = recl
+        self.max_workers = max_workers if max_workers else min(32, os.cpu_count() or 1)
+        self.time_dtype = np.dtype({'names':['t'], 'formats':['>f8'],
+            'offsets':[time_loc], 'itemsize':recl})
+
+        try:
+            with open(filename, 'rb') as fd:
+                fd.seek(-trailer_size, os.SEEK_END)
+                trailer = fd.read(trailer_size)
+                offset, nblocks, method, tag = struct.unpack(trailer_fmt, trailer)
+                if tag != magic:
+                    raise ValueError
+                fd.seek(offset)
+                index = fd.read(nblocks * index_dtype.itemsize)
+        except (OSError, ValueError, struct.error):
+            raise Exception(f'Error: {filename} is not a compressed flat file')
+
+        self.method = method.decode('ascii')
+        self.index = np.frombuffer(index, dtype=index_dtype)
+        rows = self.index['rows'].astype(np.int64)
+        self.starts = np.concatenate([[0], np.cumsum(rows)])
+
+        # Most recently decompressed block, since chunked reads that are
+        # smaller than a block touch the same block repeatedly
+        self._cached = (None, None)
+
+    def open(self):
+        ''' Keeps the file open until close() instead of reopening it
+            for each read
+        '''
+        if self._fd is None:
+            self._fd = open(self.filename, 'rb')
+
+    def close(self):
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    def __del__(self):
+        self.close()
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def num_blocks(self):
+        return len(self.index)
+
+    def tick_range(self):
+        ''' Returns the first and last time tick in the file '''
+        return (float(self.index['first'][0]), float(self.index['last'][-1]))
+
+    def read_blocks(self, blocks):
+        ''' Returns the decompressed bytes of each of the given blocks '''
+        blocks = list(blocks)
+        results = {}
+        cached_block, cached_data = self._cached
+        if cached_block in blocks:
+            results[cached_block] = cached_data
+
+        # Read the compressed blocks from disk in order
+        compressed = []
+        fd = shared = self._fd
+        if fd is None:
+            fd = open(self.filename, 'rb')
+        try:
+            for block in blocks:
+                if block in results:
+                    continue
+                offset = int(self.index['offset'][block])
+                size = int(self.index['size'][block])
+                compressed.append((block, _read_at(fd, offset, size)))
+        finally:
+            if fd is not shared:
+                fd.close()
+
+        # zlib and lzma release the GIL, so threads decompress in parallel
+        decompress = lambda item : _decompress(item[1], self.method)
+        if len(compressed) > 1 and self.max_workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(min(self.max_workers, len(compressed))) as pool:
+                data = list(pool.map(decompress, compressed))
+        else:
+            data = list(map(decompress, compressed))
+        results.update({block:d for (block, _), d in zip(compressed, data)})
+
+        if blocks:
+            self._cached = (blocks[-1], results[blocks[-1]])
+        return [results[block] for block in blocks]
+
+    def read_rows(self, i0, i1):
+        ''' Returns the binary records for rows i0 to i1 '''
+        i0, i1 = max(int(i0), 0), min(int(i1), len(self))
+        if i1 <= i0:
+            return b''
+
+        b0 = int(np.searchsorted(self.starts, i0, 'right')) - 1
+        b1 = int(np.searchsorted(self.starts, i1, 'left'))
+        data = b''.join(self.read_blocks(range(b0, b1)))
+        a = (i0 - int(self.starts[b0])) * self.recl
+        return memoryview(data)[a:a + (i1 - i0) * self.recl]
+
+    def times(self, i0, i1):
+        ''' Returns the time ticks for rows i0 to i1 '''
+        return np.frombuffer(self.read_rows(i0, i1), dtype=self.time_dtype)['t']
+
+    def row_range(self, start=None, stop=None):
+        ''' Returns the (start, stop) row indices of the records with time
+            ticks in [start, stop], decompressing at most two blocks
+        '''
+        n = len(self)
+        i0, i1 = 0, n
+        if start is not None:
+            block = int(np.searchsorted(self.index['last'], start, 'left'))
+            i0 = n
+            if block < self.num_blocks():
+                a, b = self.starts[block:block+2]
+                i0 = int(a) + bisect_left(self.times(a, b), start)
+
+        if stop is not None:
+            block = int(np.searchsorted(self.index['first'], stop, 'right')) - 1
+            i1 = 0
+            if block >= 0:
+                a, b = self.starts[block:block+2]
+                i1 = int(a) + bisect_right(self.times(a, b), stop)
+
+        return (i0, max(i0, i1))
+
+class ffz_records():
+    ''' Array-like view of the records in an ffz_file that decompresses
+        only the rows it is sliced with, in place of a memmap
+    '''
+    def __init__(self, ffz, dtype, field=None):
+        self.ffz = ffz
+        self.dtype = np.dtype(dtype)
+        self.field = field
+
+    def __len__(self):
+        return len(self.ffz)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            i0, i1, step = key.indices(len(self))
+            records = np.frombuffer(self.ffz.read_rows(i0, max(i0, i1)),
+                dtype=self.dtype)[::step]
+        else:
+            row = int(key)
+            row = row + len(self) if row < 0 else row
+            if row < 0 or row >= len(self):
+                raise IndexError('index out of range')
+            records = np.frombuffer(self.ffz.read_rows(row, row+1),
+                dtype=self.dtype)[0]
+
+        return records if self.field is None else records[self.field]
+
+def ff_compress(name, out_name=None, method='zlib', block_records=65536,
+    level=None):
+    '''
+        Writes a compressed copy of the flat file's data to {out_name}.ffz
+        along with a header file, copying records in blocks
+
+        Parameters:
+        -----------
+        name: string
+            Name of the flat file to compress (w/o extension)
+        out_name: string
+            Name of the compressed flat file, defaults to name, in which
+            case the .ffd file is removed once the .ffz file is written
+        method: string
+            'zlib' or 'lzma'
+        block_records: int
+            Number of records per compressed block
+        level: int
+            Compression level, defaults to the method's default
+
+        Note:
+        -----
+        Compressed files can be recompressed with a different method
+        or block size, but only to a new out_name
+    '''
+    from .ff_lib import ff_reader, ff_header
+    out_name = name if out_name is None else out_name
+    in_place = os.path.abspath(out_name) == os.path.abspath(name)
+    reader = ff_reader(name)
+    if reader.compressed and in_place:
+        raise Exception('Error: A compressed file cannot be recompressed in place')
+
+    # Records are decoded from the blocks of compressed files
+    records = reader._memmap_records()
+    times = reader._memmap_times()
+    rows = reader._num_records()
+
+    writer = ffz_writer(f'{out_name}.ffz', reader._record_length(), method,
+        block_records, level)
+    for a in range(0, rows, block_records):
+        b = min(a + block_records, rows)
+        writer.write(records[a:b].tobytes(), times[a:b])
+    writer.close()
+
+    # Readers use the .ffd file while it exists, so it's removed before
+    # the header describing the .ffz file is written
+    header = ff_header(name)
+    if in_place:
+        reader.close()
+        os.remove(f'{name}.ffd')
+    header.set_value('DATA', os.path.basename(out_name) + '.ffz')
+    header.set_value('COMPRESSION', method)
+    header.set_value('BLOCK RECORDS', block_records)
+    for key in checksum_keys:
+        header.keyword_dict.pop(key, None)
+    header.write(out_name)
+
+def ff_decompress(name, out_name=None):
+    '''
+        Writes the records of a compressed flat file out to a standard
+        .ffd file and header file pair named out_name (defaults to name)
+    '''
+    from .ff_lib import ff_reader, ff_header
+    out_name = name if out_name is None else out_name
+    reader = ff_reader(name)
+    ffz = reader._block_file()
+
+    with open(f'{out_name}.ffd', 'wb') as fd:
+        for block in range(ffz.num_blocks()):
+            fd.write(ffz.read_blocks([block])[0])
+
+    header = ff_header(name)
+    header.keyword_dict.pop('COMPRESSION', None)
+    header.keyword_dict.pop('BLOCK RECORDS', None)
+    for key in checksum_keys:
+        header.keyword_dict.pop(key, None)
+    header.set_value('DATA', os.path.basename(out_name) + '.ffd')
+    header.write(out_name)
@@ -1,10 +1,33 @@
 import re
 import struct
+import threading
 import numpy as np
 import os
 from . import ff_time
+from . import ff_profile
+from .ff_stats import ff_stats
+from .ff_table import ff_table
+from .ff_compress import ffz_file, ffz_writer, ffz_records
+from . import ff_checksum
 from datetime import datetime
-from numpy.lib import recfunctions as rfn
+from bisect import bisect_left, bisect_right
+
+def _rfn():
+    ''' Imports numpy.lib.recfunctions on first use, since it imports
+        numpy.ma which noticeably slows down importing fflib
+    '''
+    from numpy.lib import recfunctions
+    return recfunctions
+
+def _optional_import(module, feature):
+    ''' Imports an optional dependency, raising an error naming the
+        feature that needs it if it is not installed
+    '''
+    import importlib
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise Exception(f'Error: {feature} requires {module} to be installed')
 
 class ff_header():
     ''' Internal class for managing flat file header information '''
@@ -12,11 +35,19 @@ class ff_header():
     # col_sections = sections in column desc table
     # col_types = numpy dtype for each column desc section
     # type_map = dict mapping col_sections to col_types
-    pre_col_keys = ['DATA', 'CDATE', 'RECL', 'NCOLS', 'NROWS', 'OPSYS', 'EPOCH']
+    pre_col_keys = ['DATA', 'CDATE', 'RECL', 'NCOLS', 'NROWS', 'OPSYS', 'EPOCH',
+        'COMPRESSION', 'BLOCK RECORDS', 'CHECKSUM', 'CHECKSUM BLOCK', 'DATA CRC']
+    # data_keys = keys describing the data file's layout and contents
+    data_keys = ['DATA', 'RECL', 'NCOLS', 'NROWS', 'COMPRESSION',
+        'BLOCK RECORDS'] + ff_checksum.checksum_keys
     col_sections = ['#', 'NAME', 'UNITS', 'SOURCE', 'TYPE', 'LOC']
     col_types = ['i', 'U72', 'U72', 'U72', 'U72', 'i']
     type_map = {name:dtype for name, dtype in zip(col_sections, col_types)}
 
+    # Maps data types (TYPE column) to their size in bytes;
+    # T = time (float64), D = float64, R = float32, I = int32
+    type_sizes = {'T':8, 'D':8, 'R':4, 'I':4}
+
     def __init__(self, ff_name, read_mode=True, copy_header=None):
         ''' Facilitates reading/writing header information for a flat file
 
@@ -74,7 +105,12 @@ class ff_header():
             fd.close()
         except:
             raise Exception('Error: Could not open header file')
-        
+
+        with ff_profile.span('header parse', name, len(lines[0])):
+            self._parse(lines)
+
+    def _parse(self, lines):
+        ''' Sets internal values from the lines read from a header file '''
         # Split into lines w/ width = 72 characters
         lines = [lines[0][i*72:i*72+72] for i in range(0, int(len(lines[0])/72))]
 
@@ -322,8 +358,106 @@ class ff_header():
         
         lines += ['{:<72}'.format('END')]
 
-        fd.write(''.join(lines))
-        fd.close()
+        text = ''.join(lines)
+        with ff_profile.span('header write', name, len(text)):
+            fd.write(text)
+            fd.close()
+
+    @classmethod
+    def update_in_place(cls, name, columns=None, units=None, sources=None,
+        abstract=None, **keywords):
+        ''' 
+            Updates the header file {name}.ffh without reading or writing
+            the data file; The new header is written to a temporary file
+            that replaces the old one, so readers never see a partial file
+
+            Parameters:
+            -----------
+            name: string
+                Name of the flat file (w/o extension)
+            columns, units, sources: dict or list
+                Dictionaries mapping column labels to new labels, units or
+                sources, or lists with a value for every column
+            abstract: list of strings
+                New abstract lines
+            keywords:
+                Keyword values to set; Underscores in keyword arguments are
+                replaced with spaces (e.g. error_flag sets ERROR FLAG)
+
+            Note: keywords describing the data file (RECL, NCOLS, NROWS,
+            DATA, COMPRESSION, BLOCK RECORDS and the checksum keywords)
+            cannot be changed
+        '''
+        # Read w/o overriding DATA and OPSYS keywords
+        header = cls(name, read_mode=False)
+        header._read()
+        header._strip_abstract_keywords()
+
+        labels = list(header.get_columns())
+        for section, values in [('NAME', columns), ('UNITS', units), 
+            ('SOURCE', sources)]:
+            if values is None:
+                continue
+            if isinstance(values, dict):
+                for label in values:
+                    if label not in labels:
+                        raise Exception(f'Error: Unknown column {label}')
+                values = [values.get(label, old) for label, old in 
+                    zip(labels, header.col_table[section])]
+            if len(values) != len(labels):
+                raise Exception('List length != # of columns in description table')
+            header.col_table[section] = values
+
+        if abstract is not None:
+            header.set_abstract(abstract)
+
+        for key, value in keywords.items():
+            header._update_keyword(key.replace('_', ' ').upper(), value)
+
+        # Write to a temporary file in the same directory and rename it
+        # over the header file, keeping the original file permissions
+        import shutil
+        import tempfile
+        path = f'{name}.ffh'
+        fd, tmp = tempfile.mkstemp(suffix='.ffh', dir=os.path.dirname(path) or '.')
+        os.close(fd)
+        try:
+            shutil.copymode(path, tmp)
+            header.write(tmp[:-len('.ffh')])
+            os.replace(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+        return header
+
+    def _strip_abstract_keywords(self):
+        ''' Removes keyword lines after the ABSTRACT line from the abstract
+            text; They are also read into the keyword dictionary, so they
+            would otherwise be written twice when the header is rewritten
+        '''
+        is_keyword = lambda line : (re.fullmatch('[^=]+=[^=]+', line) and 
+            line.split('=')[0].strip(' ') in self.keyword_dict)
+        self.abstract = [line for line in (self.abstract or []) if not is_keyword(line)]
+
+    def _update_keyword(self, key, value):
+        ''' Sets a keyword's value, checking that it can be changed and
+            still fits on a line
+        '''
+        if key in self.data_keys:
+            raise Exception(f'Error: {key} describes the data file and cannot be changed')
+
+        line = f'{key} = {value}'
+        if len(line) > 72:
+            raise Exception(f'Error: {key} line is longer than 72 characters')
+
+        if key == 'EPOCH':
+            self.set_epoch(value)
+        elif key == 'ERROR FLAG':
+            self.set_error_flag(value)
+        else:
+            self.set_value(key, value)
 
     def _init_table(self, ncol):
         ''' Initialize an empty column description table w/ the
@@ -362,10 +496,12 @@ class ff_header():
 
     def _get_dtype(self):
         locs = self.col_table['LOC'].tolist()
-        last_elem = 4 if self.col_table['TYPE'][-1] == 'R' else 8
+        types = self.col_table['TYPE']
+        last_elem = self._type_to_bitlength(types[-1])
         locs += [locs[-1] + last_elem]
         lengths = np.diff(locs)
-        dtype = [f'>f{i}' for i in lengths if i > 0]
+        kinds = ['i' if t == 'I' else 'f' for t in types]
+        dtype = [f'>{k}{i}' for k, i in zip(kinds, lengths) if i > 0]
         return ','.join(dtype)
     
     def set_columns(self, names):
@@ -382,7 +518,20 @@ class ff_header():
         return self.col_table['LOC']
     
     def set_types(self, types):
+        ''' Sets column data types and updates the column locations
+            and record length to match
+        '''
+        for t in types:
+            if t not in self.type_sizes:
+                raise Exception(f'Error: Unknown column type {t}')
+
+        if self.col_table is None:
+            self._init_table(len(types))
+
         self.col_table['TYPE'] = types
+        sizes = [self._type_to_bitlength(t) for t in types]
+        self.col_table['LOC'] = np.cumsum([0] + sizes[:-1])
+        self.set_value('RECL', sum(sizes))
     
     def append_row(self, name, units='', src='', datatype='R'):
         table_dtype = self._table_dtype()
@@ -400,15 +549,12 @@ class ff_header():
         length = + self._type_to_bitlength(datatype)
         record = [(row, name, units, src, datatype, loc)]
         record = np.array(record, dtype=table_dtype)
-        table = rfn.stack_arrays([table, record])
+        table = _rfn().stack_arrays([table, record])
         self.col_table = table
         self.set_value('RECL', recl + length)
 
     def _type_to_bitlength(self, t):
-        if t == 'R':
-            return 4
-        else:
-            return 8
+        return self.type_sizes.get(t, 8)
 
     def set_units(self, units):
         ''' Sets column units '''
@@ -450,37 +596,156 @@ class ff_header():
             return None
     
     def get_time_index(self):
-        types = self.col_table['TYPE']
+        types = self.col_table['TYPE'].tolist()
         if 'T' in types:
-            return list(types).index('T')
+            return types.index('T')
         return 0
     
 class ff_reader():
     fmts = ['index', 'tick', 'datetime', 'timestamps']
-    def __init__(self, name):
+    def __init__(self, name, thread_safe=False, shared_cache=None):
+        '''
+            Requires the name of the flat file (w/o extension)
+
+            Optional thread_safe argument makes the reader safe to share
+            between threads: the data file is opened once (see open()) and
+            range queries read the shared read-only mapping without any
+            locking, while the full data loaded by get_data()/get_times()
+            is read by a single thread even if several ask for it at once
+
+            Optional shared_cache argument (an ff_shared_cache, or True for
+            the default one) loads the full data from shared memory, so
+            processes reading the same file share one read-only copy
+        '''
         self.name = name
         self.data = None
         self.times = None
+        self._lock = threading.Lock() if thread_safe else None
+        if shared_cache is True:
+            # Only loaded when asked for, since it imports multiprocessing
+            from . import ff_shared
+            shared_cache = ff_shared.shared_cache()
+        self._shared = shared_cache
+
+        # Read the compressed data file if there is no .ffd file
+        self.compressed = (not os.path.exists(f'{name}.ffd') and 
+            os.path.exists(f'{name}.ffz'))
+        self._ffz = None
+
+        # Bytes of the data file while the reader is open
+        self._mm = None
 
         self.header = ff_header(name, read_mode=self.check_exists())
+        if self.compressed:
+            self.header.set_value('DATA', os.path.basename(name) + '.ffz')
+
+        if thread_safe and self.check_exists():
+            self.open()
     
     def __str__(self):
         return f'Flat File: {self.name}'
 
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self):
+        ''' 
+            Keeps the data file memory-mapped (or open, for compressed
+            files) until close() is called, so repeated reads reuse it
+            instead of reopening the file; Returns the reader
+
+            An open reader sees the data file as it was when opened, so
+            records appended afterwards are not read until it is reopened
+        '''
+        if self._lock is not None:
+            with self._lock:
+                return self._open()
+        return self._open()
+
+    def _open(self):
+        if self.compressed:
+            self._block_file().open()
+        elif self._mm is None:
+            filename = self._filename()
+            if os.path.getsize(filename) > 0:
+                # A plain ndarray view avoids np.memmap's per-slice overhead
+                mm = np.memmap(filename, dtype='u1', mode='r')
+                self._mm = mm.view(np.ndarray)
+            else:
+                self._mm = np.zeros(0, dtype='u1')
+        return self
+
+    def is_open(self):
+        if self.compressed:
+            return self._ffz is not None and self._ffz._fd is not None
+        return self._mm is not None
+
+    def _mapped(self, rows, dtype):
+        ''' Returns a memmap over the first rows records with the given
+            dtype, reusing the open mapping if there is one
+        '''
+        # Read once, since close() may clear it from another thread
+        mm = self._mm
+        if mm is not None:
+            return mm[:rows * self._record_length()].view(dtype)
+        return np.memmap(self._filename(), dtype=dtype, mode='r', shape=(rows,))
+
     def _filename(self):
-        return f'{self.name}.ffd'
+        ext = 'ffz' if self.compressed else 'ffd'
+        return f'{self.name}.{ext}'
+
+    def _block_file(self):
+        ''' Returns the ffz_file for a compressed data file '''
+        if self._ffz is None:
+            col = self.header.get_time_index()
+            loc = int(self.header.col_table['LOC'][col])
+            self._ffz = ffz_file(self._filename(), self._record_length(), loc)
+        return self._ffz
 
     def _record_length(self):
         return int(self.header.get_value('RECL'))
 
+    def _loaded_data(self):
+        ''' Returns self.data, reading it from the file first if needed;
+            Thread-safe readers read it once even if several threads ask
+            for it at the same time
+        '''
+        data = self.data
+        if data is not None:
+            return data
+        if self._lock is None:
+            return self._read_data()
+
+        with self._lock:
+            data = self.data
+            if data is None:
+                data = self._read_data()
+        return data
+
     def _read_data(self):
         ''' Reads in the data from the file and stores it at self.data '''
-        try:
-            fd = open(self._filename(), 'rb')
-            data = fd.read()
-            fd.close()
-        except:
-            raise Exception('Error: Could not open data file for reading')
+        if self._shared is not None:
+            with ff_profile.span('data read', self.name) as span:
+                data = self._shared.load(self)
+                span.nbytes = data.nbytes
+            self.data = data
+            return data
+
+        if self.compressed:
+            return self._read_compressed_data()
+
+        with ff_profile.span('data read', self.name) as span:
+            data = self._mm
+            if data is None:
+                try:
+                    with open(self._filename(), 'rb') as fd:
+                        data = fd.read()
+                except OSError:
+                    raise Exception('Error: Could not open data file for reading')
+            span.nbytes = len(data)
 
         # Determine the shape of the file and the expected # of bytes in the data
         recl = self._record_length()
@@ -490,20 +755,38 @@ class ff_reader():
 
         # Convert binary records to data
         dtype = self.header._get_dtype()
-        if num_bytes == len(data): # If no extra bytes detected
-            # Read data from file w/ given dtype and convert to unstructured array
-            data = np.fromfile(f'{self.name}.ffd', dtype, rows)
-            data = rfn.structured_to_unstructured(data, dtype='f8')
-        else:
-            # If data length is off, split by recl and convert to non-binary
-            records = [data[i*recl:(i+1)*recl] for i in range(0, rows)]
-            data = [np.frombuffer(record, dtype=dtype) for record in records]
-            data = np.array(data)
+        with ff_profile.span('endian conversion', self.name, num_bytes):
+            if num_bytes == len(data): # If no extra bytes detected
+                # Read data from file w/ given dtype and convert to unstructured array
+                data = np.frombuffer(data, dtype, rows)
+                data = _rfn().structured_to_unstructured(data, dtype='f8')
+            else:
+                # If data length is off, split by recl and convert to non-binary
+                records = [data[i*recl:(i+1)*recl] for i in range(0, rows)]
+                data = [np.frombuffer(record, dtype=dtype) for record in records]
+                data = np.array(data)
         
         self.data = data
 
         return data
 
+    def _read_compressed_data(self):
+        ''' Decompresses every block of a .ffz file and stores the
+            data at self.data
+        '''
+        ffz = self._block_file()
+        with ff_profile.span('data read', self.name) as span:
+            data = ffz.read_rows(0, len(ffz))
+            span.nbytes = len(data)
+
+        dtype = self.header._get_dtype()
+        with ff_profile.span('endian conversion', self.name, len(data)):
+            data = np.frombuffer(data, dtype=dtype)
+            data = _rfn().structured_to_unstructured(data, dtype='f8')
+
+        self.data = data
+        return data
+
     def shape(self):
         ''' Returns the number of rows and columns in the file '''
         rows = int(self.header.get_value('NROWS'))
@@ -543,16 +826,13 @@ class ff_reader():
             Optional include_times flag specifies whether to include the seconds
             since epoch time array as the first column
         '''
-        if self.data is None:
-            self._read_data()
-
-        data = self.data
+        data = self._loaded_data()
         if not include_times:
             data = data[:,1:]
 
         return data
     
-    def get_times(self, fmt='ticks'):
+    def get_times(self, fmt='ticks', epoch=None):
         ''' Returns the time array 
         
             Parameters:
@@ -560,64 +840,100 @@ class ff_reader():
             time_fmt: string
                 Indicates whether to map data to 
                     ticks - seconds since epoch time
+                    ns - int64 nanoseconds since epoch time
                     timestamps - strings in ISO format
                     datetimes - datetime objects
+            epoch: string
+                Epoch to return ticks or ns relative to, defaults to
+                the file's epoch
         '''
-        if self.data is None:
-            self._read_data()
-        
         index = self.header.get_time_index()
-        times = self.data[:,index]
-
-        if fmt != 'ticks':
+        times = self._loaded_data()[:,index]
+        convert = (epoch is not None and epoch != self.get_epoch())
+
+        if fmt == 'ns':
+            times = ff_time.ticks_to_ns(times)
+            if convert:
+                with ff_profile.tag(self.name):
+                    times = ff_time.convert_ns(times, self.get_epoch(), epoch)
+        elif fmt != 'ticks':
             times, dtype = self._map_times(times, fmt)
+        elif convert:
+            with ff_profile.tag(self.name):
+                times = ff_time.convert_ticks(times, self.get_epoch(), epoch)
 
         return times
     
     def _map_times(self, times, time_fmt):
         if time_fmt == 'ticks':
             return (times, 'f8')
-        elif time_fmt == 'timestamps':
-            ts = ff_time.ticks_to_iso(times, self.get_epoch())
-            n = len(ts[0])
-            return (ts, f'U{n}')
-        else:
-            dates = ff_time.ticks_to_dates(times, self.get_epoch())
-            return (dates, 'datetime64[s]')
+
+        with ff_profile.tag(self.name):
+            if time_fmt == 'timestamps':
+                ts = ff_time.ticks_to_iso(times, self.get_epoch())
+                n = len(ts[0])
+                return (ts, f'U{n}')
+            else:
+                dates = ff_time.ticks_to_dates(times, self.get_epoch())
+                return (dates, 'datetime64[s]')
 
     def get_data_table(self, time_fmt='ticks'):
         ''' 
             Returns data w/ time tick column as a structured
-            numpy array (different from a regular np.array)
+            numpy array (different from a regular np.array) with
+            each column's type in native byte order
 
             Parameters:
             -----------
             time_fmt: string
                 Indicates whether to map data to 
                     ticks - seconds since epoch time
+                    ns - int64 nanoseconds since epoch time
                     timestamps - strings in ISO format
-                    datetimes - datetime objects
+                    datetimes - datetime64[ns] UTC times
         '''
-        if self.data is None:
-            self._read_data()
+        # Copy records straight from the data file (or the already loaded
+        # data) into the table, converting each column once
+        dtype = np.dtype(self._labeled_dtype()).newbyteorder('=')
+        records = self.data
+        if records is None:
+            records = self._memmap_records()[:]
+            columns = lambda i, name : records[name]
+        else:
+            columns = lambda i, name : records[:,i]
 
-        # Create dtype w/ column names
-        dtype = self._labeled_dtype()
+        index = self.header.get_time_index()
+        label = dtype.names[index]
+        with ff_profile.span('endian conversion', self.name) as span:
+            if time_fmt == 'ticks':
+                table = np.empty(len(records), dtype=dtype)
+            else:
+                times = self._map_table_times(columns(index, label), time_fmt)
+                fields = [(name, times.dtype if name == label else dtype[name])
+                    for name in dtype.names]
+                table = np.empty(len(records), dtype=fields)
+                table[label] = times
+                del times
+
+            for i, name in enumerate(dtype.names):
+                if name != label or time_fmt == 'ticks':
+                    table[name] = columns(i, name)
+            span.nbytes = table.nbytes
 
-        # Convert data table to records format
-        table = rfn.unstructured_to_structured(self.data, dtype=np.dtype(dtype))
+        return table
 
-        if time_fmt != 'ticks':
-            index = self.header.get_time_index()
-            label = table.dtype.names[index]
-            times = table[label]
-            times, tdtype = self._map_times(times, time_fmt)
-            dtype = table.dtype.descr[:]
-            dtype[index] = (label, tdtype)
-            table = table.astype(dtype)
-            table[label] = times
+    def _map_table_times(self, times, time_fmt):
+        ''' Maps the time column for get_data_table to an array '''
+        if time_fmt == 'ns':
+            return ff_time.ticks_to_ns(times)
 
-        return table
+        with ff_profile.tag(self.name):
+            if time_fmt == 'datetimes':
+                ns = ff_time.ticks_to_ns(times)
+                return ff_time.ns_to_datetime64(ns, self.get_epoch())
+
+            times, dtype = self._map_times(times, time_fmt)
+            return np.array(times, dtype=dtype)
 
     def _labeled_dtype(self):
         names = self.get_labels()
@@ -648,11 +964,13 @@ class ff_reader():
     def get_time_range(self):
         ''' Returns start/end times of this file in datetime formats '''
         t0, t1 = self.get_tick_range()
-        return ff_time.ticks_to_dates([t0, t1], self.get_epoch())
+        with ff_profile.tag(self.name):
+            return ff_time.ticks_to_dates([t0, t1], self.get_epoch())
     
     def get_tick_range(self):
         ''' Returns the start/end time ticks of this file '''
-        if self._is_filesize_valid() and self.data is None:
+        data = self.data
+        if self._is_filesize_valid() and data is None:
             return self._memmap_time_range()
 
         # Read first/last ticks from time array if data has been loaded
@@ -675,11 +993,12 @@ class ff_reader():
 
         # Convert first column in data to ISO timestamps
         epoch = self.get_epoch()
-        timestamps = ff_time.ticks_to_iso(data[:,0], epoch)
+        with ff_profile.tag(self.name):
+            timestamps = ff_time.ticks_to_iso(data[:,0], epoch)
 
         # Restructure data array so first column is of string type
         dtype = np.dtype('U72' + ',>f8' * (ncols - 1))
-        data = rfn.unstructured_to_structured(data, dtype=dtype)
+        data = _rfn().unstructured_to_structured(data, dtype=dtype)
         data['f0'] = timestamps
     
         # Format header
@@ -692,8 +1011,118 @@ class ff_reader():
         fmt_str = ['%s'] + [f'%.{prec}f'] * (ncols - 1)
 
         # Save to file
-        np.savetxt(name, data, delimiter=',', header=header, fmt=fmt_str, 
-            comments='')
+        with ff_profile.span('formatting', self.name) as span:
+            np.savetxt(name, data, delimiter=',', header=header, fmt=fmt_str, 
+                comments='')
+            span.nbytes = os.path.getsize(name)
+
+    def _export_chunks(self, columns, start, stop, chunk_size):
+        ''' Returns the labels and native dtypes of the time column (as
+            datetime64[ns] UTC times) and the given columns, and a function
+            returning column values for rows a to b of [start, stop]
+        '''
+        labels = [str(self._time_label())] + [str(label) for label in 
+            self._column_labels(columns)]
+        dtype = np.dtype(self._labeled_dtype()).newbyteorder('=')
+        dtypes = [np.dtype('datetime64[ns]')] + [dtype[label] for label in labels[1:]]
+        i0, i1 = self._row_range(start, stop)
+        records = self._memmap_records()
+        epoch = self.get_epoch()
+
+        def column(label, a, b):
+            values = records[a:b][label]
+            if label == labels[0]:
+                ns = ff_time.ticks_to_ns(values)
+                return ff_time.ns_to_datetime64(ns, epoch)
+            return values.astype(dtype[label])
+
+        chunks = [(a, min(a + chunk_size, i1)) for a in range(i0, i1, chunk_size)]
+        return (labels, dtypes, i1 - i0, chunks, column)
+
+    def to_npz(self, name=None, compress=False, columns=None, start=None,
+        stop=None, chunk_size=1048576):
+        '''
+            Writes the records in [start, stop] to a .npz file holding
+            one array per column, readable with numpy.load
+
+            Parameters:
+            -----------
+            name: string
+                Name of the .npz file, defaults to the flat file's name
+            compress: bool
+                Whether to deflate each array
+            columns: list of strings
+                Column labels to write, defaults to all non-time columns
+            start, stop: float
+                Optional time ticks limiting the records to [start, stop]
+            chunk_size: int
+                Number of rows to convert at a time
+
+            The time column is written as datetime64[ns] UTC times and the
+            other columns keep their types in native byte order; Columns 
+            are streamed from the data file one at a time, so the whole
+            table is never held in memory
+        '''
+        import zipfile
+        name = self.name if name is None else name
+        name = name if name.endswith('.npz') else f'{name}.npz'
+        labels, dtypes, rows, chunks, column = self._export_chunks(columns, 
+            start, stop, chunk_size)
+
+        method = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        with ff_profile.span('data write', self.name) as span:
+            with zipfile.ZipFile(name, 'w', method, allowZip64=True) as zf:
+                for label, dtype in zip(labels, dtypes):
+                    with zf.open(f'{label}.npy', 'w', force_zip64=True) as fd:
+                        header = {'descr':np.lib.format.dtype_to_descr(dtype),
+                            'fortran_order':False, 'shape':(rows,)}
+                        np.lib.format.write_array_header_1_0(fd, header)
+                        for a, b in chunks:
+                            fd.write(column(label, a, b).tobytes())
+            span.nbytes = os.path.getsize(name)
+
+    def to_arrow(self, name=None, compression=None, columns=None, start=None,
+        stop=None, chunk_size=1048576):
+        '''
+            Writes the records in [start, stop] to an Arrow IPC (Feather v2)
+            file with one record batch per chunk of rows (requires pyarrow)
+
+            Parameters:
+            -----------
+            name: string
+                Name of the .arrow file, defaults to the flat file's name
+            compression: string
+                Optional 'lz4' or 'zstd' buffer compression
+            columns, start, stop, chunk_size:
+                See to_npz
+
+            Column units and sources are stored in the field metadata and
+            the epoch and error flag in the schema metadata
+        '''
+        pa = _optional_import('pyarrow', 'to_arrow')
+        ipc = _optional_import('pyarrow.ipc', 'to_arrow')
+        name = self.name if name is None else name
+        name = name if name.endswith(('.arrow', '.feather')) else f'{name}.arrow'
+        labels, dtypes, rows, chunks, column = self._export_chunks(columns,
+            start, stop, chunk_size)
+
+        units, sources = self._column_info()
+        fields = []
+        for label, dtype in zip(labels, dtypes):
+            metadata = {'units':units[label], 'source':sources[label]}
+            fields.append(pa.field(label, pa.from_numpy_dtype(dtype), 
+                metadata=metadata))
+        metadata = {'epoch':self.get_epoch(), 
+            'error_flag':str(self.get_error_flag())}
+        schema = pa.schema(fields, metadata=metadata)
+
+        options = ipc.IpcWriteOptions(compression=compression)
+        with ff_profile.span('data write', self.name) as span:
+            with ipc.new_file(name, schema, options=options) as writer:
+                for a, b in chunks:
+                    arrays = [pa.array(column(label, a, b)) for label in labels]
+                    writer.write_batch(pa.record_batch(arrays, schema=schema))
+            span.nbytes = os.path.getsize(name)
 
     def _memmap_data(self):
         ''' Returns a numpy memmap array-like object representing
@@ -703,21 +1132,31 @@ class ff_reader():
         # Check if filesize matches expected filesize
         filename = self._filename()
 
-        if not self._is_filesize_valid():
+        if self.compressed or not self._is_filesize_valid():
             return None
 
         # Attempt to open file as memmap object
         try:
             dtype = self._labeled_dtype()
-            table = np.memmap(filename, dtype=dtype, mode='r', shape=None)
+            table = self._mapped(self.shape()[0], dtype)
             return table
         except:
             return None
 
     def get_memmap_table(self):
         return self._memmap_data()
+
+    def get_table(self, cache_size=32):
+        ''' Returns a lazy ff_table over the memory-mapped records that
+            converts only the slices that are accessed to native byte
+            order, caching the most recently used slices
+        '''
+        return ff_table(self, cache_size)
     
     def _memmap_time_range(self):
+        if self.compressed:
+            return self._block_file().tick_range()
+
         # Get time column index and location
         col = self.header.get_time_index()
         loc = self.header.col_table['LOC'][col]
@@ -727,6 +1166,10 @@ class ff_reader():
         rows, cols = self.shape()
         last_row_loc = max(rows-1, 0) * recl
 
+        if self._mm is not None and rows > 0:
+            times = self._memmap_times()
+            return (float(times[0]), float(times[-1]))
+
         # Attempt to read starting & ending time ticks
         with open(self._filename(), 'rb') as fd:
             fd.seek(loc)
@@ -737,16 +1180,385 @@ class ff_reader():
             end = struct.unpack('>d', end)[0]
         
         return (start, end)
-        
+
+    def _num_records(self):
+        ''' Returns the number of complete records in the data file '''
+        if self.compressed:
+            return len(self._block_file())
+        return int(self._data_size() / self._record_length())
+
+    def _data_size(self):
+        ''' Returns the size of the data file (as opened, if open) '''
+        mm = self._mm
+        if mm is not None:
+            return len(mm)
+        return os.path.getsize(self._filename())
+
+    def _memmap_records(self):
+        ''' Returns a memmap over every complete record in the data file;
+            Unlike _memmap_data, any trailing partial record is ignored
+            instead of rejecting the file
+        '''
+        dtype = np.dtype(self._labeled_dtype())
+        if self.compressed:
+            return ffz_records(self._block_file(), dtype)
+
+        rows = self._num_records()
+        if rows == 0:
+            return np.zeros(0, dtype=dtype)
+
+        return self._mapped(rows, dtype)
+
+    def _memmap_times(self):
+        ''' Returns a memmap over only the time column of each record,
+            using the column's LOC as the offset within the record
+        '''
+        if self.compressed:
+            ffz = self._block_file()
+            return ffz_records(ffz, ffz.time_dtype, 't')
+
+        col = self.header.get_time_index()
+        loc = int(self.header.col_table['LOC'][col])
+        dtype = np.dtype({'names':['t'], 'formats':['>f8'], 'offsets':[loc],
+            'itemsize':self._record_length()})
+
+        rows = self._num_records()
+        if rows == 0:
+            return np.zeros(0, dtype='>f8')
+
+        table = self._mapped(rows, dtype)
+        return table['t']
+
+    def _time_label(self):
+        return self.get_labels()[self.header.get_time_index()]
+
+    def _column_labels(self, columns=None):
+        ''' Returns the list of labels for the given columns, defaulting
+            to every non-time column
+        '''
+        labels = list(self.get_labels())
+        if columns is None:
+            time_label = self._time_label()
+            return [label for label in labels if label != time_label]
+
+        for column in columns:
+            if column not in labels:
+                raise Exception(f'Error: Unknown column {column}')
+        return list(columns)
+
+    def _row_range(self, start=None, stop=None):
+        ''' Returns the (start, stop) row indices of the records with
+            time ticks in [start, stop], found with a binary search over
+            the time column so only a few records are read
+        '''
+        if self.compressed:
+            return self._block_file().row_range(start, stop)
+
+        times = self._memmap_times()
+        i0 = 0 if start is None else bisect_left(times, start)
+        i1 = len(times) if stop is None else bisect_right(times, stop)
+        return (i0, max(i0, i1))
+
+    def _decode_records(self, records, labels):
+        ''' Converts a slice of binary records into a native-endian
+            (times, data) tuple holding only the given column labels
+        '''
+        with ff_profile.span('endian conversion', self.name, records.nbytes):
+            times = records[self._time_label()].astype('f8')
+            data = np.empty((len(records), len(labels)), dtype='f8')
+            for i, label in enumerate(labels):
+                data[:,i] = records[label]
+        return (times, data)
+
+    def iter_chunks(self, chunk_size=65536, start=None, stop=None, columns=None):
+        ''' 
+            Iterates over the records in the file in chunks of at most
+            chunk_size rows so large files can be processed with bounded
+            memory
+
+            Parameters:
+            -----------
+            chunk_size: int
+                Maximum number of records per chunk
+            start, stop: float
+                Optional time ticks limiting the records to [start, stop]
+            columns: list of strings
+                Column labels to return, defaults to all non-time columns
+
+            Yields:
+            -------
+            (times, data) tuples where times is an array of ticks and
+            data is an m x n array with one column per requested label
+        '''
+        labels = self._column_labels(columns)
+        i0, i1 = self._row_range(start, stop)
+        return self._iter_rows(i0, i1, labels, chunk_size)
+
+    def read_range(self, start=None, stop=None, columns=None):
+        ''' 
+            Returns a (times, data) tuple for the records with time ticks
+            in [start, stop], reading only those records from the file
+
+            Optional columns argument lists the column labels to return,
+            defaulting to all non-time columns
+        '''
+        labels = self._column_labels(columns)
+        i0, i1 = self._row_range(start, stop)
+        return self._read_rows(i0, i1, labels)
+
+    def _read_rows(self, i0, i1, labels):
+        ''' Returns decoded (times, data) for rows i0 to i1 '''
+        return self._decode_records(self._memmap_records()[i0:i1], labels)
+
+    def _iter_rows(self, i0, i1, labels, chunk_size=65536):
+        ''' Yields decoded (times, data) chunks for rows i0 to i1 '''
+        table = self._memmap_records()
+        for a in range(i0, i1, chunk_size):
+            b = min(a + chunk_size, i1)
+            yield self._decode_records(table[a:b], labels)
+
+    def _column_arrays(self, columns=None, start=None, stop=None):
+        ''' Returns the time ticks and a dictionary of contiguous 
+            native-endian arrays (keeping each column's type) for the
+            given columns of the records in [start, stop]
+        '''
+        labels = [str(label) for label in self._column_labels(columns)]
+        i0, i1 = self._row_range(start, stop)
+        dtype = np.dtype(self._labeled_dtype()).newbyteorder('=')
+        data = self.data
+        if data is None:
+            records = self._memmap_records()[i0:i1]
+            column = lambda label : records[label]
+        else:
+            names = list(dtype.names)
+            column = lambda label : data[i0:i1, names.index(label)]
+
+        with ff_profile.span('endian conversion', self.name) as span:
+            times = column(self._time_label()).astype('f8')
+            arrays = {label:column(label).astype(dtype[label]) for label in labels}
+            span.nbytes = times.nbytes + sum([a.nbytes for a in arrays.values()])
+        return (times, arrays)
+
+    def _column_info(self):
+        ''' Returns dictionaries mapping each label to its units and source '''
+        labels = [str(label) for label in self.get_labels()]
+        units = dict(zip(labels, [str(u).strip() for u in self.get_units()]))
+        sources = dict(zip(labels, [str(s).strip() for s in self.get_sources()]))
+        return (units, sources)
+
+    def _index_times(self, times, time_index):
+        if time_index == 'ticks':
+            return times
+        elif time_index == 'datetime64':
+            with ff_profile.tag(self.name):
+                return ff_time.ns_to_datetime64(ff_time.ticks_to_ns(times), 
+                    self.get_epoch())
+        raise Exception(f'Error: Unknown time index {time_index}')
+
+    def to_dataframe(self, columns=None, start=None, stop=None, 
+        time_index='datetime64'):
+        '''
+            Returns the records in [start, stop] as a pandas DataFrame
+            indexed by time (requires pandas)
+
+            Parameters:
+            -----------
+            columns: list of strings
+                Column labels to include, defaults to all non-time columns
+            start, stop: float
+                Optional time ticks limiting the records to [start, stop]
+            time_index: string
+                'datetime64' for a DatetimeIndex of UTC times or 'ticks'
+                for seconds since the file's epoch
+
+            Column units and sources, the epoch and the error flag are
+            stored in the DataFrame's attrs
+        '''
+        pd = _optional_import('pandas', 'to_dataframe')
+        times, arrays = self._column_arrays(columns, start, stop)
+        index = pd.Index(self._index_times(times, time_index), 
+            name=str(self._time_label()))
+
+        # Each column array is handed to pandas as-is instead of copied
+        # into a single block
+        frame = pd.DataFrame(arrays, index=index, copy=False)
+        units, sources = self._column_info()
+        frame.attrs['units'] = {label:units[label] for label in arrays}
+        frame.attrs['sources'] = {label:sources[label] for label in arrays}
+        frame.attrs['epoch'] = self.get_epoch()
+        frame.attrs['error_flag'] = self.get_error_flag()
+        return frame
+
+    def to_xarray(self, columns=None, start=None, stop=None, 
+        time_index='datetime64'):
+        '''
+            Returns the records in [start, stop] as an xarray Dataset with
+            one variable per column along the time dimension (requires
+            xarray); See to_dataframe for the parameters
+
+            Each variable's units and source are stored in its attrs, and
+            the epoch, error flag and abstract in the Dataset's attrs
+        '''
+        xr = _optional_import('xarray', 'to_xarray')
+        times, arrays = self._column_arrays(columns, start, stop)
+        label = str(self._time_label())
+        units, sources = self._column_info()
+
+        variables = {}
+        for name, values in arrays.items():
+            attrs = {'units':units[name], 'source':sources[name]}
+            variables[name] = xr.Variable((label,), values, attrs)
+
+        coords = {label:self._index_times(times, time_index)}
+        attrs = {'epoch':self.get_epoch(), 'error_flag':self.get_error_flag(),
+            'abstract':'\n'.join(self.get_abstract() or [])}
+        return xr.Dataset(variables, coords=coords, attrs=attrs)
+
+    def scan_gaps(self, threshold=None, chunk_size=1048576):
+        ''' 
+            Checks the time column for gaps and irregularities, streaming
+            through the time ticks only
+
+            Parameters:
+            -----------
+            threshold: float
+                Spacing in seconds above which two records are considered
+                a gap, defaults to 1.5 times the dominant cadence
+            chunk_size: int
+                Number of time ticks to read at a time
+
+            Returns:
+            --------
+            A dictionary with the following keys:
+                cadence - most common spacing between records in seconds
+                threshold - gap threshold that was used
+                gaps - list of (t0, t1) ticks on either side of each gap
+                duplicates - row indices of ticks equal to the previous tick
+                non_monotonic - row indices of ticks less than the previous tick
+                leaps - list of (sI, eI) row index ranges within leap seconds
+        '''
+        times = self._memmap_times()
+        cadence = self._dominant_cadence(times, chunk_size)
+        if threshold is None and cadence is not None:
+            threshold = cadence * 1.5
+
+        gaps, duplicates, non_monotonic, leaps = [], [], [], []
+        leap_epoch = self.get_epoch() not in ['Y1966', 'Y1970']
+        for a in range(0, len(times), chunk_size):
+            # Include the previous tick so diffs cross chunk boundaries
+            lo = max(a - 1, 0)
+            chunk = times[lo:a+chunk_size].astype('f8')
+            diffs = np.diff(chunk)
+            rows = np.arange(lo + 1, lo + len(chunk))
+
+            if threshold is not None:
+                index = np.nonzero(diffs > threshold)[0]
+                gaps.extend(zip(chunk[index], chunk[index+1]))
+            duplicates.extend(rows[diffs == 0])
+            non_monotonic.extend(rows[diffs < 0])
+
+            # Find ranges of ticks within true leap seconds
+            if leap_epoch and len(chunk) > 0:
+                pairs, ranges = ff_time.find_leaps(chunk, self.get_epoch(),
+                    key='leap_sec', exact_leaps=True)
+                for sI, eI in ranges:
+                    sI, eI = max(sI + lo, a), eI + lo
+                    if leaps and leaps[-1][1] >= sI:
+                        sI = leaps.pop()[0]
+                    if eI > sI:
+                        leaps.append((sI, eI))
+
+        info = {
+            'cadence' : cadence,
+            'threshold' : threshold,
+            'gaps' : gaps,
+            'duplicates' : np.array(duplicates, dtype=int),
+            'non_monotonic' : np.array(non_monotonic, dtype=int),
+            'leaps' : leaps,
+        }
+        return info
+
+    def stats(self, columns=None, start=None, stop=None, quantiles=None,
+        sample_size=10000, chunk_size=65536):
+        ''' 
+            Computes per-column statistics in a single streaming pass
+            over the file, skipping error flagged values
+
+            Parameters:
+            -----------
+            columns: list of strings
+                Column labels to compute statistics for, defaults to all
+                non-time columns
+            start, stop: float
+                Optional time ticks limiting the records to [start, stop]
+            quantiles: list of floats
+                Optional quantiles (between 0 and 1) to estimate from a
+                random sample of sample_size values per column
+
+            Returns:
+            --------
+            A dictionary mapping each label to a dictionary of its count,
+            min, max, mean, std and (optionally) quantiles; 
+            See ff_stats.result() for additional info
+        '''
+        labels = self._column_labels(columns)
+        sample_size = sample_size if quantiles is not None else None
+        stats = ff_stats(labels, float(self.get_error_flag()), sample_size)
+        for times, data in self.iter_chunks(chunk_size, start, stop, labels):
+            stats.update(data)
+
+        return stats.result(quantiles)
+
+    def _dominant_cadence(self, times, chunk_size, max_bins=1024):
+        ''' Returns the most common spacing between ticks, rounded to
+            microseconds, or None if there are less than two records
+        '''
+        counts = {}
+        for a in range(0, len(times), chunk_size):
+            chunk = times[max(a-1, 0):a+chunk_size].astype('f8')
+            diffs, num = np.unique(np.round(np.diff(chunk), 6), return_counts=True)
+            for diff, n in zip(diffs, num):
+                counts[diff] = counts.get(diff, 0) + n
+
+            # Bound memory for irregular data by keeping the most common
+            if len(counts) > max_bins:
+                items = sorted(counts.items(), key=lambda item : -item[1])
+                counts = dict(items[:max_bins])
+
+        counts = {diff:n for diff, n in counts.items() if diff > 0}
+        if len(counts) == 0:
+            return None
+
+        return float(max(counts, key=lambda diff : counts[diff]))
+
     def _is_filesize_valid(self):
-        filesize = os.path.getsize(self._filename())
+        if self.compressed:
+            return len(self._block_file()) == self.shape()[0]
+
+        filesize = self._data_size()
         rows, cols = self.shape()
         recl = self._record_length()
         return ((rows*recl) == filesize)
 
+    def verify(self):
+        ''' Checks the data file against the checksums written with it
+            (see ff_writer.set_checksums) and returns a list of problems
+            found, which is empty if the file is intact; Files without
+            checksums are only checked for truncation
+        '''
+        return ff_checksum.verify(self)
+
     def close(self):
+        ''' Releases the loaded data and the data file kept by open();
+            Arrays already read from the file remain valid
+        '''
         self.data = None
         self.times = None
+        self._mm = None
+
+        # Dropped rather than closed, so reads in progress in other threads
+        # finish before the compressed file's handle is closed
+        self._ffz = None
 
 class ff_writer():
     def __init__(self, name, copy_header=None):
@@ -759,6 +1571,29 @@ class ff_writer():
         '''
         self.name = name
         self.header = ff_header(name, read_mode=False, copy_header=copy_header)
+        self.data = None
+
+        # State for writing records incrementally with append()
+        self._fd = None
+        self._rows = 0
+        self._tick_range = None
+
+        # Compressed (.ffz) data file and checksum settings, see
+        # set_compression() and set_checksums(); Neither is copied
+        # from copy_header since they describe the copied data file
+        self.set_compression(None)
+        self.set_checksums(None)
+        self._checksums = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        # Files left unfinished by an error are removed, not finished
+        if exc_type is not None:
+            self._discard()
+        else:
+            self.close()
     
     def _data_shape_checks(self, times, data):
         ''' Performs validity checks against data and times passed to set_data '''
@@ -849,6 +1684,26 @@ class ff_writer():
         sources = [''] + col_sources
         self.header.set_sources(sources)
     
+    def set_types(self, col_types):
+        ''' 
+            Sets the data type of each non-time column, which also sets
+            the column locations and record length
+
+            Input: A list of strings, one of
+                'R' - 4 byte float (default)
+                'D' - 8 byte float
+                'I' - 4 byte signed integer
+
+            Note: Values are cast to the column type when written, so
+            integer columns cannot hold the error flag; Writing raises
+            an error if they hold anything but 32-bit integers
+        '''
+        desc_table = self.header.get_desc_table()
+        if desc_table is not None and desc_table.shape[0] != (len(col_types) + 1):
+            raise Exception('List length != # of columns in description table')
+
+        self.header.set_types(['T'] + list(col_types))
+
     def set_abstract(self, abstract):
         ''' 
             Sets the abstract for the header file
@@ -860,6 +1715,71 @@ class ff_writer():
     def set_error_flag(self, flag):
         ''' Sets the error flag '''
         self.header.set_error_flag(flag)
+
+    def set_compression(self, method='zlib', block_records=65536, level=None):
+        ''' 
+            Writes the data to a compressed .ffz file instead of a .ffd
+            file, split into independently compressed blocks
+
+            Input:
+                method - 'zlib' or 'lzma', or None to write a .ffd file
+                block_records - number of records per compressed block
+                level - compression level, defaults to the method's default
+        '''
+        if method is None:
+            self.compression = None
+            self.header.keyword_dict.pop('COMPRESSION', None)
+            self.header.keyword_dict.pop('BLOCK RECORDS', None)
+            return
+
+        self.compression = (method, block_records, level)
+        self.header.set_value('COMPRESSION', method)
+        self.header.set_value('BLOCK RECORDS', block_records)
+
+    def set_checksums(self, block_size=4194304):
+        ''' 
+            Computes the CRC32 of each block of block_size bytes of the
+            data file while it is written, saving them to a {name}.ffc
+            file and the CRC32 of the whole data file to the header;
+            Passing None disables checksums
+
+            See ff_reader.verify() for checking files
+        '''
+        self.checksum_block = block_size
+        if block_size is None:
+            for key in ff_checksum.checksum_keys:
+                self.header.keyword_dict.pop(key, None)
+
+    def _data_filename(self, name):
+        ext = 'ffd' if self.compression is None else 'ffz'
+        self.header.set_value('DATA', f'{os.path.basename(name)}.{ext}')
+        return f'{name}.{ext}'
+
+    def _open_data_file(self, name):
+        ''' Opens the data file for writing, returning an ffz_writer
+            for compressed files
+        '''
+        filename = self._data_filename(name)
+        try:
+            fd = open(filename, 'wb')
+        except:
+            raise Exception('Error: Could not open data file for writing')
+
+        if self.checksum_block is not None:
+            fd = ff_checksum.checksum_writer(fd, self.checksum_block)
+            self._checksums = fd
+
+        if self.compression is not None:
+            recl = self.header.get_recl()
+            fd = ffz_writer(fd, recl, *self.compression)
+        return fd
+
+    def _close_data_file(self, fd, name):
+        ''' Closes the data file and saves its checksums if enabled '''
+        fd.close()
+        if self._checksums is not None:
+            self._checksums.save(name, self.header)
+            self._checksums = None
     
     def write(self, name=None):
         ''' 
@@ -877,27 +1797,153 @@ class ff_writer():
 
         # Get start/stop time to put in abstract
         times = self.data[:,0]
+        self._set_time_range(times[0], times[-1])
+
+        # Convert data to binary format
+        data = self._records_to_bytes(self.data)
+
+        # Write binary data to file
+        fd = self._open_data_file(name)
+        with ff_profile.span('data write', name, len(data)):
+            if self.compression is None:
+                fd.write(data)
+            else:
+                fd.write(data, times)
+            self._close_data_file(fd, name)
+
+        # Write out header file once the data file keywords are known
+        self.header.write(name)
+
+    def append(self, times, data):
+        ''' 
+            Appends records to the .ffd file, opening it on the first call,
+            so files larger than memory can be written in pieces;
+            close() must be called afterwards to write the header file
+
+            Input:
+                times - array of length m,
+                data - array of shape m x n
+        '''
+        self._data_shape_checks(times, data)
+
+        if self._fd is None:
+            self.header.get_recl()
+            self._fd = self._open_data_file(self.name)
+            self._rows = 0
+            self._tick_range = (times[0], times[-1])
+
+        times = np.reshape(times, (len(times), 1))
+        records = np.hstack([times, data])
+        data = self._records_to_bytes(records)
+        with ff_profile.span('data write', self.name, len(data)):
+            if self.compression is None:
+                self._fd.write(data)
+            else:
+                self._fd.write(data, times[:,0])
+
+        # Track the number of rows and time range for the header
+        self._rows += len(records)
+        self._tick_range = (self._tick_range[0], times[-1,0])
+        self.header.set_value('NCOLS', records.shape[1])
+        self.header.set_value('NROWS', self._rows)
+
+    def close(self):
+        ''' Finishes a file written with append() by closing the .ffd
+            file and writing out the header file
+        '''
+        if self._fd is None:
+            return
+
+        self._close_data_file(self._fd, self.name)
+        self._fd = None
+        self._set_time_range(*self._tick_range)
+        self.header.write(self.name)
+
+    def _discard(self):
+        ''' Abandons a file being written with append(), closing the
+            .ffd file w/o finishing it and removing any data, checksum
+            and header files written for it
+        '''
+        if self._tick_range is None:
+            return
+
+        # Close the underlying file object w/o flushing compressed blocks
+        fd = self._fd
+        while getattr(fd, 'fd', None) is not None:
+            fd = fd.fd
+        if fd is not None:
+            fd.close()
+        self._fd = None
+        self._checksums = None
+
+        filenames = [self._data_filename(self.name), 
+            ff_checksum.sidecar_filename(self.name), f'{self.name}.ffh']
+        for filename in filenames:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def _set_time_range(self, t0, t1):
+        ''' Sets the first/last time and creation date keywords '''
         epoch = self.header.get_epoch()
-        t0, t1 = times[0], times[-1]
-        d0 = ff_time.tick_to_date(t0, epoch)
-        d1 = ff_time.tick_to_date(t1, epoch)
+        with ff_profile.tag(self.name):
+            d0 = ff_time.tick_to_date(t0, epoch)
+            d1 = ff_time.tick_to_date(t1, epoch)
         fmt = '%Y %j %b %d %H:%M:%S.%f'
         self.header.set_value('FIRST TIME', d0.strftime(fmt))
         self.header.set_value('LAST TIME', d1.strftime(fmt))
         self.header.set_value('CDATE', datetime.today().strftime(fmt))
 
-        # Write out header file
-        self.header.write(name)
-
-        # Convert data to binary format
+    def _records_to_bytes(self, records):
+        ''' Converts an m x n array of records (w/ times as the first
+            column) to the binary record format
+        '''
+        self._check_integers(records)
         dtype = self.header._get_dtype()
-        data = np.rec.fromarrays(self.data.T, dtype=dtype)
-        data = data.tobytes()
+        with ff_profile.span('endian conversion', self.name) as span:
+            data = np.rec.fromarrays(records.T, dtype=dtype).tobytes()
+            span.nbytes = len(data)
+        return data
 
-        # Write binary data to file
-        try:
-            fd = open(f'{name}.ffd', 'wb')
-            fd.write(data)
-            fd.close()
-        except:
-            raise Exception('Error: Could not open data file for writing')
+    def _check_integers(self, records):
+        ''' Checks that 'I' columns only hold 32-bit integer values, since
+            casting would silently truncate or wrap anything else
+        '''
+        table = self.header.col_table
+        for i, t in enumerate(table['TYPE']):
+            if t != 'I' or i >= records.shape[1]:
+                continue
+            values = records[:,i]
+            with np.errstate(invalid='ignore'):
+                valid = np.isfinite(values) & (values == np.round(values)) & \
+                    (values >= -2**31) & (values < 2**31)
+            if not np.all(valid):
+                bad = values[~valid][0]
+                raise Exception(f'Error: Column {table["NAME"][i]} has type I but '
+                    f'holds {bad}, which is not a 32-bit integer')
+
+    def _copy_columns(self, reader, labels, added=()):
+        ''' Sets the epoch, error flag and column descriptions from
+            the given ff_reader for a subset of its column labels;
+            Labels in added are new columns w/o units or sources that
+            are written as 8 byte floats
+        '''
+        all_labels = list(reader.get_labels())
+        indices = [None if label in added else all_labels.index(label)
+            for label in labels]
+        time_index = reader.header.get_time_index()
+        units = reader.get_units()
+        sources = reader.get_sources()
+        types = reader.header.col_table['TYPE']
+
+        # Unknown types are read as floats of their width, so keep that width
+        widths = [np.dtype(t).itemsize for name, t in reader._labeled_dtype()]
+        copy_type = lambda i : (types[i] if types[i] in ff_header.type_sizes
+            else ('D' if widths[i] == 8 else 'R'))
+
+        self.set_epoch(reader.get_epoch())
+        self.set_error_flag(reader.get_error_flag())
+        self.set_labels(list(labels), time_label=all_labels[time_index])
+        self.set_units(['' if i is None else units[i] for i in indices], 
+            time_units=units[time_index])
+        self.set_sources(['' if i is None else sources[i] for i in indices])
+        self.set_types(['D' if i is None else copy_type(i) for i in indices])
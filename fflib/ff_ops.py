@@ -0,0 +1,224 @@
+import numpy as np
+import os
+from . import ff_time
+from .ff_lib import ff_reader, ff_writer
+from .ff_stats import flagged
+
+def _copy_range(src, dst, offset, length, bufsize=16777216):
+    ''' Copies length bytes starting at offset in the file named src to
+        the binary file object dst, letting the kernel copy the data with
+        copy_file_range or sendfile where possible
+    '''
+    dst.flush()
+    with open(src, 'rb') as fd:
+        for name in ['copy_file_range', 'sendfile']:
+            func = getattr(os, name, None)
+            if func is None:
+                continue
+            try:
+                while length > 0:
+                    count = min(length, 1073741824)
+                    if name == 'copy_file_range':
+                        n = func(fd.fileno(), dst.fileno(), count, offset)
+                    else:
+                        n = func(dst.fileno(), fd.fileno(), offset, count)
+                    if n == 0:
+                        break
+                    offset += n
+                    length -= n
+            except OSError:
+                # Not supported for these files, e.g. across file systems
+                # on older kernels, so try the next method
+                continue
+            if length == 0:
+                return
+
+        # Copy with large buffered reads
+        fd.seek(offset)
+        while length > 0:
+            data = fd.read(min(length, bufsize))
+            if not data:
+                break
+            dst.write(data)
+            length -= len(data)
+
+def _write_header(writer, name, rows, t0, t1):
+    ''' Writes the header for a data file that was written directly,
+        with rows records and first/last time ticks t0 and t1
+    '''
+    writer.header._strip_abstract_keywords()
+    writer.header.set_value('NROWS', rows)
+    writer.header.set_value('NCOLS', len(writer.header.get_columns()))
+    writer._data_filename(name)
+    writer._set_time_range(t0, t1)
+    writer.header.write(name)
+
+def ff_extract(src, dst, start=None, stop=None, columns=None, chunk_size=1048576):
+    '''
+        Copies the records of a flat file within a time range (and
+        optionally a subset of its columns) to a new flat file without
+        converting any values
+
+        Parameters:
+        -----------
+        src: ff_reader or string
+            Flat file to extract records from
+        dst: string
+            Name of the flat file to write
+        start, stop: float
+            Optional time ticks limiting the records to [start, stop]
+        columns: list of strings
+            Optional non-time column labels to keep; When not given, the
+            record bytes are copied straight from the source data file
+        chunk_size: int
+            Number of records to copy at a time when they are not copied
+            straight from the source data file
+
+        Returns:
+        --------
+        The number of records written
+    '''
+    reader = src if isinstance(src, ff_reader) else ff_reader(src)
+    if os.path.abspath(dst) == os.path.abspath(reader.name):
+        raise Exception('Error: Output file cannot be the input file')
+    if columns is not None and reader._time_label() in columns:
+        raise Exception(f'Error: The time column {reader._time_label()} is always '
+            'kept and cannot be selected')
+
+    i0, i1 = reader._row_range(start, stop)
+    if i1 <= i0:
+        raise Exception('Error: No records in the given time range')
+
+    times = reader._memmap_times()
+    t0, t1 = float(times[i0]), float(times[i1-1])
+    recl = reader._record_length()
+
+    if columns is None:
+        writer = ff_writer(dst, copy_header=reader.name)
+        with open(writer._data_filename(dst), 'wb') as fd:
+            if reader.compressed:
+                ffz = reader._block_file()
+                for a in range(i0, i1, chunk_size):
+                    fd.write(ffz.read_rows(a, min(a + chunk_size, i1)))
+            else:
+                _copy_range(reader._filename(), fd, i0 * recl, (i1 - i0) * recl)
+    else:
+        # Pack the selected fields into new records, keeping their types
+        labels = reader._column_labels(columns)
+        writer = ff_writer(dst)
+        writer._copy_columns(reader, labels)
+        names = [reader._time_label()] + labels
+        table = reader._memmap_records()
+
+        # Pack fields in the layout given by the new header's types
+        formats = writer.header._get_dtype().split(',')
+        out_dtype = np.dtype(list(zip(names, formats)))
+        with open(writer._data_filename(dst), 'wb') as fd:
+            for a in range(i0, i1, chunk_size):
+                records = table[a:min(a + chunk_size, i1)]
+                out = np.empty(len(records), dtype=out_dtype)
+                for name in names:
+                    out[name] = records[name]
+                fd.write(out.tobytes())
+
+    _write_header(writer, dst, i1 - i0, t0, t1)
+    return i1 - i0
+
+def _schema(reader):
+    ''' Returns the parts of a flat file's header that must match for
+        its records to be appended to another file's records as-is
+    '''
+    table = reader.header.col_table
+    return (list(table['NAME']), list(table['TYPE']), list(table['LOC']),
+        reader._record_length(), reader.get_epoch(), 
+        float(reader.get_error_flag()))
+
+def ff_concat(inputs, output, chunk_size=1048576):
+    '''
+        Concatenates flat files into a single flat file, ordered by their
+        first time tick
+
+        Parameters:
+        -----------
+        inputs: list of ff_readers or strings
+            Flat files to concatenate, which must not overlap in time
+        output: string
+            Name of the flat file to write
+        chunk_size: int
+            Number of records to read at a time when records are decoded
+
+        Returns:
+        --------
+        The number of records written
+
+        Note:
+        -----
+        Every file must have the same column labels; If they also have
+        the same types, epoch and error flag, their data files are
+        appended byte for byte; Otherwise records are
+        decoded, with ticks converted to the first file's epoch and
+        error flags replaced with the first file's error flag
+    '''
+    readers = [ff if isinstance(ff, ff_reader) else ff_reader(ff) for ff in inputs]
+    readers = [ff for ff in readers if ff._num_records() > 0]
+    if len(readers) == 0:
+        raise Exception('Error: No records to concatenate')
+
+    if os.path.abspath(output) in [os.path.abspath(ff.name) for ff in readers]:
+        raise Exception('Error: Output file cannot be one of the inputs')
+
+    first = readers[0]
+    epoch = first.get_epoch()
+    same_schema = all([_schema(ff) == _schema(first) for ff in readers])
+
+    # Get time range of each file in the output epoch and sort files by it
+    ranges = []
+    for ff in readers:
+        t0, t1 = ff_time.convert_ticks(ff._memmap_time_range(), ff.get_epoch(), epoch)
+        ranges.append((t0, t1))
+    order = sorted(range(len(readers)), key=lambda i : ranges[i])
+    readers = [readers[i] for i in order]
+    ranges = [ranges[i] for i in order]
+
+    for (a0, a1), (b0, b1) in zip(ranges[:-1], ranges[1:]):
+        if b0 < a1:
+            raise Exception('Error: Input files overlap in time')
+
+    rows = 0
+    if same_schema:
+        writer = ff_writer(output, copy_header=first.name)
+        with open(writer._data_filename(output), 'wb') as fd:
+            for ff in readers:
+                n = ff._num_records()
+                if ff.compressed:
+                    for block in range(ff._block_file().num_blocks()):
+                        fd.write(ff._block_file().read_blocks([block])[0])
+                else:
+                    _copy_range(ff._filename(), fd, 0, n * ff._record_length())
+                rows += n
+        _write_header(writer, output, rows, ranges[0][0], ranges[-1][1])
+        return rows
+
+    # Decode records and convert them to the first file's layout
+    labels = first._column_labels()
+    for ff in readers:
+        if ff._column_labels() != labels:
+            raise Exception(f'Error: Columns of {ff.name} do not match those of {first.name}')
+
+    flag = float(first.get_error_flag())
+    writer = ff_writer(output)
+    writer._copy_columns(first, labels)
+    try:
+        for ff in readers:
+            in_flag = float(ff.get_error_flag())
+            for times, data in ff.iter_chunks(chunk_size, columns=labels):
+                times = ff_time.convert_ticks(times, ff.get_epoch(), epoch)
+                data[flagged(data, in_flag)] = flag
+                writer.append(times, data)
+                rows += len(times)
+        writer.close()
+    except BaseException:
+        # Don't leave a partial file behind
+        writer._discard()
+        raise
+    return rows
@@ -0,0 +1,230 @@
+'''
+    Streaming transforms of flat files, one chunk of records at a time
+
+    A pipeline reads the records of a flat file in chunks and passes
+    them through each of its steps in turn, so files of any size are
+    transformed with a bounded number of records in memory. The next
+    chunks are read by a background thread while the current chunk is
+    processed, and results are written through an appending ff_writer.
+
+    Usage:
+        def calibrate(times, data):
+            return data @ rotation.T + offsets
+
+        (ff_pipeline(name).select(['Bx', 'By', 'Bz']).window(t0, t1)
+            .apply(calibrate).resample(1.0).to_ff(out_name))
+'''
+import os
+import queue
+import threading
+import numpy as np
+from .ff_lib import ff_reader, ff_writer
+from .ff_resample import _resampler, _mark_final, methods
+
+def _prefetch(chunks, depth):
+    ''' Yields the items of an iterator that is advanced by a background
+        thread, which reads up to depth items ahead
+    '''
+    items = queue.Queue(maxsize=depth)
+    done = threading.Event()
+    end = object()
+
+    def put(item):
+        # Give up once the consumer has stopped
+        while not done.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for chunk in chunks:
+                if not put((chunk, None)):
+                    return
+            put((end, None))
+        except BaseException as error:
+            put((None, error))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk, error = items.get()
+            if error is not None:
+                raise error
+            if chunk is end:
+                return
+            yield chunk
+    finally:
+        done.set()
+        thread.join()
+
+class ff_pipeline():
+    ''' Chain of transforms applied to a flat file's records chunk by chunk '''
+    def __init__(self, src, chunk_size=65536, prefetch=2):
+        '''
+            Requires the flat file (ff_reader or name) to read records from
+
+            Optional chunk_size and prefetch arguments specify the number
+            of records read at a time and the number of chunks read ahead
+            in the background
+        '''
+        self.reader = src if isinstance(src, ff_reader) else ff_reader(src)
+        self.chunk_size = int(chunk_size)
+        self.prefetch = max(int(prefetch), 1)
+
+        # Columns and time range read from the file
+        self.start = None
+        self.stop = None
+        self._read_labels = self.reader._column_labels()
+
+        # Labels of the columns output by the last step, and the steps
+        # as functions mapping an iterator of chunks to another
+        self.labels = list(self._read_labels)
+        self._steps = []
+
+    def __str__(self):
+        return f'Flat File Pipeline: {self.reader.name}, {len(self._steps)} steps'
+
+    def select(self, columns):
+        ''' Keeps only the given columns; Before any other steps, only
+            these columns are read from the file
+        '''
+        if len(self._steps) == 0:
+            self._read_labels = self.reader._column_labels(columns)
+            self.labels = list(self._read_labels)
+            return self
+
+        for column in columns:
+            if column not in self.labels:
+                raise Exception(f'Error: Unknown column {column}')
+        indices = [self.labels.index(column) for column in columns]
+        self.labels = list(columns)
+        self._steps.append(lambda chunks : ((times, data[:,indices])
+            for times, data in chunks))
+        return self
+
+    def window(self, start=None, stop=None):
+        ''' Limits the records read from the file to those with time
+            ticks in [start, stop]
+        '''
+        self.start = start
+        self.stop = stop
+        return self
+
+    def apply(self, func, labels=None):
+        '''
+            Adds a step calling func(times, data) on each chunk, where
+            times is an array of ticks and data an m x n array with one
+            column per label (error flagged values included)
+
+            func returns the new data array for the same times, or a
+            (times, data) tuple to change or drop records; Optional
+            labels argument gives the labels of the columns func returns
+            if they differ from its input
+        '''
+        labels = self.labels if labels is None else list(labels)
+        ncols = len(labels)
+
+        def step(chunks):
+            for times, data in chunks:
+                result = func(times, data)
+                if isinstance(result, tuple):
+                    times, result = result
+                times = np.asarray(times, dtype='f8')
+                result = np.asarray(result, dtype='f8')
+                if result.ndim != 2 or result.shape != (len(times), ncols):
+                    raise Exception(f'Error: apply function returned shape '
+                        f'{result.shape}, expected ({len(times)}, {ncols})')
+                yield (times, result)
+
+        self.labels = labels
+        self._steps.append(step)
+        return self
+
+    def resample(self, cadence_seconds, method='linear', start=None, stop=None):
+        ''' Adds a step resampling the records onto a uniform time grid;
+            See ff_resample for the methods and error flag handling
+        '''
+        if method not in methods:
+            raise Exception(f'Error: Unknown resampling method {method}')
+        flag = float(self.reader.get_error_flag())
+        ncols = len(self.labels)
+
+        def step(chunks):
+            resampler = _resampler(cadence_seconds, method, start, stop, flag)
+            empty = (np.zeros(0), np.zeros((0, ncols)))
+            for times, data, final in _mark_final(chunks, empty):
+                grid, values = resampler.feed(times, data, final=final)
+                if len(grid) > 0:
+                    yield (grid, values)
+
+        self._steps.append(step)
+        return self
+
+    def iter_chunks(self):
+        ''' Iterates over the (times, data) chunks output by the last step '''
+        reader = self.reader
+        i0, i1 = reader._row_range(self.start, self.stop)
+        chunks = _prefetch(reader._iter_rows(i0, i1, self._read_labels,
+            self.chunk_size), self.prefetch)
+        for step in self._steps:
+            chunks = step(chunks)
+        return chunks
+
+    def read(self):
+        ''' Returns the (times, data) output by the last step as a whole '''
+        results = [chunk for chunk in self.iter_chunks() if len(chunk[0]) > 0]
+        if len(results) == 0:
+            return (np.zeros(0), np.zeros((0, len(self.labels))))
+        times = np.concatenate([times for times, data in results])
+        data = np.vstack([data for times, data in results])
+        return (times, data)
+
+    def _describe(self, writer):
+        ''' Sets the epoch, error flag and column descriptions of the
+            output file, copying those of columns kept from the input
+        '''
+        all_labels = list(self.reader.get_labels())
+        added = [label for label in self.labels if label not in all_labels]
+        writer._copy_columns(self.reader, self.labels, added)
+
+        # Transformed values may be fractions or flags, so integer
+        # columns are written as 8 byte floats
+        if self._steps:
+            types = writer.header.col_table['TYPE'][1:]
+            writer.set_types(['D' if t == 'I' else t for t in types])
+
+    def to_ff(self, name):
+        '''
+            Writes the output of the last step to the flat file name
+            (w/o extension) chunk by chunk; Returns the number of records
+            written
+
+            No file is left behind if a step raises an error or no
+            records are output
+        '''
+        if os.path.abspath(name) == os.path.abspath(self.reader.name):
+            raise Exception('Error: Output file cannot be the input file')
+
+        writer = ff_writer(name)
+        self._describe(writer)
+        rows = 0
+        try:
+            for times, data in self.iter_chunks():
+                if len(times) == 0:
+                    continue
+                writer.append(times, data)
+                rows += len(times)
+
+            if rows == 0:
+                raise Exception('Error: No records to write')
+            writer.close()
+        except BaseException:
+            # Don't leave a partial file behind
+            writer._discard()
+            raise
+        return rows
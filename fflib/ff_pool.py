@@ -0,0 +1,104 @@
+'''
+    Pool of open flat file readers for serving many small reads
+
+    Readers are kept open (see ff_reader.open) in least-recently-used
+    order, so repeated reads of the same files skip reopening the data
+    file and re-parsing the header. Pooled readers are thread-safe, so
+    the threads of a server can share them. When more than max_open
+    files are open, the least recently used reader is closed. A reader
+    is replaced if its header or data file has changed since it was
+    opened.
+
+    Usage:
+        ff = get_reader(name)
+        times, data = ff.read_range(start, stop)
+'''
+import os
+import threading
+from collections import OrderedDict
+from .ff_lib import ff_reader
+
+_pool = None
+
+def _file_stamp(reader):
+    ''' Returns the size and modification time of a reader's files '''
+    stamp = []
+    for filename in [f'{reader.name}.ffh', reader._filename()]:
+        info = os.stat(filename)
+        stamp.append((info.st_size, info.st_mtime_ns))
+    return tuple(stamp)
+
+class ff_reader_pool():
+    ''' Least-recently-used pool of open ff_readers '''
+    def __init__(self, max_open=128):
+        '''
+            Optional max_open argument specifies the maximum number of
+            readers to keep open
+        '''
+        self.max_open = max_open
+        self._readers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._readers)
+
+    def __contains__(self, name):
+        return os.path.abspath(name) in self._readers
+
+    def get(self, name):
+        ''' Returns an open ff_reader for the flat file, reusing the
+            pooled reader if the file has not changed
+        '''
+        key = os.path.abspath(name)
+        with self._lock:
+            entry = self._readers.get(key)
+        if entry is not None:
+            reader, stamp = entry
+            if _file_stamp(reader) == stamp:
+                with self._lock:
+                    if key in self._readers:
+                        self._readers.move_to_end(key)
+                return reader
+
+        # Read the header outside the lock so other files are not blocked;
+        # Pooled readers are shared, so they are opened thread-safe
+        reader = ff_reader(name, thread_safe=True)
+        stamp = _file_stamp(reader)
+
+        closed = []
+        with self._lock:
+            if key in self._readers:
+                closed.append(self._readers.pop(key)[0])
+            self._readers[key] = (reader, stamp)
+            while len(self._readers) > max(self.max_open, 1):
+                closed.append(self._readers.popitem(last=False)[1][0])
+
+        for old in closed:
+            old.close()
+        return reader
+
+    def remove(self, name):
+        ''' Closes and removes the reader for a file, if pooled '''
+        with self._lock:
+            entry = self._readers.pop(os.path.abspath(name), None)
+        if entry is not None:
+            entry[0].close()
+
+    def clear(self):
+        ''' Closes every pooled reader '''
+        with self._lock:
+            readers = [reader for reader, stamp in self._readers.values()]
+            self._readers.clear()
+        for reader in readers:
+            reader.close()
+
+def reader_pool():
+    ''' Returns the shared ff_reader_pool used by get_reader '''
+    global _pool
+    if _pool is None:
+        _pool = ff_reader_pool()
+    return _pool
+
+def get_reader(name):
+    ''' Returns an open ff_reader for the flat file from the shared pool '''
+    return reader_pool().get(name)
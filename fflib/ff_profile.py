@@ -0,0 +1,121 @@
+'''
+    Opt-in timing instrumentation for fflib operations
+
+    A profiler is a function called as callback(op, name, seconds, nbytes)
+    after each instrumented operation, where op is one of:
+        'header parse', 'data read', 'endian conversion', 'leap search',
+        'time conversion', 'formatting', 'header write', 'data write'
+    name is the flat file the operation was run for (or None if it was
+    not run for a file) and nbytes is the number of bytes processed
+    (0 if unknown). Operations may be nested, e.g. a 'time conversion'
+    includes the 'leap search' it runs.
+
+    Set a profiler with fflib.set_profiler(callback), or set the
+    FFLIB_PROFILE environment variable to print timings to stderr.
+    When no profiler is set, span() and tag() return a shared no-op
+    object, so the instrumentation does no timing or bookkeeping.
+'''
+import os
+import sys
+import threading
+from functools import wraps
+from time import perf_counter
+
+_profiler = None
+_local = threading.local()
+
+def set_profiler(callback):
+    ''' Sets the function called after each instrumented operation;
+        Passing None disables profiling
+    '''
+    global _profiler
+    _profiler = callback
+
+def get_profiler():
+    ''' Returns the current profiler function or None '''
+    return _profiler
+
+def print_profile(op, name, seconds, nbytes):
+    ''' Profiler that prints each operation's timing to stderr '''
+    print (f'fflib: {op:<18} {seconds*1000:10.3f} ms {nbytes:>12} bytes {name}',
+        file=sys.stderr)
+
+class _span():
+    ''' Times the body of a with-statement and reports it to the profiler '''
+    __slots__ = ('op', 'name', 'nbytes', 'prev', 'start')
+    def __init__(self, op, name, nbytes):
+        self.op = op
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        # Inherit the file name from an enclosing span or tag
+        self.prev = getattr(_local, 'name', None)
+        if self.name is None:
+            self.name = self.prev
+        _local.name = self.name
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        seconds = perf_counter() - self.start
+        _local.name = self.prev
+        callback = _profiler
+        if callback is not None and self.op is not None:
+            callback(self.op, self.name, seconds, self.nbytes)
+
+class _null_span():
+    ''' No-op span returned when profiling is disabled '''
+    __slots__ = ()
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    @property
+    def nbytes(self):
+        return 0
+
+    @nbytes.setter
+    def nbytes(self, value):
+        pass
+
+_null = _null_span()
+
+def span(op, name=None, nbytes=0):
+    ''' Returns a context manager that reports the time spent in its body
+        as the given operation; nbytes may also be set on the returned
+        object inside the body once it is known
+    '''
+    if _profiler is None:
+        return _null
+    return _span(op, name, nbytes)
+
+def tag(name):
+    ''' Returns a context manager that tags operations in its body
+        with the given file name without timing anything itself
+    '''
+    if _profiler is None:
+        return _null
+    return _span(None, name, 0)
+
+def profiled(op, size=None):
+    ''' Decorator that reports each call of a function as the given
+        operation; Optional size argument is a function mapping the
+        call's arguments to the number of bytes processed
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+
+            nbytes = size(*args) if size is not None else 0
+            with _span(op, None, nbytes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+if os.environ.get('FFLIB_PROFILE'):
+    set_profiler(print_profile)
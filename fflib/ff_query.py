@@ -0,0 +1,289 @@
+'''
+    Time-window queries across many flat files
+
+    A query is planned before any records are read: files are pruned by
+    the FIRST TIME/LAST TIME keywords in their headers (or their first
+    and last records when the keywords are missing), the window is
+    converted to each file's epoch and the row span of each remaining
+    file is found with a binary search over its time column. Rows are
+    then read in pieces by a pool of threads, with time ticks converted
+    to the output epoch a piece at a time.
+
+    Usage:
+        times, data = query(names, start, stop, ['Bx', 'By', 'Bz'])
+        for times, data in query(names, start, stop, chunk_size=65536):
+            ...
+'''
+import os
+from datetime import datetime
+import numpy as np
+from . import ff_time
+from .ff_lib import ff_reader
+from .ff_stats import flagged
+
+# Format of the FIRST TIME/LAST TIME header keywords
+time_fmt = '%Y %j %b %d %H:%M:%S.%f'
+
+# Seconds added around header times, which are truncated to the second
+# before a leap second
+time_slack = 2.0
+
+def _find_files(sources):
+    ''' Returns the flat file names (or readers) for a list of names or
+        readers, a directory or a glob pattern
+    '''
+    if isinstance(sources, (str, os.PathLike)):
+        import glob
+        sources = os.fspath(sources)
+        if os.path.isdir(sources):
+            pattern = os.path.join(sources, '*.ffh')
+        elif os.path.exists(f'{sources}.ffh'):
+            return [sources]
+        else:
+            pattern = sources
+        names = [name[:-4] if name.endswith('.ffh') else name
+            for name in sorted(glob.glob(pattern))]
+        if len(names) == 0:
+            raise Exception(f'Error: No flat files found for {sources}')
+        return names
+    return list(sources)
+
+def _header_tick_range(reader, epoch):
+    ''' Returns the first/last time ticks in the given epoch from the
+        header keywords, or None if they are missing or invalid
+    '''
+    values = [reader.header.get_value(key) for key in ['FIRST TIME', 'LAST TIME']]
+    try:
+        dates = [datetime.strptime(value.strip(), time_fmt) for value in values]
+    except (AttributeError, ValueError):
+        return None
+    t0, t1 = ff_time.dates_to_ticks(dates, epoch)
+    return (t0 - time_slack, t1 + time_slack)
+
+class ff_query():
+    ''' Plan for reading the records within a time window from several
+        flat files
+    '''
+    def __init__(self, sources, start=None, stop=None, columns=None,
+        epoch_out=None, max_workers=None):
+        '''
+            Parameters:
+            -----------
+            sources: list of ff_readers or strings, or string
+                Flat files to read, or a directory of flat files or a
+                glob pattern matching their header files
+            start, stop: float
+                Optional time ticks (in epoch_out) limiting the records to
+                [start, stop]
+            columns: list of strings
+                Column labels to return, defaults to all non-time columns
+                of the first file
+            epoch_out: string
+                Epoch of the returned time ticks, defaults to the epoch of
+                the first file
+            max_workers: int
+                Number of threads used to plan and read, defaults to the
+                number of CPUs
+        '''
+        self.start = start
+        self.stop = stop
+        self.max_workers = max_workers if max_workers else min(32, os.cpu_count() or 1)
+        sources = _find_files(sources)
+        if len(sources) == 0:
+            raise Exception('Error: No flat files to query')
+
+        # Readers created here are closed by close()
+        self._opened = []
+        open_reader = lambda ff : ff if isinstance(ff, ff_reader) else ff_reader(ff)
+        with self._executor(len(sources)) as pool:
+            readers = list(pool.map(open_reader, sources))
+        self._opened = [ff for ff, src in zip(readers, sources) if ff is not src]
+
+        first = readers[0]
+        self.epoch = first.get_epoch() if epoch_out is None else epoch_out
+        if self.epoch not in ff_time.epoch_to_dt:
+            raise Exception(f'Error: Unknown epoch {self.epoch}')
+        self.columns = first._column_labels(columns)
+        self.error_flag = float(first.get_error_flag())
+
+        with self._executor(len(readers)) as pool:
+            spans = list(pool.map(self._plan_file, readers))
+
+        # Order files by their first record in the output epoch
+        spans = [span for span in spans if span is not None]
+        spans.sort(key=lambda span : span[3])
+        self.spans = [span[:3] for span in spans]
+
+    def __str__(self):
+        return f'Flat File Query: {len(self.spans)} files, {self.num_records()} records'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _executor(self, tasks):
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(max(1, min(self.max_workers, tasks)))
+
+    def _window(self, epoch):
+        ''' Returns the query window in the given epoch '''
+        bounds = [self.start, self.stop]
+        if epoch == self.epoch:
+            return bounds
+        given = [t for t in bounds if t is not None]
+        converted = iter(ff_time.convert_ticks(np.array(given, dtype='f8'),
+            self.epoch, epoch))
+        return [None if t is None else float(next(converted)) for t in bounds]
+
+    def _plan_file(self, reader):
+        ''' Returns (reader, i0, i1, first tick) for the rows of a file
+            within the window, or None if none are
+        '''
+        epoch = reader.get_epoch()
+        start, stop = self._window(epoch)
+        reader._column_labels(self.columns)
+
+        tick_range = _header_tick_range(reader, epoch)
+        if tick_range is None:
+            if reader._num_records() == 0:
+                return None
+            tick_range = reader._memmap_time_range()
+        t0, t1 = tick_range
+        if (start is not None and t1 < start) or (stop is not None and t0 > stop):
+            return None
+
+        i0, i1 = reader._row_range(start, stop)
+        if i1 <= i0:
+            return None
+        first = float(reader._memmap_times()[i0])
+        if epoch != self.epoch:
+            first = float(ff_time.convert_ticks([first], epoch, self.epoch)[0])
+        return (reader, i0, i1, first)
+
+    def num_records(self):
+        ''' Returns the number of records the query will return '''
+        return sum([i1 - i0 for reader, i0, i1 in self.spans])
+
+    def _pieces(self, rows):
+        ''' Splits each file's span into (reader, a, b) pieces of at most
+            rows records
+        '''
+        for reader, i0, i1 in self.spans:
+            for a in range(i0, i1, rows):
+                yield (reader, a, min(a + rows, i1))
+
+    def _convert(self, reader, times, data):
+        ''' Converts a file's ticks and error flags to the output's '''
+        epoch = reader.get_epoch()
+        if epoch != self.epoch:
+            times[:] = ff_time.convert_ticks(times, epoch, self.epoch)
+        flag = float(reader.get_error_flag())
+        if flag != self.error_flag:
+            data[flagged(data, flag)] = self.error_flag
+
+    def read(self, piece_size=1048576):
+        '''
+            Returns a (times, data) tuple of every record in the window,
+            with files in order of their first record; Records are
+            decoded straight into the output arrays in pieces of at most
+            piece_size rows read in parallel
+        '''
+        n = self.num_records()
+        times = np.empty(n, dtype='f8')
+        data = np.empty((n, len(self.columns)), dtype='f8')
+        pieces = []
+        offset = 0
+        for reader, a, b in self._pieces(piece_size):
+            pieces.append((reader, a, b, offset))
+            offset += b - a
+
+        def read_piece(piece):
+            reader, a, b, offset = piece
+            records = reader._memmap_records()[a:b]
+            out_times = times[offset:offset + b - a]
+            out_data = data[offset:offset + b - a]
+            out_times[:] = records[reader._time_label()]
+            for i, label in enumerate(self.columns):
+                out_data[:,i] = records[label]
+            self._convert(reader, out_times, out_data)
+
+        with self._executor(len(pieces)) as pool:
+            list(pool.map(read_piece, pieces))
+        return (times, data)
+
+    def iter_chunks(self, chunk_size=65536):
+        '''
+            Iterates over (times, data) chunks of at most chunk_size
+            records in the window, reading up to max_workers chunks ahead
+            in the background; Chunks do not span files
+        '''
+        def read_chunk(piece):
+            reader, a, b = piece
+            times, data = reader._read_rows(a, b, self.columns)
+            self._convert(reader, times, data)
+            return (times, data)
+
+        pieces = self._pieces(chunk_size)
+        with self._executor(self.max_workers) as pool:
+            pending = []
+            for piece in pieces:
+                pending.append(pool.submit(read_chunk, piece))
+                if len(pending) > self.max_workers:
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
+
+    def close(self):
+        ''' Closes the readers opened for the query '''
+        for reader in self._opened:
+            reader.close()
+        self._opened = []
+
+def query(sources, start=None, stop=None, columns=None, epoch_out=None,
+    chunk_size=None, max_workers=None):
+    '''
+        Reads the records within a time window from several flat files
+
+        Parameters:
+        -----------
+        sources: list of ff_readers or strings, or string
+            Flat files to read, or a directory of flat files or a glob
+            pattern matching their header files
+        start, stop: float
+            Optional time ticks (in epoch_out) limiting the records to
+            [start, stop]
+        columns: list of strings
+            Column labels to return, defaults to all non-time columns of
+            the first file
+        epoch_out: string
+            Epoch of the returned time ticks, defaults to the epoch of
+            the first file
+        chunk_size: int
+            If given, returns an iterator over (times, data) chunks of at
+            most chunk_size records instead of a single (times, data)
+        max_workers: int
+            Number of threads used to plan and read, defaults to the
+            number of CPUs
+
+        Returns:
+        --------
+        A (times, data) tuple where times is an array of ticks in
+        epoch_out and data is an m x n array with one column per label,
+        or an iterator over such tuples if chunk_size is given
+
+        Note:
+        -----
+        Files are ordered by their first record in the window; Error
+        flags are replaced with the first file's error flag
+    '''
+    plan = ff_query(sources, start, stop, columns, epoch_out, max_workers)
+    if chunk_size is None:
+        with plan:
+            return plan.read()
+    return _iter_query(plan, chunk_size)
+
+def _iter_query(plan, chunk_size):
+    with plan:
+        yield from plan.iter_chunks(chunk_size)
@@ -0,0 +1,229 @@
+import numpy as np
+from .ff_lib import ff_reader, ff_writer
+from .ff_stats import flagged
+
+methods = ['linear', 'nearest', 'boxcar']
+
+class _resampler():
+    ''' Internal class that maps irregularly spaced records onto a uniform
+        time grid incrementally, one chunk at a time
+
+        Records are passed to feed() in time order; each call returns the
+        grid points that can be fully resolved from the records seen so far
+        and keeps only the trailing records needed for the next grid points
+    '''
+    def __init__(self, cadence, method='linear', start=None, stop=None,
+        flag=1e+34):
+        if method not in methods:
+            raise Exception(f'Error: Unknown resampling method {method}')
+
+        if cadence <= 0:
+            raise Exception('Error: Cadence must be positive')
+
+        self.cadence = cadence
+        self.method = method
+        self.start = start
+        self.stop = stop
+        self.flag = flag
+
+        # Boxcar averages cover [t - cadence/2, t + cadence/2)
+        self.half = cadence / 2 if method == 'boxcar' else 0
+
+        # Index of the next grid point to return and buffered records
+        self.index = 0
+        self.times = None
+        self.data = None
+
+    def feed(self, times, data, final=False):
+        ''' Adds records to the buffer and returns the (times, data)
+            of every grid point that can now be resolved; final indicates
+            that no more records will be passed
+        '''
+        times = np.asarray(times, dtype='f8')
+        data = np.asarray(data, dtype='f8')
+        if self.times is not None:
+            times = np.concatenate([self.times, times])
+            data = np.concatenate([self.data, data])
+
+        ncols = data.shape[1] if data.ndim == 2 else 0
+        if len(times) == 0:
+            return (np.zeros(0), np.zeros((0, ncols)))
+
+        if self.start is None:
+            self.start = times[0]
+
+        # Find the grid points resolved by the buffered records; points
+        # are only complete before the last record unless this is the end
+        if final:
+            limit = times[-1] if self.stop is None else self.stop
+            n = int(np.floor((limit - self.start) / self.cadence)) + 1
+        else:
+            limit = times[-1] - self.half
+            n = int(np.ceil((limit - self.start) / self.cadence))
+            if self.stop is not None:
+                n = min(n, int(np.floor((self.stop - self.start) / self.cadence)) + 1)
+
+        n = max(n, self.index)
+        grid = self.start + self.cadence * np.arange(self.index, n)
+        values = self._interpolate(times, data, grid)
+        self.index = n
+
+        # Keep the records still needed by the next grid point
+        next_time = self.start + self.cadence * self.index
+        keep = max(np.searchsorted(times, next_time - self.half, 'right') - 1, 0)
+        self.times = times[keep:]
+        self.data = data[keep:]
+
+        return (grid, values)
+
+    def _interpolate(self, times, data, grid):
+        ''' Evaluates the buffered records at each grid time '''
+        if self.method == 'boxcar':
+            return self._boxcar(times, data, grid)
+
+        n = len(times)
+        left = np.searchsorted(times, grid, 'right') - 1
+        inside = (left >= 0) & (grid <= times[-1])
+        left = np.clip(left, 0, max(n-2, 0))
+        right = np.minimum(left + 1, n - 1)
+
+        # Weight given to the right neighbor of each grid point
+        span = times[right] - times[left]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(span > 0, (grid - times[left]) / span, 0)
+        weight = np.clip(weight, 0, 1)[:,None]
+
+        left_vals, right_vals = data[left], data[right]
+        if self.method == 'nearest':
+            values = np.where(weight > 0.5, right_vals, left_vals)
+            bad = np.zeros(values.shape, dtype=bool)
+        else:
+            values = left_vals + weight * (right_vals - left_vals)
+            bad = (flagged(left_vals, self.flag) & (weight < 1)) | \
+                (flagged(right_vals, self.flag) & (weight > 0))
+
+        values[bad | ~inside[:,None]] = self.flag
+        return values
+
+    def _boxcar(self, times, data, grid):
+        ''' Averages the valid records within half a cadence of each
+            grid time using cumulative sums
+        '''
+        valid = ~flagged(data, self.flag) & np.isfinite(data)
+        sums = np.cumsum(np.where(valid, data, 0), axis=0)
+        counts = np.cumsum(valid, axis=0)
+        sums = np.vstack([np.zeros((1, data.shape[1])), sums])
+        counts = np.vstack([np.zeros((1, data.shape[1]), dtype=int), counts])
+
+        lo = np.searchsorted(times, grid - self.half, 'left')
+        hi = np.searchsorted(times, grid + self.half, 'left')
+        num = counts[hi] - counts[lo]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = (sums[hi] - sums[lo]) / num
+        values[num == 0] = self.flag
+        return values
+
+def ff_resample(reader, cadence_seconds, method='linear', start=None,
+    stop=None, columns=None, name=None, chunk_size=65536):
+    '''
+        Resamples a flat file onto a uniform time grid, streaming through
+        the file chunk by chunk so only a bounded number of records are
+        held in memory at once
+
+        Parameters:
+        -----------
+        reader: ff_reader or string
+            Flat file to resample
+        cadence_seconds: float
+            Spacing of the output time grid in seconds
+        method: string
+            'linear' - linear interpolation between neighboring records
+            'nearest' - value of the nearest record
+            'boxcar' - mean of the records within half a cadence
+        start, stop: float
+            Optional time ticks for the first/last grid point, defaulting
+            to the first/last ticks in the file
+        columns: list of strings
+            Column labels to resample, defaults to all non-time columns
+        name: string
+            Optional name of a flat file to write the result to
+        chunk_size: int
+            Number of records to read at a time
+
+        Returns:
+        --------
+        A (times, data) tuple with the grid ticks and an m x n array if
+        name is None, otherwise None after writing {name}.ffh/.ffd; No
+        file is written if there are no grid points
+
+        Note:
+        -----
+        Grid points outside of the file's time range and those depending
+        on error flagged values are set to the file's error flag
+    '''
+    if not isinstance(reader, ff_reader):
+        reader = ff_reader(reader)
+
+    labels = reader._column_labels(columns)
+    flag = float(reader.get_error_flag())
+
+    # Read one record past each end of the range (and half a cadence
+    # for boxcar averages) so points on the edges can be resolved
+    pad = cadence_seconds / 2 if method == 'boxcar' else 0
+    lo = None if start is None else start - pad
+    hi = None if stop is None else stop + pad
+    i0, i1 = reader._row_range(lo, hi)
+    i0, i1 = max(i0-1, 0), min(i1+1, reader._num_records())
+
+    writer = None
+    if name is not None:
+        writer = ff_writer(name)
+        writer._copy_columns(reader, labels)
+
+        # Resampled values may be fractions or flags, so integer
+        # columns are written as 8 byte floats
+        types = writer.header.col_table['TYPE'][1:]
+        writer.set_types(['D' if t == 'I' else t for t in types])
+
+    resampler = _resampler(cadence_seconds, method, start, stop, flag)
+    chunks = reader._iter_rows(i0, i1, labels, chunk_size)
+    empty = (np.zeros(0), np.zeros((0, len(labels))))
+
+    results = []
+    rows = 0
+    try:
+        for times, data, final in _mark_final(chunks, empty):
+            grid, values = resampler.feed(times, data, final=final)
+            if len(grid) == 0:
+                continue
+            elif writer is None:
+                results.append((grid, values))
+            else:
+                writer.append(grid, values)
+                rows += len(grid)
+
+        if writer is not None:
+            if rows == 0:
+                raise Exception('Error: No records to write')
+            writer.close()
+            return None
+    except BaseException:
+        # Don't leave a partial file behind
+        if writer is not None:
+            writer._discard()
+        raise
+
+    if len(results) == 0:
+        return empty
+
+    times = np.concatenate([grid for grid, values in results])
+    data = np.vstack([values for grid, values in results])
+    return (times, data)
+
+def _mark_final(chunks, empty):
+    ''' Yields (times, data, final) for each chunk, where final is True
+        for an empty chunk marking the end of the records
+    '''
+    for times, data in chunks:
+        yield (times, data, False)
+    yield empty + (True,)
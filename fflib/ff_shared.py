@@ -0,0 +1,315 @@
+'''
+    Shared-memory cache of decoded flat file data for worker processes
+
+    The first process to load a file through the cache decodes its data
+    (the m x n float64 array returned by ff_reader.get_data) into a
+    multiprocessing.shared_memory segment, stored column by column in
+    native byte order. Other processes attach to the same segment and get
+    read-only numpy views of it, so the data is held in memory once no
+    matter how many workers use it.
+
+    Segments are named after the data file's path, size and modification
+    time, so a changed file gets a new segment. A registry file shared by
+    every process (locked with flock) records each segment's size and
+    when it was last attached, and the least recently used segments are
+    removed once their total size would exceed max_bytes. Segments stay
+    in memory after the processes using them exit, until they are evicted
+    or clear() is called.
+
+    Each segment starts with a header of (magic, ready, rows, cols)
+    followed by the columns at data_offset; ready is set once the data is
+    written, so processes attaching while it is decoded wait for it.
+
+    Usage:
+        ff = ff_reader(name, shared_cache=True)
+        data = ff.get_data()
+'''
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+magic = b'FFS1'
+header_fmt = '=4sQQQ'
+data_offset = 64
+_cache = None
+
+# Segments this process has mapped, by name, as (path, SharedMemory)
+_attached = {}
+
+# Whether SharedMemory accepts track=False (Python 3.13+)
+_trackable = True
+
+def _segment_name(key):
+    ''' Returns the shared memory name for a (path, size, mtime) key,
+        short enough for systems limiting names to 31 characters
+    '''
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    return f'ff_{digest[:24]}'
+
+if shared_memory is not None:
+    class _segment(shared_memory.SharedMemory):
+        def __del__(self):
+            try:
+                self.close()
+            except BufferError:
+                # Arrays still view the segment, which is unmapped at exit
+                pass
+
+def _shared_memory(name, create=False, size=0):
+    ''' Opens a shared memory segment that is not removed when the
+        process that created or attached to it exits
+    '''
+    global _trackable
+    if _trackable:
+        try:
+            return _segment(name, create, size, track=False)
+        except TypeError:
+            _trackable = False
+
+    # Untrack the segment so the resource tracker does not unlink it
+    from multiprocessing import resource_tracker
+    shm = _segment(name, create, size)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+def _release(name):
+    ''' Unmaps a segment from this process unless arrays still view it '''
+    entry = _attached.pop(name, None)
+    if entry is None:
+        return
+    try:
+        entry[1].close()
+    except BufferError:
+        # Arrays returned by load() hold the buffer, so keep the mapping
+        # until a later release
+        _attached[name] = entry
+
+def _unlink(name):
+    ''' Removes a segment's name; Processes attached to it keep their
+        mapping until they release it
+    '''
+    try:
+        shm = _shared_memory(name)
+    except FileNotFoundError:
+        _release(name)
+        return
+
+    if not _trackable:
+        # unlink() unregisters the segment, so register it again first
+        from multiprocessing import resource_tracker
+        resource_tracker.register(shm._name, 'shared_memory')
+    shm.unlink()
+    shm.close()
+    _release(name)
+
+def _columns(shm, rows, cols):
+    ''' Returns the cols x rows array stored in a segment; frombuffer
+        holds the segment's buffer, so it cannot be unmapped under it
+    '''
+    data = np.frombuffer(shm.buf, dtype='f8', count=rows * cols,
+        offset=data_offset)
+    return data.reshape(cols, rows)
+
+def _array(shm):
+    ''' Returns the read-only m x n data array viewing a segment '''
+    tag, ready, rows, cols = struct.unpack_from(header_fmt, shm.buf, 0)
+    data = _columns(shm, rows, cols).T
+    data.flags.writeable = False
+    return data
+
+class ff_shared_cache():
+    ''' Cache of decoded flat file data in shared memory segments '''
+    def __init__(self, max_bytes=4294967296, registry=None, timeout=60):
+        '''
+            Optional max_bytes argument specifies the total size of the
+            segments to keep, registry the file listing them (shared by
+            every process using the same cache) and timeout the number
+            of seconds to wait for another process to finish decoding
+            before treating its segment as abandoned and decoding again
+        '''
+        if shared_memory is None:
+            raise Exception('Error: Shared caches require Python 3.8 or later')
+
+        if registry is None:
+            uid = getattr(os, 'getuid', lambda : 0)()
+            registry = os.path.join(tempfile.gettempdir(), f'fflib-shared-{uid}.json')
+
+        self.max_bytes = max_bytes
+        self.registry = registry
+        self.timeout = timeout
+
+    @contextmanager
+    def _entries(self):
+        ''' Locks the registry and yields its dictionary of segments,
+            writing it back afterwards
+        '''
+        try:
+            import fcntl
+        except ImportError:
+            raise Exception('Error: Shared caches require a POSIX system')
+
+        with open(f'{self.registry}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.registry, 'r') as fd:
+                    entries = json.load(fd)
+            except (OSError, ValueError):
+                entries = {}
+
+            yield entries
+
+            with open(self.registry, 'w') as fd:
+                json.dump(entries, fd)
+
+    def _key(self, reader):
+        filename = os.path.abspath(reader._filename())
+        info = os.stat(filename)
+        return (filename, info.st_size, info.st_mtime_ns)
+
+    def load(self, reader):
+        '''
+            Returns the reader's data as a read-only m x n float64 array
+            (see ff_reader.get_data) viewing a shared memory segment,
+            decoding the data into a new segment if no process has yet
+        '''
+        key = self._key(reader)
+        name = _segment_name(key)
+        if name not in _attached:
+            # Unmap older versions of the file
+            for other, (path, shm) in list(_attached.items()):
+                if path == key[0]:
+                    _release(other)
+
+            shm = self._attach(key)
+            if shm is None:
+                shm = self._create(key, reader)
+            _attached[name] = (key[0], shm)
+        return _array(_attached[name][1])
+
+    def _attach(self, key):
+        ''' Attaches to the segment for key once it is ready, or returns
+            None if there is no segment for it or it is not ready within
+            timeout seconds
+        '''
+        name = _segment_name(key)
+        try:
+            shm = _shared_memory(name)
+        except FileNotFoundError:
+            return None
+
+        # Wait for the process creating the segment to finish
+        deadline = time.monotonic() + self.timeout
+        while True:
+            if len(shm.buf) >= data_offset:
+                tag, ready, rows, cols = struct.unpack_from(header_fmt, shm.buf, 0)
+                if tag == magic and ready:
+                    break
+            if time.monotonic() > deadline:
+                # The process creating it failed or was killed, so remove
+                # the segment and decode the data again
+                shm.close()
+                self._discard(name)
+                return None
+            time.sleep(0.001)
+
+        with self._entries() as entries:
+            if name in entries:
+                entries[name]['used'] = time.time()
+        return shm
+
+    def _create(self, key, reader):
+        ''' Decodes the reader's data into a new segment for key '''
+        name = _segment_name(key)
+        rows = reader._num_records()
+        cols = len(reader.get_labels())
+        size = data_offset + rows * cols * 8
+        self._reserve(key, name, size)
+
+        try:
+            shm = _shared_memory(name, True, size)
+        except FileExistsError:
+            # Another process created it first
+            shm = self._attach(key)
+            return self._create(key, reader) if shm is None else shm
+
+        try:
+            struct.pack_into(header_fmt, shm.buf, 0, magic, 0, rows, cols)
+            self._fill(shm, reader, rows, cols)
+        except BaseException:
+            # Remove the partly written segment so no process waits on it
+            shm.close()
+            self._discard(name)
+            raise
+
+        struct.pack_into(header_fmt, shm.buf, 0, magic, 1, rows, cols)
+        return shm
+
+    def _fill(self, shm, reader, rows, cols):
+        ''' Decodes the reader's records into a segment's columns '''
+        data = _columns(shm, rows, cols)
+        try:
+            records = reader._memmap_records()
+            if reader.compressed:
+                records = records[:]
+            for i, label in enumerate(records.dtype.names):
+                data[i] = records[label]
+        finally:
+            # Release the buffer even if a traceback keeps this frame
+            del data
+
+    def _discard(self, name):
+        ''' Removes a segment and its registry entry '''
+        with self._entries() as entries:
+            _unlink(name)
+            entries.pop(name, None)
+
+    def _reserve(self, key, name, size):
+        ''' Registers a new segment, removing older segments for the same
+            file and the least recently used segments to make room for it
+        '''
+        with self._entries() as entries:
+            for other, entry in list(entries.items()):
+                if entry['path'] == key[0] and other != name:
+                    _unlink(other)
+                    del entries[other]
+
+            total = sum([entry['bytes'] for entry in entries.values()])
+            order = sorted(entries, key=lambda other : entries[other]['used'])
+            while order and total + size > self.max_bytes:
+                other = order.pop(0)
+                total -= entries[other]['bytes']
+                _unlink(other)
+                del entries[other]
+
+            entries[name] = {'path':key[0], 'bytes':size, 'used':time.time()}
+
+    def nbytes(self):
+        ''' Returns the total size of the registered segments '''
+        with self._entries() as entries:
+            return sum([entry['bytes'] for entry in entries.values()])
+
+    def clear(self):
+        ''' Removes every segment in the cache '''
+        with self._entries() as entries:
+            for name in entries:
+                _unlink(name)
+            entries.clear()
+
+def shared_cache():
+    ''' Returns the default ff_shared_cache used by
+        ff_reader(name, shared_cache=True)
+    '''
+    global _cache
+    if _cache is None:
+        _cache = ff_shared_cache()
+    return _cache
@@ -0,0 +1,136 @@
+import numpy as np
+
+def flagged(data, flag):
+    ''' Returns a boolean array marking values equal to the error flag,
+        either exactly or after being stored as a 4-byte float
+    '''
+    return (data == flag) | (data == float(np.float32(flag)))
+
+class ff_stats():
+    '''
+        Accumulates count/min/max/mean/std (and optionally approximate
+        quantiles) for each column of a stream of data chunks
+
+        Chunks are combined with the parallel variance algorithm of Chan
+        et al., so accumulators for different chunks or files can be
+        computed separately (e.g. in worker processes) and then combined
+        with merge()
+    '''
+    def __init__(self, labels, flag=None, sample_size=None, seed=0):
+        '''
+            Requires a list of column labels
+
+            Optional flag argument specifies an error flag value to
+            exclude from the statistics (NaNs are always excluded)
+
+            Optional sample_size argument specifies the number of values
+            per column to keep in a random sample for estimating quantiles
+        '''
+        ncols = len(labels)
+        self.labels = list(labels)
+        self.flag = flag
+        self.sample_size = sample_size
+        self.count = np.zeros(ncols, dtype='i8')
+        self.min = np.full(ncols, np.inf)
+        self.max = np.full(ncols, -np.inf)
+        self.mean = np.zeros(ncols)
+        self.m2 = np.zeros(ncols)
+        self.samples = [np.zeros(0) for i in range(ncols)]
+        self._random = np.random.RandomState(seed)
+
+    def update(self, data):
+        ''' Adds an m x n chunk of data to the statistics '''
+        data = np.asarray(data, dtype='f8')
+        valid = np.isfinite(data)
+        if self.flag is not None:
+            valid &= ~flagged(data, self.flag)
+
+        count = valid.sum(axis=0)
+        values = np.where(valid, data, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = values.sum(axis=0) / count
+        m2 = (np.where(valid, data - mean, 0) ** 2).sum(axis=0)
+        lo = np.where(valid, data, np.inf).min(axis=0, initial=np.inf)
+        hi = np.where(valid, data, -np.inf).max(axis=0, initial=-np.inf)
+        self._combine(count, lo, hi, mean, m2)
+
+        if self.sample_size:
+            for i in range(len(self.labels)):
+                column = data[:,i][valid[:,i]]
+                self.samples[i] = self._merge_samples(self.samples[i],
+                    self.count[i] - count[i], column, count[i])
+
+    def merge(self, other):
+        ''' Combines the statistics of another ff_stats object with
+            the same columns into this one
+        '''
+        if other.labels != self.labels:
+            raise Exception('Error: Cannot merge statistics for different columns')
+
+        prev_count = self.count.copy()
+        self._combine(other.count, other.min, other.max, other.mean, other.m2)
+        if self.sample_size:
+            for i in range(len(self.labels)):
+                self.samples[i] = self._merge_samples(self.samples[i],
+                    prev_count[i], other.samples[i], other.count[i])
+        return self
+
+    def _combine(self, count, lo, hi, mean, m2):
+        ''' Merges partial count/min/max/mean/m2 values into the totals '''
+        total = self.count + count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delta = mean - self.mean
+            frac = np.where(total > 0, count / total, 0)
+        update = count > 0
+        self.mean = np.where(update, self.mean + delta * frac, self.mean)
+        self.m2 = np.where(update, self.m2 + m2 + delta**2 * self.count * frac,
+            self.m2)
+        self.count = total
+        self.min = np.minimum(self.min, lo)
+        self.max = np.maximum(self.max, hi)
+
+    def _merge_samples(self, a, count_a, b, count_b):
+        ''' Merges two random samples drawn from count_a and count_b values
+            into a sample of at most sample_size values, drawing from each
+            in proportion to the number of values it represents
+        '''
+        n = self.sample_size
+        if len(a) + len(b) <= n:
+            return np.concatenate([a, b])
+
+        num_a = int(round(n * count_a / (count_a + count_b)))
+        num_a = min(max(num_a, n - len(b)), len(a))
+        num_b = min(n - num_a, len(b))
+        a = a[self._random.choice(len(a), num_a, replace=False)]
+        b = b[self._random.choice(len(b), num_b, replace=False)]
+        return np.concatenate([a, b])
+
+    def result(self, quantiles=None):
+        '''
+            Returns a dictionary mapping each column label to a dictionary
+            of its count, min, max, mean and std (population standard
+            deviation), with a 'quantiles' entry mapping each of the given
+            quantiles to its estimate if quantiles is not None
+        '''
+        info = {}
+        for i, label in enumerate(self.labels):
+            n = int(self.count[i])
+            empty = (n == 0)
+            stats = {
+                'count' : n,
+                'min' : np.nan if empty else self.min[i],
+                'max' : np.nan if empty else self.max[i],
+                'mean' : np.nan if empty else self.mean[i],
+                'std' : np.nan if empty else np.sqrt(self.m2[i] / n),
+            }
+
+            if quantiles is not None:
+                sample = self.samples[i]
+                values = [np.nan] * len(quantiles)
+                if len(sample) > 0:
+                    values = np.quantile(sample, quantiles)
+                stats['quantiles'] = dict(zip(quantiles, values))
+
+            info[label] = stats
+
+        return info
@@ -0,0 +1,128 @@
+import numpy as np
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
+
+class ff_table():
+    '''
+        Lazy table over the memory-mapped records of a flat file
+
+        Indexing only decodes the requested slice, converting it from the
+        file's big-endian format to native byte order, and recently used
+        slices are kept in a least-recently-used cache:
+
+            table['Bx'][i:j] - native array of column values for rows i to j
+            table[i:j] - native structured array of records i to j
+            table.loc[t0:t1] - native structured array of records w/ time
+                ticks in [t0, t1]
+            table.loc[t0:t1, 'Bx'] - column values for ticks in [t0, t1]
+            len(table) - number of records
+
+        Slices are returned from the cache, so they are read-only
+    '''
+    def __init__(self, reader, cache_size=32):
+        '''
+            Requires an ff_reader object for the file
+
+            Optional cache_size argument specifies the maximum number of
+            decoded slices to keep
+        '''
+        self.reader = reader
+        self.cache_size = cache_size
+        self.table = reader._memmap_records()
+        if reader.compressed:
+            # Compressed files can't be memory-mapped, so decompress them
+            self.table = self.table[:]
+        self.times = self.table[reader._time_label()]
+        self.dtype = self.table.dtype.newbyteorder('=')
+        self.loc = _time_indexer(self)
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.table)
+
+    def __str__(self):
+        return f'Table: {self.reader.name}'
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key not in self.table.dtype.names:
+                raise Exception(f'Error: Unknown column {key}')
+            return _column(self, key)
+
+        return self._slice(None, key)
+
+    def get_labels(self):
+        ''' Returns the label for each column '''
+        return list(self.table.dtype.names)
+
+    def _slice(self, label, key):
+        ''' Returns the native-endian values for the given row index or
+            slice of a column (or of every column if label is None)
+        '''
+        if not isinstance(key, slice):
+            row = int(key)
+            if label is None:
+                row = row + len(self.table) if row < 0 else row
+                return self.table[row:row+1].astype(self.dtype)[0]
+            return self.table[label][row].item()
+
+        # Look up the normalized slice in the cache
+        index = (label,) + key.indices(len(self.table))
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+
+        records = self.table[slice(*index[1:])]
+        if label is None:
+            values = records.astype(self.dtype)
+        else:
+            values = records[label].astype(self.dtype[label])
+
+        # Store slice and evict least recently used slices; Cached slices
+        # are shared by every lookup, so they can't be modified
+        values.flags.writeable = False
+        self._cache[index] = values
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        return values
+
+    def clear_cache(self):
+        ''' Removes all decoded slices from the cache '''
+        self._cache.clear()
+
+class _column():
+    ''' Column of an ff_table that decodes values when indexed '''
+    def __init__(self, table, label):
+        self.table = table
+        self.label = label
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, key):
+        return self.table._slice(self.label, key)
+
+    def __array__(self, dtype=None, copy=None):
+        values = self[:]
+        if dtype is not None:
+            return values.astype(dtype)
+        return values.copy() if copy else values
+
+class _time_indexer():
+    ''' Implements time tick based slicing for ff_table.loc '''
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, key):
+        label = None
+        if isinstance(key, tuple):
+            key, label = key
+
+        if not isinstance(key, slice) or key.step is not None:
+            raise Exception('Error: loc only supports [start:stop] time slices')
+
+        times = self.table.times
+        i0 = 0 if key.start is None else bisect_left(times, key.start)
+        i1 = len(times) if key.stop is None else bisect_right(times, key.stop)
+        return self.table._slice(label, slice(i0, max(i0, i1)))
@@ -1,8 +1,8 @@
 from datetime import datetime, timedelta
-from dateutil import parser
 import numpy as np
 from bisect import bisect, bisect_left, bisect_right
-from .leap_table import leap_table
+from .leap_table import leap_table, leap_seconds, posix_epoch
+from .ff_profile import profiled, span
 
 # Flat file strptime/strftime format
 ff_fmt = '%Y %j %b %d %H:%M:%S.%f'
@@ -23,8 +23,21 @@ epoch_to_dt = {
     'J2000':datetime(2000, 1, 1, 12) - timedelta(seconds=ofst_delta), # Julian time, counts leapseconds
 }
 
-ff_leap_table = leap_table()
+# Maps epochs to their offset in seconds from 1970-01-01 (UTC seconds
+# in the leap second table)
+epoch_to_posix = {epoch : int((dt - posix_epoch).total_seconds())
+    for epoch, dt in epoch_to_dt.items()}
 
+# Epochs whose ticks count leap seconds
+leap_epochs = ['Y2000', 'J2000']
+
+# Nanoseconds per second for int64 nanosecond ticks
+ns_per_sec = 1000000000
+
+# Number of bytes in an array of times, for profiling
+_times_size = lambda times, *args, **kwargs : len(times) * 8
+
+@profiled('leap search', _times_size)
 def find_leaps(times, epoch, key='date', exact_leaps=False):
     ''' Searches for leap seconds to adjust for in times
 
@@ -56,47 +69,29 @@ def find_leaps(times, epoch, key='date', exact_leaps=False):
     # Get leap info and determine which timedelta is used
     dates, seconds, leap_vals = get_leap_info(epoch)
     date_mode = (key == 'date')
-    leap_dates = dates if date_mode else seconds
-
-    # Extract time range info
     n = len(times)
-    start_time = times[0]
-    stop_time = times[-1]
-
-    # Get starting leap and index range to search for leaps
-    base_leap = 0
-    start = 0
-    if start_time < leap_dates[0]:
-        base_leap = 0
-    else:
-        start = bisect_left(leap_dates, start_time)
-        start = max(start-1, 0)
-    end = bisect_right(leap_dates, stop_time)
-
-    # Clip leap info to current time range
-    search_dates = leap_dates[start:end+1]
-    search_leaps = leap_vals[start:end+1]
-
-    if key != 'date':
-        search_dates = np.array(search_dates) - 1
 
-    # Find index each leap is at
-    indices = []
+    # Find index each leap is at; Datetimes are searched with bisect
+    # since converting every date to a tick would cost more than the search
     leap_ranges = []
-    for date in search_dates:
-        index = bisect_left(times, date)
-        indices.append(index)
+    if date_mode:
+        indices = [bisect_left(times, date) for date in dates]
+    else:
+        times = np.asarray(times)
+        search_dates = seconds - 1
+        indices = np.searchsorted(times, search_dates, 'left')
 
         # Find index where leaps end if specified
-        if exact_leaps and (not date_mode):
-            right_index = bisect_left(times, date+1, lo=index)
-            if right_index - index > 0:
-                leap_ranges.append((index, right_index))
-        
+        if exact_leaps:
+            right = np.searchsorted(times, search_dates + 1, 'left')
+            leap_ranges = [(int(sI), int(eI)) for sI, eI in zip(indices, right)
+                if eI > sI]
+
     # Assemble leap info into tuples of ((sI, eI), val)
-    # where (sI, eI) gives the index range and val gives the leap second
-    leaps = [base_leap] + list(search_leaps)
-    indices = [0] + list(indices) + [n]
+    # where (sI, eI) gives the index range and val gives the leap second;
+    # Times before the first leap table entry are not adjusted
+    leaps = [0] + list(leap_vals)
+    indices = [0] + [int(index) for index in indices] + [n]
     num_leaps = len(leaps)
     pairs = []
     for i in range(num_leaps):
@@ -118,14 +113,157 @@ def get_leap_info(epoch):
     ''' Returns leapseconds in datetime format, ticks since the given epoch, 
         and their respective leap offsets
     '''
-    dates = ff_leap_table['date']
-    epoch_dt = epoch_to_dt[epoch]
-    diff = [(d-epoch_dt).total_seconds() for d in dates]
-    leapvalues = ff_leap_table['leap_sec']
-    leapvalues = [leap - table_delta for leap in leapvalues]
-    seconds = [sec + leap for sec, leap in zip(diff, leapvalues)]
+    leaps = leap_seconds()
+    dates = leap_table()['date']
+    diff = (leaps.utc - epoch_to_posix[epoch]).astype('f8')
+    leapvalues = (leaps.offsets - table_delta).astype('f8')
+    seconds = diff + leapvalues
     return dates, seconds, leapvalues
 
+def _tick_leaps(ticks, epoch, unit=1):
+    ''' Returns the leap second offset (in whole seconds) included in each
+        tick relative to the given epoch; Ticks within a leap second get
+        the new offset, matching ticks_to_dates
+
+        unit is the number of tick units per second (ns_per_sec for
+        nanosecond ticks)
+    '''
+    if epoch not in leap_epochs:
+        return np.zeros(np.shape(ticks), dtype=np.int64)
+
+    # Ticks count the leap seconds after table_delta, so they are TAI
+    # seconds relative to the epoch date plus table_delta
+    origin = epoch_to_posix[epoch] + table_delta
+    offsets = leap_seconds().tai_offsets(ticks, origin, unit, before=table_delta)
+    return offsets - table_delta
+
+def _utc_leaps(seconds, epoch, unit=1):
+    ''' Returns the leap second offset (in whole seconds) to add to seconds
+        since the epoch date that do not count leap seconds, matching
+        dates_to_ticks
+    '''
+    if epoch not in leap_epochs:
+        return np.zeros(np.shape(seconds), dtype=np.int64)
+
+    offsets = leap_seconds().utc_offsets(seconds, epoch_to_posix[epoch], unit,
+        before=table_delta)
+    return offsets - table_delta
+
+@profiled('time conversion', _times_size)
+def convert_ticks(ticks, from_epoch, to_epoch):
+    ''' 
+        Converts ticks relative to one epoch to ticks relative to another
+        without going through datetime objects
+
+        Parameters:
+        -----------
+        ticks: array_like
+            float64 (or int64) seconds since from_epoch
+        from_epoch, to_epoch: string
+            Epochs of the given and returned ticks
+
+        Returns:
+        --------
+        An array of seconds since to_epoch with the same dtype as ticks,
+        equal to dates_to_ticks(ticks_to_dates(ticks, from_epoch), to_epoch)
+        but without rounding to microseconds
+
+        Note:
+        -----
+        Ticks within a leap second are mapped to the second before it
+        when converting to an epoch that does not count leap seconds;
+        Between two epochs that count leap seconds, ticks are shifted by
+        the difference between the epochs
+    '''
+    return _convert(np.asarray(ticks), from_epoch, to_epoch, 1)
+
+def _convert(ticks, from_epoch, to_epoch, unit):
+    if from_epoch == to_epoch:
+        return ticks.copy()
+
+    # Remove leap seconds counted by from_epoch, shift to to_epoch and
+    # add the leap seconds counted by to_epoch as one integer offset
+    shift = epoch_to_posix[from_epoch] - epoch_to_posix[to_epoch]
+    if from_epoch in leap_epochs and to_epoch in leap_epochs:
+        # Both count the same leap seconds, so ticks only shift
+        return ticks + ticks.dtype.type(shift * unit)
+
+    offset = (shift - _tick_leaps(ticks, from_epoch, unit)) * unit
+    offset = offset + _utc_leaps(ticks + offset, to_epoch, unit) * unit
+    return ticks + offset.astype(ticks.dtype)
+
+def ticks_to_ns(ticks):
+    ''' Maps float64 seconds to int64 nanoseconds, rounding each tick to
+        the nearest nanosecond
+    '''
+    ticks = np.asarray(ticks, dtype='f8')
+    whole = np.floor(ticks)
+    frac = np.rint((ticks - whole) * ns_per_sec).astype(np.int64)
+    return whole.astype(np.int64) * ns_per_sec + frac
+
+def ns_to_ticks(ns):
+    ''' Maps int64 nanoseconds to float64 seconds '''
+    whole, frac = np.divmod(np.asarray(ns, dtype=np.int64), ns_per_sec)
+    return whole.astype('f8') + frac / ns_per_sec
+
+@profiled('time conversion', _times_size)
+def convert_ns(ns, from_epoch, to_epoch):
+    ''' Same as convert_ticks for int64 nanoseconds since from_epoch,
+        using only integer arithmetic so the result is exact
+    '''
+    return _convert(np.asarray(ns, dtype=np.int64), from_epoch, to_epoch, 
+        ns_per_sec)
+
+@profiled('time conversion', _times_size)
+def ns_to_dates(ns, epoch):
+    ''' 
+        Maps int64 nanoseconds relative to an epoch to datetime objects
+
+        Parameters:
+        -----------
+        ns: array_like
+            int64 nanoseconds since epoch time
+        epoch: string
+            epoch that ns is relative to
+
+        Returns:
+        --------
+        A list of datetimes, rounded to the nearest microsecond
+
+        Note:
+        -----
+        Leap seconds are removed with integer arithmetic, so unlike
+        ticks_to_dates no float rounding occurs before the final
+        rounding to microseconds; Ticks within a leap second map to the
+        second before it, as in ticks_to_dates
+    '''
+    ns = ns_to_datetime64(ns, epoch).astype(np.int64)
+    us = (ns + 500) // 1000
+    return us.astype('datetime64[us]').tolist()
+
+@profiled('time conversion', _times_size)
+def ns_to_datetime64(ns, epoch):
+    ''' Maps int64 nanoseconds relative to an epoch to a datetime64[ns]
+        array of UTC times, see ns_to_dates
+    '''
+    ns = np.asarray(ns, dtype=np.int64)
+    ns = ns - _tick_leaps(ns, epoch, ns_per_sec) * ns_per_sec
+    return np.datetime64(epoch_to_dt[epoch], 'ns') + ns.astype('timedelta64[ns]')
+
+@profiled('time conversion', _times_size)
+def dates_to_ns(dates, epoch):
+    ''' 
+        Maps datetime objects (or a datetime64 array) to int64 
+        nanoseconds since epoch, see dates_to_ticks
+    '''
+    if len(dates) > 0 and getattr(dates[0], 'tzinfo', None) is not None:
+        dates = [dt.replace(tzinfo=None) for dt in dates]
+
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+    ns = (dates - np.datetime64(epoch_to_dt[epoch], 'ns')).astype(np.int64)
+    return ns + _utc_leaps(ns, epoch, ns_per_sec) * ns_per_sec
+
+@profiled('time conversion', _times_size)
 def dates_to_ticks(dates, epoch):
     ''' Maps a list of datetime objects to seconds since epoch 
 
@@ -166,6 +304,7 @@ def dates_to_ticks(dates, epoch):
 
     return secs
 
+@profiled('time conversion', _times_size)
 def ticks_to_dates_helper(ticks, epoch, leap_search=True):
     '''
         Inner function used by ticks_to_dates with an additional
@@ -249,14 +388,15 @@ def ticks_to_iso(ticks, epoch):
     datevals, leap_ranges = ticks_to_dates_helper(ticks, epoch) 
  
     # Convert datetimes to timestamps (%-formatting faster than strftime)
-    fmt_str = '%d-%02d-%02dT%02d:%02d:%02d.%06d'
-    dt_to_ts = lambda dt : (fmt_str % (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second, dt.microsecond))[:-3]
-    datestrs = list(map(dt_to_ts, datevals))
+    with span('formatting', nbytes=len(datevals) * 23):
+        fmt_str = '%d-%02d-%02dT%02d:%02d:%02d.%06d'
+        dt_to_ts = lambda dt : (fmt_str % (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second, dt.microsecond))[:-3]
+        datestrs = list(map(dt_to_ts, datevals))
 
-    # Set special timestamp for true leapseconds
-    replace_func = lambda s : s.replace(':59.', ':60.')
-    for sI, eI in leap_ranges:
-        datestrs[sI:eI] = list(map(replace_func, datestrs[sI:eI]))
+        # Set special timestamp for true leapseconds
+        replace_func = lambda s : s.replace(':59.', ':60.')
+        for sI, eI in leap_ranges:
+            datestrs[sI:eI] = list(map(replace_func, datestrs[sI:eI]))
 
     return datestrs
 
@@ -283,13 +423,14 @@ def ticks_to_timestamps(ticks, epoch):
     datevals, leap_ranges = ticks_to_dates_helper(ticks, epoch)
     
     # Convert datetimes to timestamps (%-formatting faster than strftime)
-    dt_to_ts = lambda dt : dt.strftime(ff_fmt)
-    datestrs = [dt_to_ts(dt) for dt in datevals]
+    with span('formatting', nbytes=len(datevals) * 31):
+        dt_to_ts = lambda dt : dt.strftime(ff_fmt)
+        datestrs = [dt_to_ts(dt) for dt in datevals]
 
-    # Set special timestamp for true leapseconds
-    replace_func = lambda s : s.replace(':59.', ':60.')
-    for sI, eI in leap_ranges:
-        datestrs[sI:eI] = list(map(replace_func, datestrs[sI:eI]))
+        # Set special timestamp for true leapseconds
+        replace_func = lambda s : s.replace(':59.', ':60.')
+        for sI, eI in leap_ranges:
+            datestrs[sI:eI] = list(map(replace_func, datestrs[sI:eI]))
 
     return datestrs
 
@@ -320,6 +461,7 @@ def utc_to_date(ts):
 
 def iso_to_date(ts):
     ''' Converts ISO timestamp to datetime '''
+    from dateutil import parser
     date = parser.isoparse(ts)
     return date
 
@@ -1,12 +1,175 @@
 import sys
-from .ff_lib import ff_reader
+import os
+from .ff_lib import ff_reader, ff_header
 
 def fflist():
     name = sys.argv[1]
     ff = ff_reader(name)
     ff.list_header()
+    print_gap_summary(ff.scan_gaps())
 
 def ff2csv():
     name = sys.argv[1]
     ff = ff_reader(name)
-    ff.to_csv()
\ No newline at end of file
+    ff.to_csv()
+
+def ff2npz():
+    ''' Writes flat file columns to a .npz (or Arrow IPC) file '''
+    import argparse
+    parser = argparse.ArgumentParser(prog='ff2npz',
+        description='Export flat file columns to .npz or Arrow IPC')
+    parser.add_argument('name', help='flat file to read w/o extension')
+    parser.add_argument('-o', '--output', help='file to write, defaults to name')
+    parser.add_argument('-z', '--compress', action='store_true',
+        help='compress the arrays (zstd for Arrow files)')
+    parser.add_argument('--arrow', action='store_true',
+        help='write an Arrow IPC file (requires pyarrow)')
+    parser.add_argument('--start', help='first time (tick or ISO timestamp)')
+    parser.add_argument('--stop', help='last time (tick or ISO timestamp)')
+    parser.add_argument('--columns', nargs='+', help='column labels to keep')
+    args = parser.parse_args()
+
+    ff = ff_reader(args.name)
+    epoch = ff.get_epoch()
+    start, stop = parse_tick(args.start, epoch), parse_tick(args.stop, epoch)
+    if args.arrow:
+        compression = 'zstd' if args.compress else None
+        ff.to_arrow(args.output, compression, args.columns, start, stop)
+    else:
+        ff.to_npz(args.output, args.compress, args.columns, start, stop)
+
+def ffstats():
+    name = sys.argv[1]
+    columns = sys.argv[2:] if len(sys.argv) > 2 else None
+    ff = ff_reader(name)
+    info = ff.stats(columns)
+
+    # Print one row of statistics per column
+    keys = ['count', 'min', 'max', 'mean', 'std']
+    width = max([len(label) for label in info] + [6])
+    print (f'{"Column":<{width}} ' + ' '.join([f'{key:>14}' for key in keys]))
+    for label, stats in info.items():
+        values = ' '.join([f'{stats[key]:>14.7g}' for key in keys])
+        print (f'{label:<{width}} {values}')
+
+def ffverify():
+    ''' Checks each flat file given against its checksums in parallel '''
+    from concurrent.futures import ThreadPoolExecutor
+    names = sys.argv[1:]
+    def verify(name):
+        try:
+            return ff_reader(name).verify()
+        except Exception as e:
+            return [str(e)]
+
+    with ThreadPoolExecutor(min(len(names), os.cpu_count() or 1) or 1) as pool:
+        results = list(pool.map(verify, names))
+
+    failed = 0
+    for name, errors in zip(names, results):
+        print (f'{name}: ' + ('OK' if not errors else 'FAILED'))
+        for error in errors:
+            print (f'    {error}')
+        failed += (len(errors) > 0)
+
+    sys.exit(1 if failed else 0)
+
+def ffedit():
+    ''' Updates keywords, column descriptions or the abstract in a
+        header file without rewriting the data file
+    '''
+    import argparse
+    parser = argparse.ArgumentParser(prog='ffedit', 
+        description='Edit a flat file header in place')
+    parser.add_argument('name', help='flat file name w/o extension')
+    parser.add_argument('-k', '--keyword', action='append', default=[],
+        metavar='KEY=VALUE', help='set a header keyword')
+    parser.add_argument('-l', '--label', action='append', default=[],
+        metavar='LABEL=NEW', help='rename a column')
+    parser.add_argument('-u', '--units', action='append', default=[],
+        metavar='LABEL=UNITS', help='set the units of a column')
+    parser.add_argument('-s', '--source', action='append', default=[],
+        metavar='LABEL=SOURCE', help='set the source of a column')
+    parser.add_argument('-a', '--abstract', metavar='FILE',
+        help='replace the abstract with the lines of a text file')
+    args = parser.parse_args()
+
+    def split_pairs(items):
+        pairs = [item.split('=', 1) for item in items]
+        for pair in pairs:
+            if len(pair) != 2:
+                parser.error(f'Expected KEY=VALUE, got {pair[0]}')
+        return {key.strip():value.strip() for key, value in pairs}
+
+    abstract = None
+    if args.abstract:
+        with open(args.abstract, 'r') as fd:
+            abstract = fd.read().splitlines()
+
+    # Keywords may contain spaces, so pass them as a dictionary
+    keywords = split_pairs(args.keyword)
+    ff_header.update_in_place(args.name, 
+        columns=split_pairs(args.label) or None,
+        units=split_pairs(args.units) or None,
+        sources=split_pairs(args.source) or None,
+        abstract=abstract, **keywords)
+
+def parse_tick(value, epoch):
+    ''' Maps a command line time (a tick or an ISO timestamp) to a tick '''
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        from . import ff_time
+        return ff_time.date_to_tick(ff_time.iso_to_date(value), epoch)
+
+def ffslice():
+    ''' Copies a time range and/or subset of columns to a new flat file '''
+    import argparse
+    from .ff_ops import ff_extract
+    parser = argparse.ArgumentParser(prog='ffslice',
+        description='Extract records from a flat file')
+    parser.add_argument('src', help='flat file to read w/o extension')
+    parser.add_argument('dst', help='flat file to write w/o extension')
+    parser.add_argument('--start', help='first time (tick or ISO timestamp)')
+    parser.add_argument('--stop', help='last time (tick or ISO timestamp)')
+    parser.add_argument('--columns', nargs='+', help='column labels to keep')
+    args = parser.parse_args()
+
+    ff = ff_reader(args.src)
+    epoch = ff.get_epoch()
+    rows = ff_extract(ff, args.dst, parse_tick(args.start, epoch),
+        parse_tick(args.stop, epoch), args.columns)
+    print (f'Wrote {rows} records to {args.dst}')
+
+def ffcat():
+    ''' Concatenates flat files into a single flat file '''
+    import argparse
+    from .ff_ops import ff_concat
+    parser = argparse.ArgumentParser(prog='ffcat',
+        description='Concatenate flat files')
+    parser.add_argument('inputs', nargs='+', help='flat files w/o extension')
+    parser.add_argument('-o', '--output', required=True, 
+        help='flat file to write w/o extension')
+    args = parser.parse_args()
+
+    rows = ff_concat(args.inputs, args.output)
+    print (f'Wrote {rows} records to {args.output}')
+
+def print_gap_summary(info):
+    ''' Prints the results of ff_reader.scan_gaps() '''
+    gaps = info['gaps']
+    lines = [
+        f'Cadence: {info["cadence"]}',
+        f'Gaps: {len(gaps)}',
+        f'Duplicate times: {len(info["duplicates"])}',
+        f'Non-monotonic times: {len(info["non_monotonic"])}',
+        f'Leap seconds: {len(info["leaps"])}',
+    ]
+
+    if len(gaps) > 0:
+        largest = max([t1 - t0 for t0, t1 in gaps])
+        lines[1] += f' (threshold = {info["threshold"]}, largest = {largest})'
+
+    print ('\n'.join(lines))
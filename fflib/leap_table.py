@@ -1,41 +1,210 @@
-from datetime import datetime
-from sre_parse import GLOBAL_FLAGS
+from datetime import datetime, timedelta
 import numpy as np
 import os
+import zlib
 
 relative_path = os.path.dirname(__file__)
 leap_file = 'leap-seconds.list'
-date_fmt = '# %d %b %Y'
 table_fmt = [('tai', 'f8'), ('leap_sec', 'f8'), ('date', datetime)]
 _leap_table = None
+_leap_table_version = None
+_leap_seconds = None
 
-def map_item(item):
-    tai_sec, leap_sec, date = item
-    return (float(tai_sec), float(leap_sec), datetime.strptime(date, date_fmt))
+# Leap second list timestamps are seconds since 1900-01-01 (NTP epoch)
+ntp_epoch = datetime(1900, 1, 1)
+posix_epoch = datetime(1970, 1, 1)
+ntp_to_posix = int((posix_epoch - ntp_epoch).total_seconds())
+
+def _leap_file_path():
+    return os.path.join(relative_path, leap_file)
+
+def _cache_file_path(path):
+    ''' Returns the path of the precompiled form of a leap second list '''
+    return os.path.splitext(path)[0] + '.npy'
+
+def parse_leap_list(text):
+    ''' Parses the text of a leap second list and returns int64 arrays
+        of the NTP timestamp and TAI - UTC offset of each entry
+    '''
+    # Remove comments and blank lines and split each line by whitespace
+    lines = text.split('\n')
+    items = [line.split()[:2] for line in lines if (line.strip() and line[0] != '#')]
+    items = np.array(items, dtype='i8').reshape((-1, 2))
+    return (items[:,0], items[:,1])
+
+def write_cache(path=None):
+    ''' Writes the precompiled form of a leap second list (by default
+        fflib's leap-seconds.list) to a .npy file next to it
+
+        The cache is a single int64 array holding the CRC32 of the list
+        it was built from, the number of entries n, then the n NTP
+        timestamps and the n leap offsets
+    '''
+    path = _leap_file_path() if path is None else path
+    with open(path, 'rb') as fd:
+        text = fd.read()
+
+    ntp, leaps = parse_leap_list(text.decode('ascii'))
+    header = [zlib.crc32(text), len(ntp)]
+    cache = np.concatenate([header, ntp, leaps]).astype('i8')
+    np.save(_cache_file_path(path), cache)
+
+def load_leap_seconds(path=None):
+    ''' Returns the (ntp, leaps) int64 arrays for a leap second list,
+        using the precompiled cache if it was built from the same list
+    '''
+    path = _leap_file_path() if path is None else path
+    with open(path, 'rb') as fd:
+        text = fd.read()
+
+    try:
+        cache = np.load(_cache_file_path(path))
+        crc, n = cache[:2]
+        if crc == zlib.crc32(text):
+            return (cache[2:2+n], cache[2+n:2+2*n])
+    except (OSError, ValueError):
+        pass
+
+    return parse_leap_list(text.decode('ascii'))
+
+class LeapSeconds():
+    '''
+        Leap second table stored as int64 arrays with vectorized
+        conversions between UTC and TAI
+
+        UTC times are POSIX seconds since 1970-01-01 (which do not count
+        leap seconds) and TAI times are the same seconds plus the TAI - UTC
+        offset in effect, so TAI times count every elapsed second; Times
+        before the first table entry use an offset of 0
+
+        Attributes:
+            utc - UTC seconds at which each offset takes effect
+            offsets - TAI - UTC offset in seconds for each entry
+            tai - TAI seconds at which each offset takes effect
+            version - incremented each time the table is (re)loaded
+    '''
+    def __init__(self, path=None):
+        '''
+            Optional path argument specifies a leap second list to read
+            instead of the one distributed with fflib
+        '''
+        self.path = path
+        self.version = 0
+        self._crc = None
+        self.reload()
+
+    def __len__(self):
+        return len(self.utc)
+
+    def reload(self):
+        ''' Re-reads the leap second list (e.g. after it is updated)
+            and returns True if the table changed
+        '''
+        path = _leap_file_path() if self.path is None else self.path
+        with open(path, 'rb') as fd:
+            crc = zlib.crc32(fd.read())
+
+        if crc == self._crc:
+            return False
+
+        ntp, offsets = load_leap_seconds(self.path)
+        self.utc = ntp - ntp_to_posix
+        self.offsets = offsets
+        self.tai = self.utc + self.offsets
+        self.version += 1
+        self._crc = crc
+        return True
+
+    def _utc_index(self, utc, origin=0, unit=1):
+        ''' Returns the index of the entry in effect at each UTC time,
+            or -1 before the first entry
+        '''
+        starts = (self.utc - origin) * unit
+        return np.searchsorted(starts, utc, 'right') - 1
+
+    def _tai_index(self, tai, origin=0, unit=1):
+        ''' Returns the index of the entry in effect at each TAI time,
+            or -1 before the first entry; Times within a leap second get
+            the entry that inserts it
+        '''
+        starts = (self.tai - 1 - origin) * unit
+        return np.searchsorted(starts, tai, 'right') - 1
+
+    def _offsets_at(self, index, before=0):
+        ''' Returns the offset for each table index, before where index < 0 '''
+        index = np.asarray(index)
+        offsets = self.offsets[np.maximum(index, 0)]
+        return np.where(index >= 0, offsets, before)
+
+    def utc_offsets(self, utc, origin=0, unit=1, before=0):
+        '''
+            Returns the TAI - UTC offset in seconds in effect at each UTC
+            time
+
+            Optional origin and unit arguments give the UTC seconds the
+            times are relative to and the number of time units per second
+            (e.g. 10**9 for nanoseconds); Times before the first entry get
+            the offset before
+        '''
+        return self._offsets_at(self._utc_index(utc, origin, unit), before)
+
+    def tai_offsets(self, tai, origin=0, unit=1, before=0):
+        '''
+            Returns the TAI - UTC offset in seconds in effect at each TAI
+            time; Times within a leap second get the new offset
+
+            Optional origin, unit and before arguments are the same as for
+            utc_offsets, with origin in TAI seconds
+        '''
+        return self._offsets_at(self._tai_index(tai, origin, unit), before)
+
+    def utc_to_tai(self, utc):
+        ''' Maps UTC seconds to TAI seconds '''
+        utc = np.asarray(utc)
+        return utc + self.utc_offsets(utc)
+
+    def tai_to_utc(self, tai):
+        ''' Maps TAI seconds to UTC seconds; Times within a leap second
+            map to the second before it (23:59:59 is repeated)
+        '''
+        tai = np.asarray(tai)
+        return tai - self.tai_offsets(tai)
+
+    def is_leap(self, tai):
+        ''' Returns a boolean array marking TAI times that fall within
+            an inserted leap second (23:59:60)
+        '''
+        tai = np.asarray(tai)
+        index = self._tai_index(tai)
+        inserted = (index >= 1) & (self.offsets[np.maximum(index, 0)] >
+            self.offsets[np.maximum(index-1, 0)])
+        return inserted & (tai < self.tai[np.maximum(index, 0)])
+
+    def dates(self):
+        ''' Returns the UTC datetime each offset takes effect at '''
+        return [posix_epoch + timedelta(seconds=int(sec)) for sec in self.utc]
+
+def leap_seconds():
+    ''' Returns the shared LeapSeconds object for fflib's leap second list '''
+    global _leap_seconds
+    if _leap_seconds is None:
+        _leap_seconds = LeapSeconds()
+    return _leap_seconds
 
 def leap_table():
     ''' Opens leap second list and returns a named numpy
         array of each leap second entry
     '''
-    global _leap_table
-    if _leap_table is not None:
+    global _leap_table, _leap_table_version
+    leaps = leap_seconds()
+    if _leap_table is not None and _leap_table_version == leaps.version:
         return _leap_table
 
-    # Open leap second list and read lines
-    leap_file_path = os.path.join(relative_path, leap_file)
-    fd = open(leap_file_path, 'r')
-    lines = fd.readlines()
-    fd.close()
-
-    # Remove comments
-    items = [line.strip('\n') for line in lines if (len(line) > 0 and line[0] != '#')]
-
-    # Split each line by tabs
-    items = [item.split('\t') for item in items]
-
-    # Map each string in line to objects and return named table
-    table = list(map(map_item, items))
+    # Map each entry to (tai, leap, date) and return named table
+    ntp = (leaps.utc + ntp_to_posix).astype('f8')
+    table = list(zip(ntp, leaps.offsets.astype('f8'), leaps.dates()))
     table = np.array(table, dtype=table_fmt)
     _leap_table = table
+    _leap_table_version = leaps.version
 
-    return table
\ No newline at end of file
+    return table
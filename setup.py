@@ -11,6 +11,8 @@ setuptools.setup(
     description='Python Flat File Utility Library',
     url="git@https://github.com/igpp-ucla/fflib.git",
     install_requires=['numpy>=1.15.0'],
+    extras_require={'pandas':['pandas'], 'xarray':['xarray'], 
+        'arrow':['pyarrow']},
     packages=['fflib'],
     python_requires='>=3.6',
     include_package_data=True,
@@ -18,6 +20,12 @@ setuptools.setup(
 		'console_scripts': [
 			'fflist=fflib.ff_util:fflist',
 			'ff2csv=fflib.ff_util:ff2csv',
+			'ff2npz=fflib.ff_util:ff2npz',
+			'ffstats=fflib.ff_util:ffstats',
+			'ffverify=fflib.ff_util:ffverify',
+			'ffedit=fflib.ff_util:ffedit',
+			'ffslice=fflib.ff_util:ffslice',
+			'ffcat=fflib.ff_util:ffcat',
 		],
 	},
 )
\ No newline at end of file
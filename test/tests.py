@@ -5,7 +5,16 @@ from datetime import date, datetime, timedelta
 from FF_Time import FFTIME
 import spiceypy as spice
 import numpy as np
-from fflib.leap_table import leap_table
+from fflib.leap_table import leap_table, leap_seconds
+from fflib.ff_lib import ff_header
+from fflib.ff_pool import ff_reader_pool
+from fflib.ff_shared import ff_shared_cache
+from fflib.ff_query import ff_query, query
+from fflib.ff_pipeline import ff_pipeline
+from fflib import ff_reader, ff_writer, ff_resample, ff_compress, ff_decompress, ff_extract, ff_concat
+import tempfile
+import os
+import time
 leap_dates = leap_table()['date']
 np.set_printoptions(formatter={'float':str})
 spice.furnsh('latest_leapseconds.tls')
@@ -225,9 +234,80 @@ def leapless_epoch_tests():
             ticks = dates_to_ticks([other_date, leap_date], epoch)
             assert(np.array_equal(ticks, [other_diff, diff]))
 
+def leap_seconds_tests():
+    ''' Check UTC/TAI conversions around each leap second '''
+    leaps = leap_seconds()
+    for utc, offset in zip(leaps.utc[1:], leaps.offsets[1:]):
+        tai = utc + offset
+        assert(np.array_equal(leaps.utc_to_tai([utc-1, utc]), [tai-2, tai]))
+        assert(np.array_equal(leaps.tai_to_utc([tai-2, tai-1, tai]), [utc-1, utc-1, utc]))
+        assert(list(leaps.is_leap([tai-2, tai-1, tai-0.5, tai])) == [False, True, True, False])
+
+        # Offsets of nanoseconds relative to another origin
+        ns = (np.array([tai-2, tai-1, tai]) - 1000) * ff_time.ns_per_sec
+        assert(list(leaps.tai_offsets(ns, 1000, ff_time.ns_per_sec)) == [offset-1, offset, offset])
+        ns = (np.array([utc-1, utc]) - 1000) * ff_time.ns_per_sec
+        assert(list(leaps.utc_offsets(ns, 1000, ff_time.ns_per_sec)) == [offset-1, offset])
+    assert(leaps.utc_offsets(leaps.utc[0] - 1, before=-1) == -1)
+    assert(not leaps.reload())
+
+def convert_ticks_tests():
+    ''' Check that converting ticks between epochs matches converting
+        them through datetimes, including ticks around each leap second
+    '''
+    leaps = leap_seconds()
+    utc = np.concatenate([leaps.utc[1:] + d for d in [-1.5, -0.25, 0, 0.5, 3600]])
+    utc = np.sort(np.concatenate([utc, np.linspace(leaps.utc[1], leaps.utc[-1] + 1e8, 1000)]))
+    for from_epoch in epochs:
+        ticks = utc - ff_time.epoch_to_posix[from_epoch]
+        dates = ff_time.ticks_to_dates(ticks, from_epoch)
+        for to_epoch in epochs:
+            if to_epoch == from_epoch:
+                assert(np.array_equal(ff_time.convert_ticks(ticks, from_epoch, to_epoch), ticks))
+                continue
+            expected = ff_time.dates_to_ticks(dates, to_epoch)
+            if from_epoch in ff_time.leap_epochs and to_epoch in ff_time.leap_epochs:
+                # Leap seconds themselves are kept, which datetimes cannot hold
+                shift = ff_time.epoch_to_posix[from_epoch] - ff_time.epoch_to_posix[to_epoch]
+                expected = ticks + shift
+            result = ff_time.convert_ticks(ticks, from_epoch, to_epoch)
+            assert(np.max(np.abs(result - expected)) < 1e-6)
+
+def ns_tests():
+    ''' Check that nanosecond conversions are exact and agree with the
+        float tick conversions
+    '''
+    leaps = leap_seconds()
+    utc = np.concatenate([leaps.utc[1:] + d for d in [-1.5, -0.25, 0, 0.5, 3600]])
+    ns = np.sort(utc) * ff_time.ns_per_sec + 123456789
+    for epoch in epochs:
+        epoch_ns = ns - ff_time.epoch_to_posix[epoch] * ff_time.ns_per_sec
+        ticks = ff_time.ns_to_ticks(epoch_ns)
+        assert(np.array_equal(ff_time.ticks_to_ns(ticks) // 1000, epoch_ns // 1000))
+
+        dates = ff_time.ns_to_dates(epoch_ns, epoch)
+        expected = ff_time.ticks_to_dates(ticks, epoch)
+        assert(max([abs((a - b).total_seconds()) for a, b in zip(dates, expected)]) <= 1e-6)
+
+        for to_epoch in epochs:
+            result = ff_time.convert_ns(epoch_ns, epoch, to_epoch)
+            back = ff_time.convert_ns(result, to_epoch, epoch)
+            assert(np.array_equal(result % 1000, epoch_ns % 1000))
+            if epoch not in ff_time.leap_epochs or to_epoch in ff_time.leap_epochs:
+                assert(np.array_equal(back, epoch_ns))
+
+    # Dates round trip exactly through nanoseconds
+    dates = [datetime(2016, 12, 31, 23, 59, 59, 999999), datetime(2017, 1, 1, 0, 0, 0, 1)]
+    ns = ff_time.dates_to_ns(dates, 'J2000')
+    assert(ns[1] - ns[0] == ff_time.ns_per_sec + 2000) # Leap second between
+    assert(ff_time.ns_to_dates(ns, 'J2000') == dates)
+
 def leap_tests():
     edge_leap_date_tests()
     edge_leap_tick_tests()
+    leap_seconds_tests()
+    convert_ticks_tests()
+    ns_tests()
 
 def epoch_tests():
     ''' Check that epoch date = 0 tick relative to epoch '''
@@ -287,9 +367,760 @@ def reversal_tests():
         assert ((d == rd))
         assert ((rd == rrd))
 
+def write_test_file(name, n=1000, epoch='J2000'):
+    ''' Writes a flat file w/ irregular times and random data '''
+    rng = np.random.default_rng(1)
+    times = np.cumsum(rng.uniform(0.5, 1.5, n)) + 6e8
+    data = rng.normal(size=(n, 3))
+    ff = ff_writer(name)
+    ff.set_data(times, data, epoch)
+    ff.set_labels(['Bx', 'By', 'Bz'])
+    ff.write()
+    return ff_reader(name)
+
+def resample_tests():
+    ''' Check that streamed resampling is independent of chunk size '''
+    with tempfile.TemporaryDirectory() as tmp:
+        ff = write_test_file(os.path.join(tmp, 'test'))
+        times, data = ff.get_times(), ff.get_data()
+        for method in ['linear', 'nearest', 'boxcar']:
+            small = ff_resample(ff, 1.0, method, chunk_size=17)
+            large = ff_resample(ff, 1.0, method)
+            assert(np.array_equal(small[0], large[0]))
+            assert(np.array_equal(small[1], large[1]))
+
+        grid, values = ff_resample(ff, 1.0, 'linear', chunk_size=17)
+        assert(np.allclose(values[:,0], np.interp(grid, times, data[:,0])))
+
+        # Write result to a file
+        name = os.path.join(tmp, 'resampled')
+        ff_resample(ff, 1.0, 'linear', name=name, chunk_size=17)
+        assert(np.allclose(ff_reader(name).get_data(), values))
+
+        # Errors and empty grids leave no file behind
+        iter_rows = ff._iter_rows
+        def failing_rows(*args):
+            rows = iter_rows(*args)
+            yield next(rows)
+            raise ValueError('read failed')
+        ff._iter_rows = failing_rows
+        try:
+            ff_resample(ff, 1.0, 'linear', name=name + 'fail', chunk_size=17)
+            assert(False)
+        except ValueError as e:
+            assert(str(e) == 'read failed')
+        ff._iter_rows = iter_rows
+        try:
+            ff_resample(ff, 1.0, 'linear', times[10], times[5], name=name + 'empty')
+            assert(False)
+        except Exception as e:
+            assert('No records' in str(e))
+        try:
+            with ff_writer(name + 'with') as out:
+                out.set_labels(['Bx', 'By', 'Bz'])
+                out.append(times[:10], data[:10])
+                raise ValueError('write failed')
+        except ValueError:
+            pass
+        assert(sorted(os.listdir(tmp)) == ['resampled.ffd', 'resampled.ffh', 
+            'test.ffd', 'test.ffh'])
+
+def gap_tests():
+    ''' Check gap, duplicate and non-monotonic time detection '''
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        times = np.arange(100) + 6e8
+        times = np.delete(times, [50, 51])
+        times[10] = times[9]
+        times[20] = times[19] - 0.5
+        ff = ff_writer(name)
+        ff.set_data(times, np.zeros((len(times), 1)), 'J2000')
+        ff.set_labels(['Bx'])
+        ff.write()
+
+        info = ff_reader(name).scan_gaps(chunk_size=16)
+        assert(info['cadence'] == 1.0)
+        assert((times[49], times[50]) in info['gaps'])
+        assert(list(info['duplicates']) == [10])
+        assert(list(info['non_monotonic']) == [20])
+
+def stats_tests():
+    ''' Check streamed statistics against numpy '''
+    with tempfile.TemporaryDirectory() as tmp:
+        ff = write_test_file(os.path.join(tmp, 'test'))
+        data = ff.get_data()
+        stats = ff.stats(chunk_size=64)
+        for i, label in enumerate(['Bx', 'By', 'Bz']):
+            assert(stats[label]['count'] == len(data))
+            assert(stats[label]['min'] == data[:,i].min())
+            assert(stats[label]['max'] == data[:,i].max())
+            assert(np.isclose(stats[label]['mean'], data[:,i].mean()))
+            assert(np.isclose(stats[label]['std'], data[:,i].std()))
+
+def compress_tests():
+    ''' Check that compressed files read the same and round-trip to .ffd '''
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        ff = write_test_file(name)
+        for method in ['zlib', 'lzma']:
+            ff_compress(name, name + method, method, block_records=64)
+            ffz = ff_reader(name + method)
+            assert(ffz.compressed)
+            assert(np.array_equal(ffz.get_data(True), ff.get_data(True)))
+
+            t0, t1 = ff.get_times()[[100, 300]]
+            for a, b in zip(ffz.read_range(t0, t1), ff.read_range(t0, t1)):
+                assert(np.array_equal(a, b))
+
+            ff_decompress(name + method, name + 'out')
+            with open(name + '.ffd', 'rb') as fd, open(name + 'out.ffd', 'rb') as out:
+                assert(fd.read() == out.read())
+
+        # Compressed files are recompressed from their records
+        ff_compress(name + 'zlib', name + 're', 'lzma', block_records=100)
+        assert(np.array_equal(ff_reader(name + 're').get_data(True), ff.get_data(True)))
+        try:
+            ff_compress(name + 'zlib', method='lzma')
+            assert(False)
+        except Exception as e:
+            assert('in place' in str(e))
+
+        # Compressing in place replaces the .ffd file
+        ff_compress(name + 'out')
+        assert(not os.path.exists(name + 'out.ffd'))
+        ffz = ff_reader(name + 'out')
+        assert(ffz.compressed and ffz.header.get_value('COMPRESSION') == 'zlib')
+        assert(np.array_equal(ffz.get_data(True), ff.get_data(True)))
+
+def checksum_tests():
+    ''' Check that verify() detects a corrupted byte '''
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        ff = write_test_file(name)
+        out = ff_writer(name + 'crc', copy_header=name)
+        out.set_data(ff.get_times(), ff.get_data())
+        out.set_checksums(block_size=1024)
+        out.write()
+        assert(ff_reader(name + 'crc').verify() == [])
+
+        with open(name + 'crc.ffd', 'r+b') as fd:
+            fd.seek(5000)
+            byte = fd.read(1)
+            fd.seek(5000)
+            fd.write(bytes([byte[0] ^ 1]))
+        assert(ff_reader(name + 'crc').verify() == ['Checksum mismatch in bytes 4096 to 5120'])
+
+def column_type_tests():
+    ''' Check that each column type round-trips with the right layout '''
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'types')
+        times = np.arange(10) + 6e8
+        data = np.column_stack([np.arange(10) + 2**30, np.pi * np.arange(10), 
+            np.full(10, 0.1)])
+        ff = ff_writer(name)
+        ff.set_labels(['N', 'D', 'R'])
+        ff.set_types(['I', 'D', 'R'])
+        ff.set_data(times, data, 'J2000')
+        ff.write()
+
+        ff = ff_reader(name)
+        assert(list(ff.header.get_locations()) == [0, 8, 12, 20])
+        assert(os.path.getsize(name + '.ffd') == 10 * 24)
+        values = ff.get_data()
+        assert(np.array_equal(values[:,:2], data[:,:2]))
+        assert(np.all(values[:,2] == np.float32(0.1)))
+
+        # Tables keep each column's type in native byte order, whether read
+        # from the data file or from the loaded data
+        for ff in [ff_reader(name), ff]:
+            table = ff.get_data_table()
+            assert([table.dtype[i] for i in range(4)] == [np.dtype(t) for t in ['f8', 'i4', 'f8', 'f4']])
+            assert(np.array_equal(table['N'], data[:,0]) and np.array_equal(table['SCET'], times))
+
+        table = ff_reader(name).get_data_table('datetimes')
+        dates = ff_time.ticks_to_dates(times, 'J2000')
+        assert(list(table['SCET'].astype('datetime64[us]').tolist()) == dates)
+        assert(np.array_equal(table['D'], data[:,1]))
+
+        # Integer columns only accept values that fit exactly
+        for bad in [1.5, np.nan, 1e34, 2**31, -2**31 - 1]:
+            ff = ff_writer(name + 'bad')
+            ff.set_labels(['N'])
+            ff.set_types(['I'])
+            ff.set_data(times[:2], [[-2**31], [bad]], 'J2000')
+            try:
+                ff.write()
+                assert(False)
+            except Exception as e:
+                assert('not a 32-bit integer' in str(e))
+
+        # Extracted columns of an unknown type keep their width
+        ff = ff_writer(name + 'x')
+        ff.set_labels(['N', 'X'])
+        ff.set_types(['I', 'D'])
+        ff.set_data(times, data[:,:2], 'J2000')
+        ff.header.col_table['TYPE'][2] = 'X'
+        ff.write()
+        ff_extract(name + 'x', name + 'xcols', columns=['X', 'N'])
+        out = ff_reader(name + 'xcols')
+        assert(list(out.header.col_table['TYPE']) == ['T', 'D', 'I'])
+        assert(np.array_equal(out.get_data(), data[:,[1,0]]))
+
+        # So do those written by a pipeline, while integers become floats
+        # once transformed and new columns are described as floats
+        ff_pipeline(name + 'x').to_ff(name + 'xpipe')
+        out = ff_reader(name + 'xpipe')
+        assert(list(out.header.col_table['TYPE']) == ['T', 'I', 'D'])
+        assert(np.array_equal(out.get_data(), data[:,:2]))
+        ff_pipeline(name + 'x').apply(lambda t, d : d.sum(axis=1)[:,None] / 2, 
+            ['Sum']).to_ff(name + 'xsum')
+        out = ff_reader(name + 'xsum')
+        assert(list(out.header.col_table['TYPE']) == ['T', 'D'])
+        assert(list(out.get_labels()) == ['SCET', 'Sum'] and out.get_units()[1] == '')
+        ff_pipeline(name + 'x').apply(lambda t, d : d).to_ff(name + 'xsame')
+        assert(list(ff_reader(name + 'xsame').header.col_table['TYPE']) == ['T', 'D', 'D'])
+
+def profile_tests():
+    ''' Check the operations reported to a profiler for a write, a read
+        and a time conversion
+    '''
+    import fflib
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        calls = []
+        fflib.set_profiler(lambda op, fname, seconds, nbytes : calls.append((op, fname, nbytes)))
+        try:
+            times = write_test_file(name).get_times()
+            assert(('data write', name, 20000) in calls)
+            assert(('header write', name) in [call[:2] for call in calls])
+
+            calls.clear()
+            ff_reader(name).get_data()
+            assert(('data read', name, 20000) in calls)
+            assert(('endian conversion', name, 20000) in calls)
+
+            calls.clear()
+            ff_time.convert_ticks(times, 'J2000', 'Y2000')
+            assert(calls[-1] == ('time conversion', None, 8000))
+
+            # Errors raised by the profiler are not mistaken for I/O errors
+            def fail(*args):
+                raise ValueError('profiler failed')
+            ff = ff_reader(name)
+            fflib.set_profiler(fail)
+            try:
+                ff.get_data()
+                assert(False)
+            except ValueError:
+                pass
+        finally:
+            fflib.set_profiler(None)
+
+def table_tests():
+    ''' Check ff_table slices, time slices, eviction and read-only caching '''
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        ff = write_test_file(name)
+        data = ff.get_data()
+        times = ff.get_times()
+        ff_compress(name, name + 'z', block_records=100)
+
+        for fname in [name, name + 'z']:
+            table = ff_reader(fname).get_table(cache_size=2)
+            assert(len(table) == len(times))
+            assert(table.get_labels() == ['SCET', 'Bx', 'By', 'Bz'])
+            assert(np.array_equal(table['Bx'][10:20], data[10:20,0]))
+            assert(table['By'][5] == data[5,1])
+            records = table[100:110]
+            assert(records.dtype.isnative and np.array_equal(records['Bz'], data[100:110,2]))
+            assert(table[-1]['SCET'] == times[-1])
+            assert(np.array_equal(np.asarray(table['Bz']), data[:,2]))
+
+            # Time slices include both ends
+            t0, t1 = times[[200, 250]]
+            assert(np.array_equal(table.loc[t0:t1]['SCET'], times[200:251]))
+            assert(np.array_equal(table.loc[t0:t1, 'By'], data[200:251,1]))
+            assert(len(table.loc[times[-1]+1:]) == 0)
+
+            # Repeated slices come from the cache until they are evicted
+            assert(table['Bx'][0:3] is table['Bx'][0:3])
+            first = table['Bx'][0:3]
+            table['Bx'][3:6]
+            table['Bx'][6:9]
+            assert(len(table._cache) == 2 and table['Bx'][0:3] is not first)
+
+            # Cached slices can't be modified
+            values = table['Bx'][0:3]
+            try:
+                values[0] = 999
+                assert(False)
+            except ValueError:
+                pass
+            assert(np.array_equal(table['Bx'][0:3], data[0:3,0]))
+            table.clear_cache()
+            assert(len(table._cache) == 0)
+
+def dataframe_tests():
+    ''' Check DataFrame/Dataset exports if pandas/xarray are installed '''
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        ff = write_test_file(name)
+        times, data = ff.get_times(), ff.get_data()
+        try:
+            import pandas
+        except ImportError:
+            return
+
+        frame = ff.to_dataframe()
+        assert(list(frame.columns) == ['Bx', 'By', 'Bz'])
+        assert(np.array_equal(frame['By'].to_numpy(), data[:,1]))
+        dates = ff_time.ticks_to_dates(times, 'J2000')
+        diffs = frame.index.to_numpy() - np.array(dates, dtype='datetime64[ns]')
+        assert(np.max(np.abs(diffs)) <= np.timedelta64(1, 'us'))
+        assert(frame.attrs['epoch'] == 'J2000')
+
+        frame = ff.to_dataframe(['Bz'], times[10], times[19], time_index='ticks')
+        assert(np.array_equal(frame.index, times[10:20]))
+        assert(np.array_equal(frame['Bz'], data[10:20,2]))
+
+        try:
+            import xarray
+        except ImportError:
+            return
+
+        dataset = ff.to_xarray(['Bx'], times[10], times[19], time_index='ticks')
+        assert(np.array_equal(dataset['Bx'].values, data[10:20,0]))
+        assert(np.array_equal(dataset['SCET'].values, times[10:20]))
+        assert(dataset['Bx'].attrs['units'] == frame.attrs['units']['Bz'])
+
+def export_tests():
+    ''' Check that .npz (and Arrow if installed) exports match the data '''
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        ff = write_test_file(name)
+        times, data = ff.get_times(), ff.get_data()
+        utc = ff_time.ns_to_datetime64(ff_time.ticks_to_ns(times), 'J2000')
+
+        ff.to_npz(chunk_size=300)
+        ff.to_npz(name + 'z', True, ['By'], times[100], times[199])
+        with np.load(name + '.npz') as arrays:
+            assert(arrays.files == ['SCET', 'Bx', 'By', 'Bz'])
+            assert(np.array_equal(arrays['SCET'], utc))
+            assert(np.array_equal(arrays['Bz'], data[:,2].astype('f4')))
+        with np.load(name + 'z.npz') as arrays:
+            assert(np.array_equal(arrays['By'], data[100:200,1].astype('f4')))
+
+        try:
+            import pyarrow.feather
+        except ImportError:
+            return
+
+        ff.to_arrow(name, 'zstd', chunk_size=300)
+        table = pyarrow.feather.read_table(name + '.arrow')
+        assert(np.array_equal(table['SCET'].to_numpy(), utc))
+        assert(np.array_equal(table['Bx'].to_numpy(), data[:,0].astype('f4')))
+        assert(table.schema.metadata[b'epoch'] == b'J2000')
+
+def pool_tests():
+    ''' Check that open readers and pooled readers read the same data
+        and that the pool replaces changed files and closes old readers
+    '''
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        ff = write_test_file(name)
+        times = ff.get_times()
+        expected = ff.read_range(times[10], times[20])
+        ff_compress(name, name + 'z', block_records=100)
+
+        for fname in [name, name + 'z']:
+            with ff_reader(fname) as ff:
+                assert(ff.is_open())
+                for i in range(2):
+                    result = ff.read_range(times[10], times[20])
+                    assert(np.array_equal(result[1], expected[1]))
+                assert(ff.get_tick_range() == (times[0], times[-1]))
+                assert(np.array_equal(ff.get_data()[:,0], ff_reader(name).get_data()[:,0]))
+            assert(not ff.is_open())
+
+        pool = ff_reader_pool(max_open=1)
+        ff = pool.get(name)
+        assert(pool.get(name) is ff and ff.is_open())
+        other = pool.get(name + 'z')
+        assert(len(pool) == 1 and not ff.is_open() and other.is_open())
+
+        # Rewritten files are reopened
+        write_test_file(name, n=500)
+        ff = pool.get(name)
+        assert(len(ff.get_times()) == 500 and pool.get(name) is ff)
+        pool.clear()
+        assert(len(pool) == 0 and not ff.is_open())
+
+def thread_safe_tests():
+    ''' Check that threads sharing a thread-safe reader load its data
+        once and read ranges correctly
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        expected = write_test_file(name).get_data()
+        ff = ff_reader(name, thread_safe=True)
+        assert(ff.is_open())
+
+        loads = []
+        read_data = ff._read_data
+        def counted_read():
+            loads.append(1)
+            time.sleep(0.01)
+            return read_data()
+        ff._read_data = counted_read
+
+        times = ff_reader(name).get_times()
+        def read(i):
+            result = ff.read_range(times[i], times[i+9])[1]
+            return np.array_equal(result, expected[i:i+10]) and ff.get_data(True) is ff.data
+
+        with ThreadPoolExecutor(8) as pool:
+            assert(all(pool.map(read, range(0, 900, 10))))
+        assert(len(loads) == 1)
+
+def shared_cache_tests():
+    ''' Check that processes read the same data from a shared cache and
+        that old versions and least recently used files are removed
+    '''
+    import multiprocessing
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        expected = write_test_file(name).get_data()
+        cache = ff_shared_cache(max_bytes=40000, registry=os.path.join(tmp, 'cache.json'))
+        try:
+            data = ff_reader(name, shared_cache=cache).get_data()
+            assert(np.array_equal(data, expected) and not data.flags.writeable)
+            assert(cache.nbytes() > data.nbytes)
+
+            # A worker process attaches to the same segment
+            def worker(queue):
+                data = ff_reader(name, shared_cache=cache).get_data()
+                queue.put(np.array_equal(data, expected))
+            context = multiprocessing.get_context('fork')
+            queue = context.Queue()
+            process = context.Process(target=worker, args=(queue,))
+            process.start()
+            assert(queue.get(timeout=60))
+            process.join()
+
+            # Rewritten files replace their segment; Arrays read earlier
+            # stay valid after their segment is removed
+            size = cache.nbytes()
+            expected2 = write_test_file(name, n=500).get_data()
+            time.sleep(0.01)
+            assert(np.array_equal(ff_reader(name, shared_cache=cache).get_data(), expected2))
+            assert(cache.nbytes() < size and np.array_equal(data, expected))
+
+            # Files that do not fit evict the least recently used ones
+            other = os.path.join(tmp, 'other')
+            write_test_file(other, n=1000)
+            ff_reader(other, shared_cache=cache).get_data()
+            assert(cache.nbytes() == size)
+
+            # A failed decode removes its segment instead of leaving one
+            # that other readers wait on
+            cache.timeout = 1
+            reader = ff_reader(name, shared_cache=cache)
+            def fail():
+                raise OSError('read failed')
+            reader._memmap_records = fail
+            try:
+                reader.get_data()
+                assert(False)
+            except OSError:
+                pass
+            start = time.monotonic()
+            assert(np.array_equal(ff_reader(name, shared_cache=cache).get_data(), expected2))
+            assert(time.monotonic() - start < 1)
+
+            # Segments never marked ready (e.g. their creator was killed)
+            # are rebuilt once the timeout passes
+            cache.clear()
+            cache.timeout = 0.1
+            reader = ff_reader(name, shared_cache=cache)
+            from fflib import ff_shared
+            stale = ff_shared._shared_memory(ff_shared._segment_name(cache._key(reader)), True, 128)
+            assert(np.array_equal(reader.get_data(), expected2))
+            stale.close()
+        finally:
+            cache.clear()
+        assert(cache.nbytes() == 0)
+
+def async_tests():
+    ''' Check that the async reader returns the same records as ff_reader '''
+    import asyncio
+    from fflib.ff_async import ff_async_reader
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        ff = write_test_file(name)
+        times = ff.get_times()
+        expected = ff.read_range(times[10], times[500], ['Bz'])
+
+        async def run():
+            reader = await ff_async_reader.open(name, max_concurrency=2)
+            result = await reader.read_range(times[10], times[500], ['Bz'])
+            assert(np.array_equal(result[0], expected[0]) and np.array_equal(result[1], expected[1]))
+
+            chunks = [chunk async for chunk in reader.iter_chunks(100, times[10], times[500], ['Bz'])]
+            assert(len(chunks) == 5)
+            assert(np.array_equal(np.concatenate([data for t, data in chunks]), expected[1]))
+
+            data = await asyncio.gather(*[reader.get_data(True) for i in range(4)])
+            assert(all([d is data[0] for d in data]) and np.array_equal(data[0][:,0], times))
+            reader.close()
+
+        asyncio.run(run())
+
+        # Plain readers aren't safe to share between executor threads
+        try:
+            ff_async_reader(ff_reader(name))
+            assert(False)
+        except Exception as e:
+            assert('thread_safe' in str(e))
+
+def header_update_tests():
+    ''' Check that header updates do not touch the data file '''
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        write_test_file(name)
+        with open(name + '.ffh', 'r') as fd:
+            header = fd.read()
+        stat = os.stat(name + '.ffd')
+
+        ff_header.update_in_place(name)
+        with open(name + '.ffh', 'r') as fd:
+            assert(fd.read() == header)
+
+        ff_header.update_in_place(name, columns={'Bz':'BZ'}, units={'Bx':'nT'},
+            error_flag=-1e31, mission='TEST')
+        ff = ff_reader(name)
+        assert(list(ff.get_labels()) == ['SCET', 'Bx', 'By', 'BZ'])
+        assert(ff.get_units()[1] == 'nT')
+        assert(float(ff.get_error_flag()) == -1e31)
+        assert(ff.header.get_value('MISSION') == 'TEST')
+        assert(os.stat(name + '.ffd').st_mtime_ns == stat.st_mtime_ns)
+        assert(sorted(os.listdir(tmp)) == ['test.ffd', 'test.ffh'])
+
+        # Keywords describing the data file are protected
+        ff = ff_reader(name)
+        out = ff_writer(name + 'z')
+        out.set_data(ff.get_times(), ff.get_data(), ff.get_epoch())
+        out.set_labels(['Bx', 'By', 'Bz'])
+        out.set_compression('zlib', block_records=100)
+        out.set_checksums(block_size=1024)
+        out.write()
+        with open(name + 'z.ffh', 'r') as fd:
+            header = fd.read()
+        for key in ['nrows', 'compression', 'block_records', 'checksum',
+            'checksum_block', 'data_crc']:
+            try:
+                ff_header.update_in_place(name + 'z', **{key:'1'})
+                assert(False)
+            except Exception as e:
+                assert('cannot be changed' in str(e))
+        with open(name + 'z.ffh', 'r') as fd:
+            assert(fd.read() == header)
+        assert(ff_reader(name + 'z').verify() == [])
+
+def extract_tests():
+    ''' Check extracted time ranges and columns against read_range '''
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        ff = write_test_file(name)
+        t0, t1 = ff.get_times()[[100, 300]]
+        times, data = ff.read_range(t0, t1)
+
+        assert(ff_extract(ff, name + 'range', t0, t1) == len(times))
+        out = ff_reader(name + 'range')
+        assert(out.shape() == (len(times), 4))
+        assert(out.get_tick_range() == (t0, t1))
+        assert(np.array_equal(out.get_data(), data))
+
+        ff_extract(ff, name + 'cols', t0, t1, columns=['Bz', 'Bx'])
+        out = ff_reader(name + 'cols')
+        assert(list(out.get_labels()) == ['SCET', 'Bz', 'Bx'])
+        assert(np.array_equal(out.get_data(), data[:,[2,0]]))
+
+        # The source file and the time column can't be used
+        for dst, columns in [(name, None), (name + 'time', ['SCET', 'Bx'])]:
+            try:
+                ff_extract(ff, dst, t0, t1, columns=columns)
+                assert(False)
+            except Exception as e:
+                assert('cannot be' in str(e))
+        assert(os.path.getsize(name + '.ffd') == len(ff.get_times()) * ff._record_length())
+        assert(not os.path.exists(name + 'time.ffh'))
+
+def concat_tests():
+    ''' Check that concatenating extracted pieces restores the file '''
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        ff = write_test_file(name)
+        times = ff.get_times()
+        ff_extract(ff, name + '1', None, times[399])
+        ff_extract(ff, name + '2', times[400], None)
+
+        assert(ff_concat([name + '2', name + '1'], name + 'cat') == len(times))
+        with open(name + '.ffd', 'rb') as fd, open(name + 'cat.ffd', 'rb') as out:
+            assert(fd.read() == out.read())
+
+        # Decoded when epochs differ
+        ff = ff_reader(name + '2')
+        dates = ff_time.ticks_to_dates(ff.get_times(), 'J2000')
+        out = ff_writer(name + '2y', copy_header=name + '2')
+        out.set_data(ff_time.dates_to_ticks(dates, 'Y2000'), ff.get_data(), 'Y2000')
+        out.write()
+        ff_concat([name + '1', name + '2y'], name + 'mixed')
+        mixed = ff_reader(name + 'mixed')
+        assert(mixed.get_epoch() == 'J2000')
+        assert(np.max(np.abs(ff.get_times(epoch='Y2000') - ff_reader(name + '2y').get_times())) < 1e-6)
+        ns = ff_time.ticks_to_ns(ff.get_times())
+        assert(np.array_equal(ff.get_times('ns', 'Y2000'), ff_time.convert_ns(ns, 'J2000', 'Y2000')))
+        assert(np.max(np.abs(mixed.get_times() - times)) < 1e-6)
+        assert(np.array_equal(mixed.get_data(), ff_reader(name).get_data()))
+
+        # Failed decodes leave no output behind
+        def write_part(part, t0, labels, types, values):
+            out = ff_writer(os.path.join(tmp, part))
+            out.set_data(np.arange(10.0) + t0, np.full((10, 2), values), 'J2000')
+            out.set_labels(labels)
+            out.set_types(types)
+            out.write()
+            return os.path.join(tmp, part)
+        a = write_part('a', 0, ['Bx', 'By'], ['D', 'I'], 1)
+        b = write_part('b', 100, ['Bx', 'Bz'], ['D', 'D'], 1)
+        c = write_part('c', 200, ['Bx', 'By'], ['D', 'D'], 0.5)
+        for inputs, message in [([a, b], 'do not match'), ([a, c], 'not a 32-bit integer')]:
+            try:
+                ff_concat(inputs, os.path.join(tmp, 'out'))
+                assert(False)
+            except Exception as e:
+                assert(message in str(e))
+            assert(not any(f.startswith('out') for f in os.listdir(tmp)))
+
+def pipeline_tests():
+    ''' Check pipeline steps against the same transforms on the full data '''
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        ff = write_test_file(name)
+        times = ff.get_times()
+        t0, t1 = times[[100, 900]]
+        expected = ff.read_range(t0, t1, ['Bz', 'Bx'])
+
+        matrix = np.array([[0, 1], [-1, 0]])
+        calibrate = lambda times, data : data @ matrix.T + 1
+        pipeline = ff_pipeline(name, chunk_size=64).select(['Bz', 'Bx']).window(t0, t1)
+        rows = pipeline.apply(calibrate).to_ff(name + 'cal')
+        out = ff_reader(name + 'cal')
+        assert(rows == len(expected[0]) and list(out.get_labels()) == ['SCET', 'Bz', 'Bx'])
+        assert(np.array_equal(out.get_times(), expected[0]))
+        assert(np.allclose(out.get_data(), calibrate(*expected), atol=1e-5))
+
+        # Steps after apply work on its labels
+        norm = lambda times, data : np.sqrt(np.sum(data**2, axis=1))[:,None]
+        result = ff_pipeline(name, chunk_size=100).apply(norm, ['Bt']).read()
+        assert(np.allclose(result[1][:,0], np.linalg.norm(ff.get_data(), axis=1)))
+        result = ff_pipeline(name, chunk_size=100).apply(lambda t, d : d * 2).select(['By']).read()
+        assert(np.array_equal(result[1][:,0], ff.get_data()[:,1] * 2))
+
+        # Resampling in a pipeline matches ff_resample
+        result = ff_pipeline(name, chunk_size=100).resample(2.0, 'boxcar').read()
+        expected = ff_resample(name, 2.0, 'boxcar', chunk_size=100)
+        assert(np.array_equal(result[0], expected[0]) and np.array_equal(result[1], expected[1]))
+
+        # Errors raised while reading reach the caller
+        try:
+            ff_pipeline(name).apply(lambda t, d : d[:,:1]).read()
+            assert(False)
+        except Exception as e:
+            assert('apply function' in str(e))
+
+        # Errors raised by the prefetch thread reach the caller and no
+        # partial output file is left behind
+        pipeline = ff_pipeline(name, chunk_size=100, prefetch=1)
+        iter_rows = pipeline.reader._iter_rows
+        def failing_rows(*args):
+            rows = iter_rows(*args)
+            yield next(rows)
+            yield next(rows)
+            raise ValueError('read failed')
+        pipeline.reader._iter_rows = failing_rows
+        try:
+            pipeline.to_ff(name + 'fail')
+            assert(False)
+        except ValueError as e:
+            assert(str(e) == 'read failed')
+        assert(not any(f.startswith('testfail') for f in os.listdir(tmp)))
+
+        try:
+            ff_pipeline(name).window(0, 1).to_ff(name + 'empty')
+            assert(False)
+        except Exception as e:
+            assert('No records' in str(e))
+        assert(not any(f.startswith('testempty') for f in os.listdir(tmp)))
+
+def query_tests():
+    ''' Check queries across files w/ different epochs and formats
+        against read_range on the original file
+    '''
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'test')
+        ff = write_test_file(name)
+        times = ff.get_times()
+        parts = os.path.join(tmp, 'parts')
+        os.mkdir(parts)
+        ff_extract(ff, os.path.join(parts, 'c'), times[700], None)
+        ff_extract(ff, os.path.join(parts, 'b'), times[300], times[699])
+        ff_compress(os.path.join(parts, 'b'))
+        a = ff_reader(name).read_range(None, times[299])
+        out = ff_writer(os.path.join(parts, 'a'), copy_header=name)
+        out.set_data(ff_time.convert_ticks(a[0], 'J2000', 'Y1970'), a[1], 'Y1970')
+        out.write()
+
+        t0, t1 = times[[250, 800]]
+        expected = ff.read_range(t0, t1, ['Bz', 'Bx'])
+        result = query(parts, t0, t1, ['Bz', 'Bx'], 'J2000')
+        assert(np.max(np.abs(result[0] - expected[0])) < 1e-6)
+        assert(np.array_equal(result[1], expected[1]))
+
+        chunks = list(query(os.path.join(parts, '*.ffh'), t0, t1, ['Bz', 'Bx'], 'J2000', chunk_size=64))
+        assert(max([len(times) for times, data in chunks]) == 64)
+        assert(np.array_equal(np.concatenate([data for times, data in chunks]), expected[1]))
+
+        # Files outside the window are pruned
+        with ff_query(parts, times[750], times[760], epoch_out='J2000') as plan:
+            assert(len(plan.spans) == 1 and plan.num_records() == 11)
+        assert(len(query(parts, 0, 1)[0]) == 0)
+        y1970 = ff_time.convert_ticks(times[[0, 299]], 'J2000', 'Y1970')
+        assert(np.array_equal(query(parts, *y1970, epoch_out='Y1970')[1], a[1]))
+
 epoch_tests()
 specific_tests()
 direct_leapless_tests()
 leapless()
 leap_tests()
+resample_tests()
+gap_tests()
+stats_tests()
+compress_tests()
+checksum_tests()
+column_type_tests()
+header_update_tests()
+profile_tests()
+table_tests()
+dataframe_tests()
+export_tests()
+pool_tests()
+thread_safe_tests()
+async_tests()
+shared_cache_tests()
+extract_tests()
+concat_tests()
+query_tests()
+pipeline_tests()
 print ('All tests passed')
\ No newline at end of file